@@ -0,0 +1,111 @@
+import logging
+import argparse
+import json
+import time
+import resource
+import multiprocessing
+
+import torch
+
+
+def run_trial(trial):
+    # runs in a fresh process, so peak RSS (on cpu) is for this trial only
+    from zoobot.shared import label_metadata, schemas
+    from zoobot.pytorch.estimators import define_model
+
+    architecture_name, resize_size, batch_size, checkpoint_stages, steps, device = trial
+    device = torch.device(device)
+    schema = schemas.Schema(label_metadata.decals_dr5_ortho_pairs, label_metadata.decals_ortho_dependencies)
+    get_architecture, representation_dim = define_model.select_base_architecture_func_from_name(architecture_name)
+    model = define_model.get_plain_pytorch_zoobot_model(
+        output_dim=len(schema.label_cols),
+        channels=1,
+        get_architecture=get_architecture,
+        representation_dim=representation_dim,
+        checkpoint_stages=checkpoint_stages
+    ).to(device)
+    model.train()
+    loss_func = define_model.get_loss_func(schema.question_index_groups)
+    optimizer = torch.optim.Adam(model.parameters())
+
+    images = torch.rand(batch_size, 1, resize_size, resize_size, device=device)
+    labels = torch.randint(0, 10, (batch_size, len(schema.label_cols)), device=device).float()
+
+    def train_step():
+        loss = torch.mean(loss_func(model(images), labels))
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    result = {
+        'architecture': architecture_name,
+        'resize_size': resize_size,
+        'batch_size': batch_size,
+        'checkpoint_stages': checkpoint_stages,
+        'device': str(device),
+        'out_of_memory': False,
+        'images_per_sec': None,
+        'peak_memory_gb': None
+    }
+    try:
+        train_step()  # warmup, and allocates optimizer state
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+        start = time.perf_counter()
+        for _ in range(steps):
+            train_step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            result['peak_memory_gb'] = torch.cuda.max_memory_allocated(device) / 1024 ** 3
+        else:
+            result['peak_memory_gb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2  # linux, kilobytes
+        result['images_per_sec'] = steps * batch_size / (time.perf_counter() - start)
+    except RuntimeError as e:
+        if 'out of memory' not in str(e):
+            raise e
+        result['out_of_memory'] = True
+    return result
+
+
+if __name__ == '__main__':
+
+    """
+    Peak memory and training throughput per batch size, with and without activation checkpointing (checkpoint_stages).
+    Each trial runs in its own process, so peak memory on cpu (max RSS) is not inflated by earlier trials.
+    On cpu, peak memory includes the python/torch baseline (~0.5GB).
+
+    python benchmarks/pytorch/benchmark_activation_checkpointing.py --architecture efficientnet_b4 --resize-size 380 --batch-sizes 8 16 32 --device cuda
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--architecture', dest='architecture_name', type=str, default='efficientnet_b4')
+    parser.add_argument('--resize-size', dest='resize_size', type=int, default=380)
+    parser.add_argument('--batch-sizes', dest='batch_sizes', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--steps', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--save-loc', dest='save_loc', type=str, default=None)
+    args = parser.parse_args()
+
+    trials = [
+        (args.architecture_name, args.resize_size, batch_size, checkpoint_stages, args.steps, args.device)
+        for batch_size in args.batch_sizes for checkpoint_stages in [False, True]
+    ]
+    results = []
+    # one process per trial. Spawn, as cuda can't be re-initialised in a forked process
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_trial, trials):
+            logging.info(result)
+            results.append(result)
+
+    for result in results:
+        if result['out_of_memory']:
+            print('{architecture} {resize_size}px batch {batch_size:>4} checkpoint_stages={checkpoint_stages!s:<5} out of memory'.format(**result))
+        else:
+            print('{architecture} {resize_size}px batch {batch_size:>4} checkpoint_stages={checkpoint_stages!s:<5} peak memory {peak_memory_gb:6.2f}GB  {images_per_sec:6.1f} images/sec'.format(**result))
+
+    if args.save_loc is not None:
+        with open(args.save_loc, 'w') as f:
+            json.dump(results, f, indent=4)
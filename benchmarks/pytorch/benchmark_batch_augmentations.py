@@ -0,0 +1,75 @@
+import logging
+import argparse
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from pytorch_galaxy_datasets.galaxy_datamodule import default_torchvision_transforms
+
+from zoobot.pytorch.estimators import batch_augmentations
+
+
+if __name__ == '__main__':
+
+    """
+    Compare augmentation throughput (images/sec) of:
+    - the per-image torchvision path (as applied by each dataloader worker in GalaxyDataModule), per cpu core
+    - BatchAugmentation on whole uint8 batches, on cpu and (if available) gpu
+
+    Images are random, already decoded (decoding costs the same in both paths).
+    Per-image throughput scales ~linearly with num_workers, so compare batch throughput against per-image throughput * num_workers.
+
+    python benchmarks/pytorch/benchmark_batch_augmentations.py --batch-size 256 --input-size 424 --resize-size 224
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=256)
+    parser.add_argument('--input-size', dest='input_size', type=int, default=424)
+    parser.add_argument('--resize-size', dest='resize_size', type=int, default=224)
+    parser.add_argument('--color', default=False, action='store_true')
+    parser.add_argument('--batches', type=int, default=5)
+    args = parser.parse_args()
+
+    greyscale = not args.color
+    crop_scale_bounds = (0.7, 0.8)
+    crop_ratio_bounds = (0.9, 1.1)
+
+    images = np.random.randint(0, 256, size=(args.batch_size, args.input_size, args.input_size, 3), dtype=np.uint8)
+
+    # per-image path, single process (as one dataloader worker)
+    per_image_transform = transforms.Compose(default_torchvision_transforms(greyscale, args.resize_size, crop_scale_bounds, crop_ratio_bounds))
+    pil_images = [Image.fromarray(image) for image in images]
+    per_image_transform(pil_images[0])  # warmup
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        torch.stack([per_image_transform(image) for image in pil_images])
+    per_image_rate = args.batches * args.batch_size / (time.perf_counter() - start)
+    logging.info('Per-image torchvision (1 worker): {:.0f} images/sec'.format(per_image_rate))
+
+    # batch path, from uint8 CHW batch as given by ZoobotDataModule(batch_augmentation=True)
+    batch = torch.from_numpy(images).permute(0, 3, 1, 2).contiguous()
+    augment = batch_augmentations.BatchAugmentation(args.resize_size, crop_scale_bounds, crop_ratio_bounds, greyscale=greyscale)
+
+    devices = ['cpu']
+    if torch.cuda.is_available():
+        devices.append('cuda')
+    for device in devices:
+        augment = augment.to(device)
+        device_batch = batch.to(device)
+        with torch.no_grad():
+            augment(device_batch)  # warmup
+            if device == 'cuda':
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            for _ in range(args.batches):
+                augmented = augment(device_batch)
+            if device == 'cuda':
+                torch.cuda.synchronize()
+        batch_rate = args.batches * args.batch_size / (time.perf_counter() - start)
+        logging.info('BatchAugmentation ({}, {} threads): {:.0f} images/sec, output {}'.format(
+            device, torch.get_num_threads(), batch_rate, tuple(augmented.shape)))
@@ -0,0 +1,112 @@
+import logging
+import argparse
+import json
+import time
+
+import torch
+
+from zoobot.shared import label_metadata, schemas
+from zoobot.pytorch.estimators import define_model
+
+
+if __name__ == '__main__':
+
+    """
+    Compare eager vs. torch.compile for the Zoobot efficientnets (with dirichlet head and loss):
+    training steps/sec (forward, loss, backward, Adam step) and inference images/sec (forward only).
+
+    Each architecture runs at its design resolution: b0 224px, b2 260px, b4 380px.
+    Compilation time is excluded (see warmup) but reported.
+
+    python benchmarks/pytorch/benchmark_compile.py --architectures efficientnet efficientnet_b2 efficientnet_b4 --batch-size 16 --device cpu
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--architectures', nargs='+', default=['efficientnet', 'efficientnet_b2', 'efficientnet_b4'])
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--save-loc', dest='save_loc', type=str, default=None)
+    args = parser.parse_args()
+
+    resolutions = {'efficientnet': 224, 'efficientnet_b2': 260, 'efficientnet_b4': 380}
+    schema = schemas.Schema(label_metadata.decals_dr5_ortho_pairs, label_metadata.decals_ortho_dependencies)
+    device = torch.device(args.device)
+
+    def synchronize():
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    results = []
+    for architecture_name in args.architectures:
+        resize_size = resolutions[architecture_name]
+        images = torch.rand(args.batch_size, 1, resize_size, resize_size, device=device)
+        labels = torch.randint(0, 10, (args.batch_size, len(schema.label_cols)), device=device).float()
+
+        for compile_model in [False, True]:
+            torch.manual_seed(42)
+            get_architecture, representation_dim = define_model.select_base_architecture_func_from_name(architecture_name)
+            model = define_model.get_plain_pytorch_zoobot_model(
+                output_dim=len(schema.label_cols),
+                channels=1,
+                get_architecture=get_architecture,
+                representation_dim=representation_dim,
+                compile_model=compile_model
+            ).to(device)
+            loss_func = define_model.get_loss_func(schema.question_index_groups, compile_loss=compile_model)
+            optimizer = torch.optim.Adam(model.parameters())
+
+            def train_step():
+                loss = torch.mean(loss_func(model(images), labels))
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+
+            def predict_step():
+                with torch.no_grad():
+                    model(images)
+
+            # warmup, including compilation
+            start = time.perf_counter()
+            model.train()
+            train_step()
+            model.eval()
+            predict_step()
+            synchronize()
+            warmup_time = time.perf_counter() - start
+
+            model.train()
+            start = time.perf_counter()
+            for _ in range(args.steps):
+                train_step()
+            synchronize()
+            train_steps_per_sec = args.steps / (time.perf_counter() - start)
+
+            model.eval()
+            start = time.perf_counter()
+            for _ in range(args.steps):
+                predict_step()
+            synchronize()
+            predict_images_per_sec = args.steps * args.batch_size / (time.perf_counter() - start)
+
+            result = {
+                'architecture': architecture_name,
+                'resize_size': resize_size,
+                'batch_size': args.batch_size,
+                'device': str(device),
+                'compiled': compile_model,
+                'warmup_sec': warmup_time,
+                'train_steps_per_sec': train_steps_per_sec,
+                'predict_images_per_sec': predict_images_per_sec
+            }
+            logging.info(result)
+            results.append(result)
+
+    for result in results:
+        print('{architecture:>16} compiled={compiled!s:<5} warmup {warmup_sec:7.1f}s  train {train_steps_per_sec:6.2f} steps/sec  predict {predict_images_per_sec:7.1f} images/sec'.format(**result))
+
+    if args.save_loc is not None:
+        with open(args.save_loc, 'w') as f:
+            json.dump(results, f, indent=4)
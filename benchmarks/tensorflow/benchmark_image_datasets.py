@@ -0,0 +1,87 @@
+import os
+import logging
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from zoobot.tensorflow.data_utils import image_datasets
+
+
+def write_example_images(image_dir, n_images, size):
+    # galaxy-like: smooth blob plus a little noise, so pngs compress (and decode) roughly like real ones
+    os.makedirs(image_dir, exist_ok=True)
+    x, y = np.meshgrid(np.arange(size), np.arange(size))
+    rng = np.random.default_rng(0)
+    for n in range(n_images):
+        width = rng.uniform(size / 20, size / 5)
+        blob = 255 * np.exp(-((x - size / 2) ** 2 + (y - size / 2) ** 2) / (2 * width ** 2))
+        image = np.clip(blob[:, :, np.newaxis] + rng.normal(0, 5, size=(size, size, 3)), 0, 255).astype(np.uint8)
+        Image.fromarray(image).save(os.path.join(image_dir, 'galaxy_{}.png'.format(n)))
+
+
+def get_image_dataset_serial(image_paths, file_format, batch_size):
+    # previous get_image_dataset: serial path checks, sequential decode, and a decoded batch to find the image size
+    missing_paths = [path for path in image_paths if not os.path.isfile(path)]
+    assert not missing_paths
+    path_ds = tf.data.Dataset.from_tensor_slices([str(path) for path in image_paths])
+    image_ds = path_ds.map(lambda x: image_datasets.load_image_file(x, mode=file_format))
+    image_ds = image_ds.batch(batch_size, drop_remainder=False)
+    test_images = [batch for batch in image_ds.take(1)][0]['matrix']
+    _ = test_images.numpy().shape[1]
+    return image_ds.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
+
+
+def time_dataset(get_dataset, max_batches):
+    start = time.perf_counter()
+    dataset = get_dataset()
+    setup_time = time.perf_counter() - start
+    images = 0
+    for batch in dataset.take(max_batches):
+        images += batch['matrix'].shape[0]
+    return setup_time, images / (time.perf_counter() - start - setup_time)
+
+
+if __name__ == '__main__':
+
+    """
+    Compare get_image_dataset throughput (images/sec, decoding only - no resizing) against the previous serial implementation.
+    Also times the path check: os.path.isfile per image vs. one listing per directory.
+
+    Writes --n-images example pngs to --image-dir if it has none. Or point --image-dir at real images.
+
+    python benchmarks/tensorflow/benchmark_image_datasets.py --image-dir /tmp/benchmark_pngs --n-images 100000
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image-dir', dest='image_dir', type=str, default='/tmp/benchmark_pngs')
+    parser.add_argument('--n-images', dest='n_images', type=int, default=100000)
+    parser.add_argument('--size', type=int, default=424, help='Size of example images, if writing them')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=256)
+    parser.add_argument('--max-batches', dest='max_batches', type=int, default=20,
+                        help='Batches to time for each loader (path check and setup always cover every image)')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.image_dir) or not any(name.endswith('.png') for name in os.listdir(args.image_dir)):
+        logging.info('Writing {} example images to {}'.format(args.n_images, args.image_dir))
+        write_example_images(args.image_dir, args.n_images, args.size)
+    image_paths = sorted(os.path.join(args.image_dir, name) for name in os.listdir(args.image_dir) if name.endswith('.png'))[:args.n_images]
+    size_on_disk = image_datasets.get_image_size_on_disk(image_paths[0])
+    logging.info('{} images of size {}, {} cpus'.format(len(image_paths), size_on_disk, os.cpu_count()))
+
+    start = time.perf_counter()
+    assert not [path for path in image_paths if not os.path.isfile(path)]
+    logging.info('Path check, isfile per image: {:.3f}s'.format(time.perf_counter() - start))
+    start = time.perf_counter()
+    assert not image_datasets.check_paths_exist(image_paths)
+    logging.info('Path check, listing per directory: {:.3f}s'.format(time.perf_counter() - start))
+
+    setup_time, rate = time_dataset(lambda: get_image_dataset_serial(image_paths, 'png', args.batch_size), args.max_batches)
+    logging.info('Serial: setup {:.2f}s, {:.0f} images/sec'.format(setup_time, rate))
+
+    setup_time, rate = time_dataset(lambda: image_datasets.get_image_dataset(image_paths, 'png', size_on_disk, args.batch_size), args.max_batches)
+    logging.info('Parallel (AUTOTUNE): setup {:.2f}s, {:.0f} images/sec'.format(setup_time, rate))
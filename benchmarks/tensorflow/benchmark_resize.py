@@ -0,0 +1,68 @@
+import os
+import logging
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from zoobot.tensorflow.data_utils import image_datasets
+
+
+def get_batch_resized_dataset(image_paths, requested_img_size, batch_size):
+    # previous get_image_dataset: decode to float32, batch, then resize whole batches with lanczos3
+    path_ds = tf.data.Dataset.from_tensor_slices(image_paths)
+    image_ds = path_ds.map(lambda x: image_datasets.load_image_file(x, mode='png'), num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    image_ds = image_ds.batch(batch_size)
+    image_ds = image_ds.map(lambda x: image_datasets.prepare_image_batch(x, resize_size=requested_img_size), num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return image_ds.prefetch(tf.data.AUTOTUNE)
+
+
+def load_all(dataset, repeats=3):
+    # best of several passes, as timings on shared machines are noisy
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        images = np.concatenate([batch['matrix'].numpy() for batch in dataset])
+        times.append(time.perf_counter() - start)
+    return images, len(images) / min(times)
+
+
+if __name__ == '__main__':
+
+    """
+    Compare get_image_dataset resizing options, on pngs in --image-dir:
+    - previous: lanczos3 on whole float32 batches, after batching
+    - lanczos3 or area resizing per image as each is decoded, optionally keeping uint8
+
+    Reports images/sec (including png decoding) and the pixel difference (0-255 scale) from the previous output.
+
+    python benchmarks/tensorflow/benchmark_resize.py --image-dir data/example_images/basic --sizes 224 212
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image-dir', dest='image_dir', type=str, default='data/example_images/basic')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[224, 212])
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64)
+    args = parser.parse_args()
+
+    image_paths = sorted(os.path.join(args.image_dir, name) for name in os.listdir(args.image_dir) if name.endswith('.png'))
+    logging.info('{} images of size {}, {} cpus'.format(len(image_paths), image_datasets.get_image_size_on_disk(image_paths[0]), os.cpu_count()))
+
+    for size in args.sizes:
+        load_all(get_batch_resized_dataset(image_paths[:args.batch_size], size, args.batch_size), repeats=1)  # warmup
+        previous, rate = load_all(get_batch_resized_dataset(image_paths, size, args.batch_size))
+        logging.info('{}px, previous (batch lanczos3): {:.0f} images/sec'.format(size, rate))
+
+        for resize_method in ['lanczos3', 'area']:
+            for keep_uint8 in [False, True]:
+                def get_dataset(paths):
+                    return image_datasets.get_image_dataset(
+                        paths, 'png', size, args.batch_size, resize_method=resize_method, keep_uint8=keep_uint8)
+                load_all(get_dataset(image_paths[:args.batch_size]), repeats=1)  # warmup
+                images, rate = load_all(get_dataset(image_paths))
+                diff = np.abs(images.astype(np.float32) - previous)
+                logging.info('{}px, per image {}{}: {:.0f} images/sec, difference from previous: mean {:.3f}, 99th pc {:.2f}, max {:.1f}'.format(
+                    size, resize_method, ' uint8' if keep_uint8 else '', rate, diff.mean(), np.percentile(diff, 99), diff.max()))
@@ -0,0 +1,90 @@
+import os
+import glob
+import logging
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from zoobot.tensorflow.data_utils import catalog_to_tfrecord, tfrecord_datasets
+
+
+def time_dataset(dataset, repeats=3):
+    # best of several passes, as timings on shared machines are noisy
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        galaxies = sum(batch['id_str'].shape[0] for batch in dataset)
+        times.append(time.perf_counter() - start)
+    return galaxies / min(times)
+
+
+if __name__ == '__main__':
+
+    """
+    Compare tfrecord shard size and read throughput (galaxies/sec) for each way of saving images:
+    raw uint8 bytes (default), raw with GZIP/ZLIB compression, and png/jpeg-encoded bytes.
+    With --greyscale, images are saved with one channel (see create_shards.ShardConfig), for comparison.
+
+    Uses the example galaxy images, resized to --size as for real shards (see create_shards.py).
+    Reads from local disk (likely page cache), so throughput here is decode-bound.
+    On a slow shared filesystem, reading is instead limited by bandwidth: divide that by MB/galaxy.
+
+    python benchmarks/tensorflow/benchmark_tfrecord_formats.py --image-dir data/example_images/basic --size 300
+    """
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image-dir', dest='image_dir', type=str, default='data/example_images/basic')
+    parser.add_argument('--save-dir', dest='save_dir', type=str, default='/tmp/benchmark_tfrecord_formats')
+    parser.add_argument('--size', type=int, default=300)
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=128)
+    parser.add_argument('--greyscale', default=False, action='store_true')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.image_dir, '*.png')))
+    df = pd.DataFrame({'file_loc': paths, 'id_str': [os.path.basename(path) for path in paths]})
+    os.makedirs(args.save_dir, exist_ok=True)
+    logging.info('{} galaxies of size {}, greyscale={}, {} cpus'.format(len(df), args.size, args.greyscale, os.cpu_count()))
+
+    options = [
+        # image_format, jpeg_quality, compression_type
+        ('raw', None, None),
+        ('raw', None, 'ZLIB'),
+        ('raw', None, 'GZIP'),
+        ('png', None, None),
+        ('jpeg', 95, None),
+        ('jpeg', 85, None)
+    ]
+    results = []
+    raw_images = None
+    for image_format, jpeg_quality, compression_type in options:
+        name = '{}{}{}'.format(image_format, jpeg_quality or '', '_' + compression_type if compression_type else '')
+        tfrecord_loc = os.path.join(args.save_dir, '{}.tfrecord'.format(name))
+
+        start = time.perf_counter()
+        catalog_to_tfrecord.write_image_df_to_tfrecord(
+            df, tfrecord_loc, args.size, ['id_str'], reader=catalog_to_tfrecord.load_png_as_pil,
+            image_format=image_format, jpeg_quality=jpeg_quality or 95, compression_type=compression_type, greyscale=args.greyscale)
+        write_time = time.perf_counter() - start
+
+        dataset = tfrecord_datasets.get_tfrecord_dataset(
+            [tfrecord_loc], [], args.batch_size, shuffle=False, image_format=image_format, compression_type=compression_type)
+        images = np.concatenate([batch['matrix'].numpy() for batch in dataset])  # also a warmup
+        if raw_images is None:
+            raw_images = images  # first option is raw
+        results.append({
+            'name': name,
+            'kb_per_galaxy': os.path.getsize(tfrecord_loc) / len(df) / 1e3,
+            'write_galaxies_per_sec': len(df) / write_time,
+            'read_galaxies_per_sec': time_dataset(dataset),
+            'mean_pixel_error': np.abs(images - raw_images).mean() * 255  # jpeg is lossy
+        })
+        os.remove(tfrecord_loc)
+
+    results = pd.DataFrame(results)
+    results['size_vs_raw'] = results['kb_per_galaxy'] / results['kb_per_galaxy'][0]
+    logging.info('\n{}'.format(results.round(2).to_string(index=False)))
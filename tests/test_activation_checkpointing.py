@@ -0,0 +1,30 @@
+import copy
+
+import torch
+
+from zoobot.pytorch.estimators import efficientnet_standard
+
+
+def test_checkpoint_stages_matches_gradients():
+    model = efficientnet_standard.efficientnet_b0(input_channels=1, include_top=False)
+    checkpointed_model = copy.deepcopy(model)
+    checkpointed_model.checkpoint_stages = True
+    images = torch.rand(4, 1, 64, 64)
+
+    grads = []
+    for m in [model, checkpointed_model]:
+        m.train()
+        torch.manual_seed(0)  # same stochastic depth drops
+        m(images).sum().backward()
+        grads.append([p.grad for p in m.parameters()])
+
+    for grad, checkpointed_grad in zip(*grads):
+        assert torch.allclose(grad, checkpointed_grad, atol=1e-5)
+
+
+def test_checkpoint_stages_only_when_training():
+    model = efficientnet_standard.efficientnet_b0(input_channels=1, include_top=False, checkpoint_stages=True)
+    model.eval()
+    images = torch.rand(2, 1, 64, 64)
+    with torch.no_grad():
+        assert model(images).shape == (2, 1280)
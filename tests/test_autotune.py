@@ -0,0 +1,38 @@
+import json
+
+import torch
+import pytorch_lightning as pl
+
+from zoobot.pytorch.training import autotune
+
+
+class TinyLossModule(pl.LightningModule):
+
+    def __init__(self):
+        super().__init__()
+        self.model = torch.nn.Linear(4, 2)
+
+    def forward(self, x):
+        return self.model(x)
+
+    def loss_func(self, predictions, labels):
+        return torch.mean((predictions - labels) ** 2, dim=1)
+
+
+def test_autotune_dataloader(tmp_path):
+    dataset = torch.utils.data.TensorDataset(torch.randn(256, 4), torch.randn(256, 2))
+    model = TinyLossModule()
+    weights_before = model.model.weight.detach().clone()
+    save_loc = str(tmp_path / 'dataloader_config.json')
+
+    config = autotune.autotune_dataloader(
+        model, dataset, save_loc=save_loc, batch_sizes=(8, 16), num_workers_options=(1,), prefetch_factors=(2,),
+        steps=6, warmup_steps=2, device='cpu'
+    )
+
+    assert len(config['trials']) == 2
+    assert config['batch_size'] in (8, 16)
+    assert torch.equal(model.model.weight, weights_before)  # trials use a copy
+    with open(save_loc, 'r') as f:
+        assert json.load(f)['batch_size'] == config['batch_size']
+    assert autotune.load_dataloader_config(save_loc) == {'batch_size': config['batch_size'], 'num_workers': 1, 'prefetch_factor': 2}
@@ -0,0 +1,44 @@
+import pytest
+
+import torch
+
+from zoobot.pytorch.estimators import batch_augmentations
+
+
+@pytest.fixture
+def images():
+    return torch.randint(0, 256, size=(8, 3, 48, 48), dtype=torch.uint8)
+
+
+def test_batch_augmentation_shape(images):
+    augment = batch_augmentations.BatchAugmentation(resize_size=32, greyscale=True)
+    augmented = augment(images)
+    assert augmented.shape == (8, 1, 32, 32)
+    assert augmented.dtype == torch.float32
+    assert augmented.min() >= 0. and augmented.max() <= 1.
+
+
+def test_batch_augmentation_identity(images):
+    # full-size crop at the same resolution, without flips or rotations, should change nothing
+    augment = batch_augmentations.BatchAugmentation(
+        resize_size=48, crop_scale_bounds=(1., 1.), crop_ratio_bounds=(1., 1.), greyscale=False, flip=False, rotate=False)
+    assert torch.allclose(augment(images), images.float() / 255., atol=1e-5)
+
+
+def test_batch_augmentation_flip(images):
+    augment = batch_augmentations.BatchAugmentation(
+        resize_size=48, crop_scale_bounds=(1., 1.), crop_ratio_bounds=(1., 1.), greyscale=False, flip=True, rotate=False)
+    augmented = augment(images)
+    expected = images.float() / 255.
+    for image, original in zip(augmented, expected):
+        assert torch.allclose(image, original, atol=1e-5) or torch.allclose(image, original.flip(-1), atol=1e-5)
+
+
+def test_batch_augmentation_rotation_corners():
+    # rotated-in corners are zero, as with torchvision RandomRotation, but the centre is always kept
+    images = torch.full((64, 1, 32, 32), 255, dtype=torch.uint8)
+    augment = batch_augmentations.BatchAugmentation(
+        resize_size=32, crop_scale_bounds=(1., 1.), crop_ratio_bounds=(1., 1.), flip=False, rotate=True)
+    augmented = augment(images)
+    assert torch.all(augmented[:, :, 12:20, 12:20] > 0.99)
+    assert (augmented[:, 0, 0, 0] == 0).float().mean() > 0.5
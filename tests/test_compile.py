@@ -0,0 +1,56 @@
+import pytest
+import torch
+from torch import nn
+
+from zoobot.pytorch.estimators import define_model, custom_layers, efficientnet_custom
+
+
+class TinyModule(define_model.GenericLightningModule):
+
+    def __init__(self):
+        super().__init__()
+        self.model = nn.Sequential(nn.Linear(4, 4), nn.BatchNorm1d(4), nn.Linear(4, 3))
+
+    def setup_metrics(self):
+        self.log_on_step = True  # no accuracy metrics needed
+
+
+@pytest.mark.skipif(not hasattr(torch, 'compile'), reason='requires torch >= 2.0')
+def test_compiled_dirichlet_head():
+    # PermaDropout and ScaledSigmoid should compile, and weights should transfer to/from the compiled model
+    model = nn.Sequential(
+        nn.Flatten(),
+        custom_layers.PermaDropout(0.),
+        efficientnet_custom.custom_top_dirichlet(16, 4)
+    )
+    compiled = torch.compile(model)
+    x = torch.rand(8, 1, 4, 4)
+    assert torch.allclose(compiled(x), model(x))
+
+    compiled_state_dict = compiled.state_dict()
+    assert all(key.startswith('_orig_mod.') for key in compiled_state_dict.keys())
+
+    fresh_model = nn.Sequential(nn.Flatten(), custom_layers.PermaDropout(0.), efficientnet_custom.custom_top_dirichlet(16, 4))
+    fresh_model.load_state_dict(define_model.strip_compiled_prefix(compiled_state_dict))
+    assert torch.allclose(fresh_model(x), model(x))
+
+
+def test_getstate_drops_compiled_model_and_trainer():
+    # pickled for ddp_spawn - neither the compiled model nor the trainer should go with it
+    module = TinyModule()
+    module._compiled_model = object()
+    module._trainer = object()
+    state = module.__getstate__()
+    assert state['_compiled_model'] is None
+    assert state['_trainer'] is None
+
+
+def test_warmup_keeps_batchnorm_stats():
+    model = TinyModule()
+    # not compiled, but the warmup passes are the same
+    buffers_before = {name: buffer.clone() for name, buffer in model.named_buffers()}
+    define_model.warmup_compiled_model(model, (8, 4), torch.device('cpu'))
+    for name, buffer in model.named_buffers():
+        assert torch.equal(buffer, buffers_before[name]), name
+    assert model.training
+    assert all(param.grad is None for param in model.parameters())
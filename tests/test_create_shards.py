@@ -0,0 +1,175 @@
+import os
+
+import pytest
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from zoobot.tensorflow.data_utils import create_shards, tfrecord_datasets, checks, catalog_to_tfrecord, tfrecord_index
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    rows = []
+    for n in range(10):
+        file_loc = str(tmp_path / 'galaxy_{}.png'.format(n))
+        Image.fromarray(np.random.randint(0, 255, size=(32, 32, 3), dtype=np.uint8)).save(file_loc)
+        rows.append({'id_str': 'galaxy_{}'.format(n), 'file_loc': file_loc, 'smooth-or-featured_smooth': float(n)})
+    with open(rows[3]['file_loc'], 'wb') as f:
+        f.write(b'not a png')  # one bad image
+    return pd.DataFrame(rows)
+
+
+def test_write_catalog_to_tfrecord_shards(catalog, tmp_path):
+    columns_to_save = ['id_str', 'smooth-or-featured_smooth']
+    shard_bytes = []
+    for num_workers in [1, 2]:
+        save_dir = str(tmp_path / 'shards_{}'.format(num_workers))
+        os.mkdir(save_dir)
+        written = create_shards.write_catalog_to_tfrecord_shards(catalog, 16, columns_to_save, save_dir, shard_size=4, num_workers=num_workers)
+
+        assert set(written['id_str']) == set(catalog['id_str']) - {'galaxy_3'}  # skipped
+        assert sorted(os.listdir(save_dir)) == ['s16_shard_{}{}'.format(n, suffix) for n in range(3) for suffix in ['.tfrecord', '_index.csv']]
+        assert set(written['shard']) == set(loc for loc in os.listdir(save_dir) if loc.endswith('.tfrecord'))
+        shard_bytes.append([open(os.path.join(save_dir, loc), 'rb').read() for loc in sorted(os.listdir(save_dir))])
+
+    assert shard_bytes[0] == shard_bytes[1]  # deterministic, however many workers
+
+    tfrecord_locs = [os.path.join(save_dir, loc) for loc in sorted(os.listdir(save_dir)) if loc.endswith('.tfrecord')]
+    batches = list(tfrecord_datasets.get_tfrecord_dataset(tfrecord_locs, ['smooth-or-featured_smooth'], batch_size=16, shuffle=False))
+    id_strs = [id_str.decode() for id_str in batches[0]['id_str'].numpy()]
+    assert sorted(id_strs) == sorted(set(catalog['id_str']) - {'galaxy_3'})
+
+
+def test_write_shard_fails(catalog, tmp_path, monkeypatch):
+    save_loc = str(tmp_path / 's16_shard_0.tfrecord')
+
+    def fail_partway(df, save_loc, index_loc=None, **kwargs):
+        for loc in [save_loc, index_loc]:
+            with open(loc, 'w') as f:
+                f.write('partial')
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(catalog_to_tfrecord, 'write_image_df_to_tfrecord', fail_partway)
+    write_kwargs = {'img_size': 16, 'columns_to_save': ['id_str'], 'reader': None, 'compression_type': None}
+    _, n_galaxies, skipped, error = create_shards._write_shard((catalog[:4], save_loc, write_kwargs))
+    assert n_galaxies == 4
+    assert skipped == []  # failed, not skipped
+    assert 'No space left on device' in error
+    assert os.listdir(tmp_path) == [loc for loc in os.listdir(tmp_path) if loc.endswith('.png')]  # no partial shard or index
+
+
+def test_write_catalog_to_tfrecord_shards_fails(catalog, tmp_path):
+    # whole shards failing (here, no directory to write to) should raise, not skip every galaxy
+    with pytest.raises(IOError, match='Failed to write 3 of 3 shards'):
+        create_shards.write_catalog_to_tfrecord_shards(catalog, 16, ['id_str'], str(tmp_path / 'missing'), shard_size=4, num_workers=1)
+
+
+@pytest.mark.parametrize('interrupted', [False, True])
+def test_update_shards(catalog, tmp_path, monkeypatch, interrupted):
+    catalog = catalog[catalog['id_str'] != 'galaxy_3']
+    columns_to_save = ['id_str', 'smooth-or-featured_smooth']
+    shard_config = create_shards.ShardConfig(shard_dir=str(tmp_path / 'shards'), size=16, shard_size=4)
+    shard_config.prepare_shards(catalog[:6].copy(), catalog[6:].copy(), columns_to_save, val_fraction=0.2, test_fraction=0.2, num_workers=1)
+    before = create_shards.load_shard_manifest(shard_config.manifest_loc).set_index('id_str')
+
+    new_galaxies = []
+    for n in range(10, 20):
+        file_loc = str(tmp_path / 'galaxy_{}.png'.format(n))
+        Image.fromarray(np.random.randint(0, 255, size=(32, 32, 3), dtype=np.uint8)).save(file_loc)
+        new_galaxies.append({'id_str': 'galaxy_{}'.format(n), 'file_loc': file_loc, 'smooth-or-featured_smooth': float(n)})
+    # galaxy_0 removed, galaxy_1 has new votes, galaxy_7 is now labelled, and 10 new galaxies
+    labelled_catalog = pd.concat([catalog[1:7], pd.DataFrame(new_galaxies)]).reset_index(drop=True)
+    labelled_catalog.loc[labelled_catalog['id_str'] == 'galaxy_1', 'smooth-or-featured_smooth'] = 100.
+    if interrupted:
+        # shards written and retired, but manifest not yet saved
+        def interrupt(manifest, manifest_loc):
+            raise KeyboardInterrupt
+        with monkeypatch.context() as patch:
+            patch.setattr(create_shards, 'save_shard_manifest', interrupt)
+            with pytest.raises(KeyboardInterrupt):
+                shard_config.update_shards(labelled_catalog, catalog[7:].copy(), columns_to_save, val_fraction=0.2, test_fraction=0.2, num_workers=1)
+    shard_config.update_shards(labelled_catalog, catalog[7:].copy(), columns_to_save, val_fraction=0.2, test_fraction=0.2, num_workers=1)
+    after = create_shards.load_shard_manifest(shard_config.manifest_loc).set_index('id_str')
+
+    assert set(after.index) == set(catalog['id_str'][1:]) | set(pd.DataFrame(new_galaxies)['id_str'])
+    unchanged = ['galaxy_2', 'galaxy_4', 'galaxy_5', 'galaxy_6', 'galaxy_8', 'galaxy_9']
+    assert after.loc[unchanged].equals(before.loc[unchanged])  # not rewritten
+    assert after.loc['galaxy_1', 'split'] == before.loc['galaxy_1', 'split']
+    assert after.loc['galaxy_1', 'shard'] not in set(before['shard'])  # rewritten to a new shard
+    assert after.loc['galaxy_7', 'split'] in create_shards.LABELLED_SPLITS
+
+    # shards on disk match the manifest, with no galaxy duplicated
+    for split in create_shards.LABELLED_SPLITS + ['unlabelled']:
+        in_split = after[after['split'] == split]
+        split_dir = shard_config.get_split_dir(split)
+        tfrecord_locs = sorted(os.path.join(split_dir, loc) for loc in set(in_split['shard']))
+        assert sorted(loc for loc in os.listdir(split_dir) if loc.endswith('.tfrecord')) == sorted(map(os.path.basename, tfrecord_locs))
+        if tfrecord_locs:
+            batches = tfrecord_datasets.get_tfrecord_dataset(tfrecord_locs, [], batch_size=32, shuffle=False)
+            id_strs = [id_str.decode() for batch in batches for id_str in batch['id_str'].numpy()]
+            assert sorted(id_strs) == sorted(in_split.index)
+    train_and_val = tfrecord_datasets.get_tfrecord_dataset(shard_config.train_tfrecord_locs() + shard_config.val_tfrecord_locs() + shard_config.test_tfrecord_locs(), ['smooth-or-featured_smooth'], batch_size=32, shuffle=False)
+    labels = dict((id_str.decode(), label) for batch in train_and_val for id_str, label in zip(batch['id_str'].numpy(), batch['smooth-or-featured_smooth'].numpy()))
+    assert labels['galaxy_1'] == 100.
+
+    # split for new galaxies depends only on id_str
+    assert list(create_shards.assign_splits(pd.Series(['galaxy_10', 'galaxy_11']))) == list(create_shards.assign_splits(pd.Series(['galaxy_11', 'galaxy_10'])))[::-1]
+
+
+def test_tfrecord_index(catalog, tmp_path):
+    columns_to_save = ['id_str', 'smooth-or-featured_smooth']
+    save_dir = str(tmp_path / 'shards')
+    os.mkdir(save_dir)
+    create_shards.write_catalog_to_tfrecord_shards(catalog, 16, columns_to_save, save_dir, shard_size=4, num_workers=1)
+    tfrecord_locs = sorted(os.path.join(save_dir, loc) for loc in os.listdir(save_dir) if loc.endswith('.tfrecord'))
+    index = tfrecord_index.load_index(tfrecord_locs)
+    assert sorted(index['id_str']) == sorted(set(catalog['id_str']) - {'galaxy_3'})
+
+    sequential = list(tfrecord_datasets.get_tfrecord_dataset(tfrecord_locs, ['smooth-or-featured_smooth'], batch_size=16, shuffle=False))[0]
+    images = dict(zip([id_str.decode() for id_str in sequential['id_str'].numpy()], sequential['matrix'].numpy()))
+
+    id_strs = ['galaxy_9', 'galaxy_0', 'galaxy_5']
+    subset = tfrecord_index.find_galaxies(index, id_strs)
+    batch = list(tfrecord_index.get_indexed_dataset(subset, ['smooth-or-featured_smooth'], batch_size=8))[0]
+    assert [id_str.decode() for id_str in batch['id_str'].numpy()] == id_strs  # in order asked
+    assert list(batch['smooth-or-featured_smooth'].numpy()) == [9., 0., 5.]
+    for id_str, matrix in zip(id_strs, batch['matrix'].numpy()):
+        np.testing.assert_array_equal(matrix, images[id_str])
+    with pytest.raises(KeyError):
+        tfrecord_index.find_galaxies(index, ['galaxy_3'])
+
+    # same index when made from the shard alone, and kept valid when galaxies are removed
+    pd.testing.assert_frame_equal(tfrecord_index.index_tfrecord(tfrecord_locs[0]), index[index['tfrecord_loc'] == tfrecord_locs[0]].drop(columns='tfrecord_loc').reset_index(drop=True))
+    create_shards.remove_from_tfrecord(tfrecord_locs[0], [index['id_str'][0]])
+    reindexed = tfrecord_index.load_index(tfrecord_locs)
+    assert index['id_str'][0] not in set(reindexed['id_str'])
+    assert len(list(tfrecord_index.read_serialized_examples(reindexed))) == len(index) - 1
+
+
+def test_get_index_loc():
+    assert tfrecord_index.get_index_loc('/data/dr5.tfrecords/s300_shard_0.tfrecord') == '/data/dr5.tfrecords/s300_shard_0_index.csv'
+
+
+def test_find_missing_files(tmp_path, monkeypatch):
+    locs = []
+    for dir_n in range(3):
+        os.mkdir(tmp_path / 'dir_{}'.format(dir_n))
+        for n in range(4):
+            locs.append(str(tmp_path / 'dir_{}'.format(dir_n) / 'galaxy_{}.png'.format(n)))
+            open(locs[-1], 'w').close()
+    missing = [str(tmp_path / 'dir_1' / 'new.png'), str(tmp_path / 'no_dir' / 'galaxy_0.png')]
+    cache_loc = str(tmp_path / 'cache.json')
+
+    assert checks.find_missing_files(locs + missing, cache_loc=cache_loc) == missing
+
+    open(missing[0], 'w').close()  # changes dir_1 only
+    os.utime(tmp_path / 'dir_1', ns=(0, 0))  # in case the change was too quick to alter mtime
+    listed = []
+    real_listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listed.append(path) or real_listdir(path))
+    assert checks.find_missing_files(locs + missing, cache_loc=cache_loc) == missing[1:]
+    assert listed == [str(tmp_path / 'dir_1')]  # other directories unchanged, so from cache
+
+    with pytest.raises(FileNotFoundError):
+        catalog_to_tfrecord.get_reader(locs + missing)
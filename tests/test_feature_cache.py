@@ -0,0 +1,52 @@
+import numpy as np
+import tensorflow as tf
+
+from zoobot.tensorflow.transfer_learning import feature_cache
+
+
+class RandomShift(tf.keras.layers.Layer):
+    # stands in for the base model's (always on) augmentations
+
+    def call(self, x, training=None):
+        return x + tf.random.uniform(tf.shape(x))
+
+
+def get_dataset(n_galaxies=10, batch_size=4):
+    images = np.arange(n_galaxies, dtype=np.float32)[:, None, None, None] * np.ones((1, 4, 4, 2), dtype=np.float32)
+    labels = np.arange(n_galaxies, dtype=np.float32)
+    return tf.data.Dataset.from_tensor_slices((images, labels)).batch(batch_size)
+
+
+def test_cache_features(tmp_path):
+    base_model = tf.keras.Sequential([tf.keras.layers.InputLayer(input_shape=(4, 4, 2)), RandomShift()])
+    save_loc = str(tmp_path / 'features.npy')
+
+    features, labels = feature_cache.cache_features(base_model, get_dataset(), save_loc, n_views=3)
+
+    assert features.shape == (3, 10, 2)  # pooled
+    assert not np.allclose(features[0], features[1])  # views differ
+    np.testing.assert_array_equal(labels, np.arange(10))
+    # galaxies stay in order: pooled feature is galaxy index + shift in [0, 1)
+    assert np.all((features >= labels[None, :, None]) & (features < labels[None, :, None] + 1))
+
+    loaded_features, loaded_labels = feature_cache.load_features(save_loc)
+    np.testing.assert_allclose(loaded_features, features)
+    np.testing.assert_array_equal(loaded_labels, labels)
+
+
+def test_get_feature_dataset():
+    n_views, n_galaxies = 3, 10
+    # view v of galaxy i has features [i, v]
+    features = np.stack(np.meshgrid(np.arange(n_galaxies), np.arange(n_views)), axis=-1).astype(np.float32)
+    labels = np.arange(n_galaxies)
+
+    batches = list(feature_cache.get_feature_dataset(features, labels, batch_size=4, shuffle=True, seed=0))
+    x = np.concatenate([batch_x.numpy() for batch_x, _ in batches])
+    y = np.concatenate([batch_y.numpy() for _, batch_y in batches])
+    assert x.shape == (n_galaxies, 2)
+    assert sorted(y) == list(labels)
+    np.testing.assert_array_equal(x[:, 0], y)  # features match labels
+    assert set(x[:, 1]).issubset(set(range(n_views)))
+
+    x_eval = np.concatenate([batch_x.numpy() for batch_x, _ in feature_cache.get_feature_dataset(features, labels, batch_size=4)])
+    np.testing.assert_allclose(x_eval, np.stack([labels, np.ones(n_galaxies)], axis=1))  # mean over views
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from zoobot.tensorflow.transfer_learning import sweep
+
+
+def get_split(n_galaxies, rng):
+    features = rng.normal(size=(n_galaxies, 2))
+    labels = (features[:, 0] > 0).astype(int)
+    return features, labels
+
+
+def test_get_sweep_configs():
+    configs = sweep.get_sweep_configs(head_types=['linear', 'mlp'], dropout_rates=[0.5, 0.75], dataset_sizes=[10, None])
+    # linear heads have no dropout, so aren't repeated for each dropout rate
+    assert len(configs) == 2 + 4
+    assert len(set(config['run_name'] for config in configs)) == len(configs)
+
+
+def test_run_sweep(tmp_path):
+    rng = np.random.default_rng(0)
+    data_dir = str(tmp_path / 'data')
+    sweep.save_sweep_data(data_dir, get_split(200, rng), get_split(50, rng), get_split(50, rng))
+    results_loc = str(tmp_path / 'results.csv')
+
+    configs = sweep.get_sweep_configs(head_types=['linear'], dataset_sizes=[50, None])
+    results = sweep.run_sweep(data_dir, configs, results_loc, processes=2, batch_size=8, max_galaxies_to_show=2000)
+    assert len(results) == 2
+    assert set(results['dataset_size']) == {50, 200}
+    assert results.query('dataset_size == 200')['test_accuracy'].squeeze() > 0.7
+
+    # completed configs are skipped
+    configs = sweep.get_sweep_configs(head_types=['linear'], dataset_sizes=[50, 100, None])
+    results = sweep.run_sweep(data_dir, configs, results_loc, processes=2, batch_size=8, max_galaxies_to_show=2000)
+    assert len(results) == 3
+    assert len(pd.read_csv(results_loc)) == 3
@@ -0,0 +1,136 @@
+import pytest
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+from zoobot.shared import label_metadata, schemas
+from zoobot.tensorflow.training import losses as tf_losses
+
+
+@pytest.fixture
+def multiquestion_context():
+    # factory, as in test_loss_equivalence.py, but for a full schema
+    def _multiquestion_context(question_index_groups, batch_size=16, total_count=10):
+        labels, concentrations = [], []
+        for q_start, q_end in question_index_groups:
+            answers = q_end - q_start + 1
+            q_concentrations = np.random.rand(batch_size, answers) * 20. + 1.  # within the 1-101 range of the dirichlet head
+            q_labels = tfp.distributions.DirichletMultinomial(np.ones(batch_size) * total_count, q_concentrations).sample().numpy()
+            labels.append(q_labels)
+            concentrations.append(q_concentrations)
+        return np.concatenate(labels, axis=1), np.concatenate(concentrations, axis=1)
+    return _multiquestion_context
+
+
+@pytest.fixture
+def decals_schema():
+    return schemas.Schema(label_metadata.decals_dr5_ortho_pairs, label_metadata.decals_ortho_dependencies)
+
+
+def test_fused_multiquestion_loss(multiquestion_context, decals_schema):
+    labels, concentrations = multiquestion_context(decals_schema.question_index_groups)
+
+    log_prob = tf_losses.calculate_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups).numpy()
+    log_prob_fused = tf_losses.calculate_fused_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups).numpy()
+
+    assert log_prob.shape == log_prob_fused.shape
+    assert np.allclose(log_prob, log_prob_fused)
+
+
+def test_fused_multiquestion_loss_float32_xla(multiquestion_context, decals_schema):
+    labels, concentrations = multiquestion_context(decals_schema.question_index_groups)
+    labels, concentrations = labels.astype(np.float32), concentrations.astype(np.float32)
+
+    fused_loss = tf.function(
+        lambda x, y: tf_losses.calculate_fused_multiquestion_loss(x, y, decals_schema.question_index_groups),
+        jit_compile=True
+    )
+
+    log_prob = tf_losses.calculate_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups).numpy()
+    log_prob_fused = fused_loss(labels, concentrations).numpy()
+
+    assert np.allclose(log_prob, log_prob_fused, rtol=1e-4, atol=1e-3)
+
+
+def test_fused_multiquestion_loss_gradients(multiquestion_context, decals_schema):
+    labels, concentrations = multiquestion_context(decals_schema.question_index_groups)
+    concentrations = tf.Variable(concentrations)
+
+    with tf.GradientTape() as tape:
+        loss = tf.reduce_sum(tf_losses.calculate_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups))
+    grads = tape.gradient(loss, concentrations).numpy()
+
+    with tf.GradientTape() as tape:
+        loss_fused = tf.reduce_sum(tf_losses.calculate_fused_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups))
+    grads_fused = tape.gradient(loss_fused, concentrations).numpy()
+
+    assert np.allclose(grads, grads_fused)
+
+
+def test_fused_keras_loss(multiquestion_context, decals_schema):
+    labels, concentrations = multiquestion_context(decals_schema.question_index_groups)
+
+    loss = tf_losses.get_multiquestion_loss(decals_schema.question_index_groups)(labels, concentrations).numpy()
+    loss_fused = tf_losses.get_multiquestion_loss(decals_schema.question_index_groups, fused=True)(labels, concentrations).numpy()
+
+    assert np.isclose(loss, loss_fused)
+
+
+@pytest.fixture
+def campaign_context(multiquestion_context):
+    # mimic decals_all_campaigns_ortho_pairs: each galaxy only has votes for one campaign's block of questions
+    def _campaign_context(question_index_groups, n_campaigns=3, batch_size=16):
+        labels, concentrations = multiquestion_context(question_index_groups, batch_size=batch_size)
+        question_campaign = np.arange(len(question_index_groups)) % n_campaigns
+        galaxy_campaign = np.random.randint(n_campaigns, size=batch_size)
+        question_mask = galaxy_campaign[:, None] == question_campaign[None, :]  # (batch, question)
+        for q_n, (q_start, q_end) in enumerate(question_index_groups):
+            labels[~question_mask[:, q_n], q_start:q_end+1] = 0
+        return labels, concentrations, question_mask
+    return _campaign_context
+
+
+def test_sparse_multiquestion_loss(campaign_context, decals_schema):
+    labels, concentrations, question_mask = campaign_context(decals_schema.question_index_groups)
+
+    log_prob = tf_losses.calculate_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups).numpy()
+    log_prob_sparse = tf_losses.calculate_sparse_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups).numpy()
+    log_prob_masked = tf_losses.calculate_sparse_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups, question_mask=question_mask).numpy()
+
+    assert log_prob.shape == log_prob_sparse.shape
+    assert np.allclose(log_prob, log_prob_sparse)
+    assert np.allclose(log_prob, log_prob_masked)
+    assert np.all(log_prob_sparse[~question_mask] == 0)
+
+
+def test_sparse_multiquestion_loss_gradients(campaign_context, decals_schema):
+    labels, concentrations, _ = campaign_context(decals_schema.question_index_groups)
+    concentrations = tf.Variable(concentrations)
+
+    with tf.GradientTape() as tape:
+        loss = tf.reduce_sum(tf_losses.calculate_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups))
+    grads = tape.gradient(loss, concentrations).numpy()
+
+    with tf.GradientTape() as tape:
+        loss_sparse = tf.reduce_sum(tf_losses.calculate_sparse_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups))
+    grads_sparse = tape.gradient(loss_sparse, concentrations)
+
+    assert np.allclose(grads, tf.convert_to_tensor(grads_sparse).numpy())
+
+
+def test_masked_keras_loss(campaign_context, decals_schema):
+    labels, concentrations, question_mask = campaign_context(decals_schema.question_index_groups)
+    question_mask[:, 0] = False  # exclude a question even where it has votes, so the mask (not the votes) decides
+    labels_with_mask = np.concatenate([labels, question_mask.astype(labels.dtype)], axis=1)
+    assert labels_with_mask.shape[1] == len(decals_schema.label_cols) + len(decals_schema.question_mask_cols)
+
+    loss_masked = tf_losses.get_multiquestion_loss(decals_schema.question_index_groups, sparse=True, masked=True)(labels_with_mask, concentrations).numpy()
+    expected = tf_losses.calculate_sparse_multiquestion_loss(labels, concentrations, decals_schema.question_index_groups, question_mask=question_mask).numpy().sum()
+    assert np.isclose(loss_masked, expected)
+    assert not np.isclose(loss_masked, tf_losses.get_multiquestion_loss(decals_schema.question_index_groups, sparse=True)(labels, concentrations).numpy())
+
+    with pytest.raises(ValueError):
+        tf_losses.get_multiquestion_loss(decals_schema.question_index_groups, fused=True, sparse=True)
+    with pytest.raises(ValueError):
+        tf_losses.get_multiquestion_loss(decals_schema.question_index_groups, masked=True)
@@ -0,0 +1,53 @@
+import types
+
+import pandas as pd
+import pytest
+import torch
+import pytorch_lightning as pl
+
+from zoobot.pytorch.estimators import define_model
+
+
+class TinyZoobotModule(define_model.GenericLightningModule):
+
+    def __init__(self):
+        super().__init__()
+        self.model = torch.nn.Linear(4, 3)  # not 2, which would log accuracy
+        self.loss_func = lambda predictions, labels: torch.mean((predictions - labels) ** 2, dim=1)
+        self.reference_batch_size = 16
+
+    def setup_metrics(self):
+        self.log_on_step = True  # no accuracy metrics needed
+
+
+class TinyDataModule(pl.LightningDataModule):
+
+    def __init__(self, batch_size=4):
+        super().__init__()
+        self.batch_size = batch_size
+
+    def train_dataloader(self):
+        dataset = torch.utils.data.TensorDataset(torch.randn(32, 4), torch.randn(32, 3))
+        return torch.utils.data.DataLoader(dataset, batch_size=self.batch_size)
+
+
+def test_scale_learning_rate():
+    trainer = types.SimpleNamespace(datamodule=types.SimpleNamespace(batch_size=128), world_size=2, accumulate_grad_batches=2)
+    assert define_model.get_effective_batch_size(trainer) == 512
+    assert define_model.scale_learning_rate(0.001, 512, reference_batch_size=512) == 0.001
+    assert define_model.scale_learning_rate(0.001, 256, reference_batch_size=512) == 0.0005
+
+
+def test_gradient_accumulation_logging(tmp_path):
+    model = TinyZoobotModule()
+    trainer = pl.Trainer(
+        max_epochs=1, accelerator='cpu', accumulate_grad_batches=2, logger=pl.loggers.CSVLogger(str(tmp_path)), log_every_n_steps=1,
+        enable_checkpointing=False, enable_progress_bar=False
+    )
+    trainer.fit(model, TinyDataModule(batch_size=4))
+
+    # 8 batches of 4, accumulated in pairs: 4 optimizer steps of 8 galaxies, so learning rate halved for reference batch size 16
+    assert trainer.global_step == 4
+    assert trainer.optimizers[0].param_groups[0]['lr'] == pytest.approx(0.0005)
+    metrics = pd.read_csv(trainer.logger.experiment.metrics_file_path)
+    assert metrics['train/accumulated_supervised_loss'].notna().sum() == 4
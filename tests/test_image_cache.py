@@ -0,0 +1,60 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+import torch
+
+from zoobot.pytorch.data_utils import image_cache
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    file_locs = []
+    for n in range(10):
+        file_loc = str(tmp_path / 'galaxy_{}.png'.format(n))
+        Image.fromarray(np.random.randint(0, 255, size=(64, 64, 3), dtype=np.uint8)).save(file_loc)
+        file_locs.append(file_loc)
+    return pd.DataFrame({'file_loc': file_locs, 'smooth-or-featured_smooth': np.arange(10)})
+
+
+@pytest.mark.parametrize('greyscale', [True, False])
+def test_cache_images(catalog, tmp_path, greyscale):
+    file_locs = list(catalog['file_loc'])
+    cache_loc = image_cache.get_cache_loc(file_locs, str(tmp_path), cache_size=32, greyscale=greyscale)
+    image_cache.cache_images(file_locs, cache_loc, cache_size=32, greyscale=greyscale, num_workers=2, chunk_size=3)
+
+    images = np.load(cache_loc, mmap_mode='r')
+    assert images.shape == (10, 32, 32, 1 if greyscale else 3)
+    for n in [0, 4, 9]:
+        assert np.array_equal(images[n], image_cache.load_resized_image(file_locs[n], 32, greyscale))
+
+
+def test_cached_galaxy_dataset(catalog, tmp_path):
+    file_locs = list(catalog['file_loc'])
+    cache_loc = image_cache.get_cache_loc(file_locs, str(tmp_path), cache_size=32, greyscale=True)
+    image_cache.cache_images(file_locs, cache_loc, cache_size=32, greyscale=True, num_workers=2)
+
+    # e.g. a shuffled split of the cached catalog
+    split_catalog = catalog.sample(frac=0.5, random_state=42)
+    cache_indices = pd.Index(file_locs).get_indexer(split_catalog['file_loc'])
+    dataset = image_cache.CachedGalaxyDataset(
+        split_catalog, ['smooth-or-featured_smooth'], cache_loc, cache_indices,
+        transform=lambda image: torch.from_numpy(image).permute(2, 0, 1) / 255.  # as transforms.ToTensor
+    )
+
+    image, label = dataset[0]
+    assert image.shape == (1, 32, 32)
+    assert image.max() <= 1.
+    assert label == split_catalog['smooth-or-featured_smooth'].iloc[0]
+
+
+def test_wait_for_cache(catalog, tmp_path, monkeypatch):
+    monkeypatch.setenv('LOCAL_RANK', '1')
+    assert image_cache.get_local_rank() == 1
+
+    cache_loc = str(tmp_path / 'cache.npy')
+    with pytest.raises(TimeoutError):
+        image_cache.wait_for_cache(cache_loc, timeout=0.2, poll_interval=0.1)
+    image_cache.cache_images(list(catalog['file_loc']), cache_loc, cache_size=32, num_workers=1)
+    assert image_cache.wait_for_cache(cache_loc, timeout=0.2, poll_interval=0.1) == cache_loc
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+import numpy as np
+from PIL import Image
+
+from zoobot.tensorflow.data_utils import image_datasets
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    paths = []
+    for n in range(10):
+        path = str(tmp_path / 'galaxy_{}.png'.format(n))
+        Image.fromarray(np.full((32, 32, 3), n, dtype=np.uint8)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_check_paths_exist(image_paths, tmp_path):
+    assert image_datasets.check_paths_exist(image_paths) == []
+    missing = [str(tmp_path / 'missing.png'), str(tmp_path / 'missing_dir' / 'galaxy_0.png')]
+    assert image_datasets.check_paths_exist(image_paths[:2] + missing + image_paths[2:]) == missing
+
+
+def test_get_image_size_on_disk(image_paths):
+    assert image_datasets.get_image_size_on_disk(image_paths[0]) == 32
+
+
+def test_get_image_dataset(image_paths):
+    dataset = image_datasets.get_image_dataset(image_paths, 'png', requested_img_size=32, batch_size=4, labels=list(range(10)))
+    batches = list(dataset)
+    assert [batch['matrix'].shape[0] for batch in batches] == [4, 4, 2]
+    images = np.concatenate([batch['matrix'].numpy() for batch in batches])
+    labels = np.concatenate([batch['label'].numpy() for batch in batches])
+    # parallel decoding keeps the order of image_paths
+    np.testing.assert_array_equal(images[:, 0, 0, 0], np.arange(10))
+    np.testing.assert_array_equal(labels, np.arange(10))
+    assert [os.path.basename(path.decode()) for batch in batches for path in batch['id_str'].numpy()] == [os.path.basename(path) for path in image_paths]
+
+    with pytest.raises(FileNotFoundError):
+        image_datasets.get_image_dataset(image_paths + ['missing.png'], 'png', requested_img_size=32, batch_size=4)
+
+
+def test_resize_image():
+    image = np.random.randint(0, 256, size=(8, 8, 3)).astype(np.uint8)
+    resized = image_datasets.resize_image(image, 4, method='area').numpy()
+    # integer factor: box downsampling
+    np.testing.assert_allclose(resized, image.reshape(4, 2, 4, 2, 3).mean(axis=(1, 3)), rtol=1e-5)
+    lanczos = image_datasets.resize_image(image, 4).numpy()
+    assert lanczos.min() >= 0. and lanczos.max() <= 255.
+
+
+def test_get_image_dataset_resized(image_paths):
+    dataset = image_datasets.get_image_dataset(image_paths, 'png', requested_img_size=16, batch_size=4, resize_method='area', keep_uint8=True)
+    images = np.concatenate([batch['matrix'].numpy() for batch in dataset])
+    assert images.dtype == np.uint8
+    assert images.shape == (10, 16, 16, 3)
+    np.testing.assert_array_equal(images[:, 0, 0, 0], np.arange(10))
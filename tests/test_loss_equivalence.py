@@ -6,6 +6,7 @@ import numpy as np
 
 from zoobot.tensorflow.training import losses as tf_losses
 from zoobot.pytorch.training import losses as torch_losses
+from zoobot.pytorch.estimators import define_model
 
 
 @pytest.fixture
@@ -53,3 +54,38 @@ def test_multiquestion_loss(single_question_context):
     log_prob_torch = torch_losses.calculate_multiquestion_loss(torch.from_numpy(labels_both), torch.from_numpy(concentrations_both), question_index_groups).numpy()
 
     assert np.isclose(log_prob_tf, log_prob_torch).all()
+
+
+def test_sparse_multiquestion_loss(single_question_context):
+    labels_a, _, concentrations_a = single_question_context(answers=2)
+    labels_b, _, concentrations_b = single_question_context(answers=3)
+    labels_b[::2] = 0  # every other galaxy has no votes for question b e.g. from another campaign
+
+    labels_both = np.concatenate([labels_a, labels_b], axis=1)
+    concentrations_both = np.concatenate([concentrations_a, concentrations_b], axis=1)
+    question_index_groups = [(0, 1), (2, 4)]
+
+    log_prob_tf = tf_losses.calculate_multiquestion_loss(labels_both, concentrations_both, question_index_groups).numpy()
+    log_prob_torch_sparse = torch_losses.calculate_sparse_multiquestion_loss(torch.from_numpy(labels_both), torch.from_numpy(concentrations_both), question_index_groups).numpy()
+
+    assert np.isclose(log_prob_tf, log_prob_torch_sparse).all()
+    assert (log_prob_torch_sparse[::2, 1] == 0).all()
+
+
+def test_masked_loss_func(single_question_context):
+    labels_a, _, concentrations_a = single_question_context(answers=2)
+    labels_b, _, concentrations_b = single_question_context(answers=3)
+    labels = torch.from_numpy(np.concatenate([labels_a, labels_b], axis=1))
+    concentrations = torch.from_numpy(np.concatenate([concentrations_a, concentrations_b], axis=1))
+    question_index_groups = [(0, 1), (2, 4)]
+    question_mask = torch.ones(len(labels), 2, dtype=torch.bool)
+    question_mask[::2, 1] = False  # e.g. question b not asked in the campaign of every other galaxy
+
+    loss_func = define_model.get_loss_func(question_index_groups, sparse=True, masked=True)
+    loss = loss_func(concentrations, torch.cat([labels, question_mask.to(labels.dtype)], dim=1))
+    expected = torch_losses.calculate_sparse_multiquestion_loss(labels, concentrations, question_index_groups, question_mask=question_mask)
+    assert torch.allclose(loss, expected)
+    assert (loss[::2, 1] == 0).all()
+
+    with pytest.raises(ValueError):
+        define_model.get_loss_func(question_index_groups, masked=True)
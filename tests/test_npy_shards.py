@@ -0,0 +1,50 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from zoobot.pytorch.data_utils import npy_shards, image_cache
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    rows = []
+    for n in range(10):
+        file_loc = str(tmp_path / 'galaxy_{}.png'.format(n))
+        Image.fromarray(np.random.randint(0, 255, size=(64, 64, 3), dtype=np.uint8)).save(file_loc)
+        rows.append({'id_str': 'galaxy_{}'.format(n), 'file_loc': file_loc, 'smooth-or-featured_smooth': n, 'smooth-or-featured_featured-or-disk': 2 * n})
+    return pd.DataFrame(rows)
+
+
+def test_npy_shards(catalog, tmp_path):
+    label_cols = ['smooth-or-featured_smooth', 'smooth-or-featured_featured-or-disk']
+    save_dir = str(tmp_path / 'shards')
+    index = npy_shards.write_catalog_to_npy_shards(catalog, 32, label_cols, save_dir, shard_size=4, greyscale=True, num_workers=2)
+
+    assert len(index) == 10
+    assert index['shard'].nunique() == 3  # 4, 4, 2
+
+    # read back in a specific order
+    dataset = npy_shards.NpyShardDataset(save_dir, id_strs=catalog['id_str'])
+    assert len(dataset) == 10
+    for n in [0, 5, 9]:
+        image, label = dataset[n]
+        assert image.dtype == np.uint8
+        assert np.array_equal(image, image_cache.load_resized_image(catalog['file_loc'][n], 32, greyscale=True))
+        assert np.array_equal(label, catalog.loc[n, label_cols].values.astype(np.float32))
+
+
+def test_npy_shard_datamodule(catalog, tmp_path):
+    galaxy_datamodule = pytest.importorskip('zoobot.pytorch.data_utils.galaxy_datamodule')
+
+    label_cols = ['smooth-or-featured_smooth', 'smooth-or-featured_featured-or-disk']
+    split_dirs = npy_shards.prepare_npy_shards(catalog, label_cols, str(tmp_path / 'shards'), size=32, shard_size=4, num_workers=2)
+    datamodule = galaxy_datamodule.NpyShardDataModule(
+        train_dir=split_dirs['train'], val_dir=split_dirs['val'], test_dir=split_dirs['test'],
+        resize_size=24, batch_augmentation=True, batch_size=2, num_workers=0, prefetch_factor=None
+    )
+    datamodule.setup()
+    assert datamodule.label_cols == label_cols
+    image, label = datamodule.train_dataset[0]
+    assert image.shape == (1, 32, 32)  # uint8, augmented later by the model
@@ -0,0 +1,92 @@
+import json
+
+import torch
+import pytorch_lightning as pl
+
+from zoobot.pytorch.estimators import custom_callbacks, batch_augmentations
+
+
+class TinyDataModule(pl.LightningDataModule):
+    # as ZoobotDataModule(batch_augmentation=True): uint8 images, resized by the model
+
+    def __init__(self, resize_size=32, batch_size=4):
+        super().__init__()
+        self.resize_size = resize_size
+        self.batch_size = batch_size
+        self.train_batch_size = batch_size
+        self.train_dataloader_calls = 0
+        self.dataset = torch.utils.data.TensorDataset(torch.randint(0, 255, (32, 1, 48, 48), dtype=torch.uint8), torch.randn(32, 2))
+
+    def set_train_resolution(self, resize_size, batch_size):
+        self.train_batch_size = batch_size
+
+    def train_dataloader(self):
+        self.train_dataloader_calls += 1
+        return torch.utils.data.DataLoader(self.dataset, batch_size=self.train_batch_size)
+
+    def val_dataloader(self):
+        return torch.utils.data.DataLoader(self.dataset, batch_size=self.batch_size)
+
+
+class TinyModule(pl.LightningModule):
+
+    def __init__(self):
+        super().__init__()
+        self.model = torch.nn.Sequential(torch.nn.Conv2d(1, 2, 3), torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten())
+        self.batch_augmentation = batch_augmentations.BatchAugmentation(resize_size=32)
+        self.train_shapes = []
+        self.val_shapes = []
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        x, labels = batch
+        return self.batch_augmentation(x), labels
+
+    def forward(self, x):
+        return self.model(x)
+
+    def training_step(self, batch, batch_idx):
+        x, y = batch
+        self.train_shapes.append((self.current_epoch, tuple(x.shape)))
+        return torch.nn.functional.mse_loss(self(x), y)
+
+    def validation_step(self, batch, batch_idx):
+        x, y = batch
+        self.val_shapes.append(tuple(x.shape))
+
+    def configure_optimizers(self):
+        return torch.optim.SGD(self.parameters(), lr=0.1)
+
+
+def test_get_progressive_resizing_schedule():
+    schedule = custom_callbacks.get_progressive_resizing_schedule(resize_size=380, batch_size=64, stages=3, epochs_per_stage=5)
+    assert [stage['epoch'] for stage in schedule] == [0, 5, 10]
+    assert [stage['resize_size'] for stage in schedule] == [190, 285, 380]
+    assert schedule[0]['batch_size'] == 256
+    assert schedule[-1]['batch_size'] == 64
+
+
+def test_progressive_resizing(tmp_path):
+    schedule = [
+        {'epoch': 0, 'resize_size': 16, 'batch_size': 16},
+        {'epoch': 2, 'resize_size': 32, 'batch_size': 4}
+    ]
+    save_loc = str(tmp_path / 'schedule.json')
+    model = TinyModule()
+    trainer = pl.Trainer(
+        max_epochs=4, accelerator='cpu', logger=False, enable_checkpointing=False, enable_progress_bar=False, num_sanity_val_steps=0,
+        callbacks=[custom_callbacks.ProgressiveResizing(schedule, save_loc=save_loc)]
+    )
+    datamodule = TinyDataModule()
+    trainer.fit(model, datamodule)
+
+    assert datamodule.train_dataloader_calls == 2  # once per stage, not once per epoch
+
+    for epoch, shape in model.train_shapes:
+        if epoch < 2:
+            assert shape == (16, 1, 16, 16)
+        else:
+            assert shape == (4, 1, 32, 32)
+    assert set(model.val_shapes) == {(4, 1, 32, 32)}  # always at final resolution
+    assert 'batch_augmentation' not in model.__dict__  # model's own augmentation restored
+    with open(save_loc, 'r') as f:
+        assert json.load(f)['schedule'] == schedule
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from PIL import Image
+
+from zoobot.tensorflow.data_utils import create_tfrecord, tfrecord_datasets, catalog_to_tfrecord
+from zoobot.tensorflow.estimators import preprocess, custom_layers
+
+
+def write_tfrecords(tmp_path, label_cols, n_records=3, galaxies_per_record=7, image_format='raw', compression_type=None):
+    rng = np.random.default_rng(0)
+    tfrecord_locs = []
+    for record_n in range(n_records):
+        tfrecord_loc = str(tmp_path / 's{}_{}.tfrecord'.format(record_n, image_format))
+        with tf.io.TFRecordWriter(tfrecord_loc, options=tf.io.TFRecordOptions(compression_type=compression_type)) as writer:
+            for galaxy_n in range(galaxies_per_record):
+                labels = dict(zip(label_cols, rng.uniform(0, 40, size=len(label_cols))))
+                matrix = rng.integers(0, 256, size=(8, 8, 3)).astype(np.uint8)
+                writer.write(create_tfrecord.serialize_image_example(matrix, image_format=image_format, id_str='{}_{}'.format(record_n, galaxy_n), **labels))
+        tfrecord_locs.append(tfrecord_loc)
+    return tfrecord_locs
+
+
+def test_get_tfrecord_dataset(tmp_path):
+    label_cols = ['answer_{}'.format(n) for n in range(34)]
+    tfrecord_locs = write_tfrecords(tmp_path, label_cols)
+
+    # batch parsing should match parsing each example, then batching
+    expected = list(tfrecord_datasets.load_tfrecords(list(tfrecord_locs), tfrecord_datasets.get_feature_spec(label_cols)).batch(4))
+    batches = list(tfrecord_datasets.get_tfrecord_dataset(list(tfrecord_locs), label_cols, batch_size=4, shuffle=False))
+
+    assert len(batches) == len(expected) == 6  # 21 galaxies
+    for batch, expected_batch in zip(batches, expected):
+        assert set(batch.keys()) == set(expected_batch.keys()) == set(['matrix', 'id_str'] + label_cols)
+        for key in batch.keys():
+            assert batch[key].dtype == expected_batch[key].dtype
+            np.testing.assert_array_equal(batch[key].numpy(), expected_batch[key].numpy())
+    assert batches[0]['matrix'].shape == (4, 8 * 8 * 3)
+    # interleaved: 1st in s0, 1st in s1, ...
+    assert [id_str.decode() for id_str in batches[0]['id_str'].numpy()] == ['0_0', '1_0', '2_0', '0_1']
+
+    batches = list(tfrecord_datasets.get_tfrecord_dataset(list(tfrecord_locs), label_cols, batch_size=4, shuffle=False, drop_remainder=True))
+    assert len(batches) == 5
+
+
+def test_keep_uint8(tmp_path):
+    label_cols = ['answer_{}'.format(n) for n in range(2)]
+    tfrecord_locs = write_tfrecords(tmp_path, label_cols)
+
+    float_config = preprocess.PreprocessingConfig(label_cols, input_size=8, make_greyscale=True, normalise_from_uint8=False)
+    float_dataset = preprocess.preprocess_dataset(
+        tfrecord_datasets.get_tfrecord_dataset(list(tfrecord_locs), label_cols, batch_size=4, shuffle=False), float_config)
+
+    uint8_config = preprocess.PreprocessingConfig(label_cols, input_size=8, make_greyscale=False, normalise_from_uint8=False, keep_uint8=True)
+    uint8_dataset = preprocess.preprocess_dataset(
+        tfrecord_datasets.get_tfrecord_dataset(list(tfrecord_locs), label_cols, batch_size=4, shuffle=False, keep_uint8=True), uint8_config)
+    input_layer = custom_layers.InputPreprocessing(normalise_from_uint8=True, make_greyscale=True)
+
+    for (float_images, float_labels), (uint8_images, uint8_labels) in zip(float_dataset, uint8_dataset):
+        assert uint8_images.dtype == tf.uint8
+        assert uint8_images.shape[1:] == (8, 8, 3)
+        np.testing.assert_allclose(input_layer(uint8_images).numpy(), float_images.numpy(), rtol=1e-6)
+        np.testing.assert_array_equal(uint8_labels.numpy(), float_labels.numpy())
+
+
+def test_encoded_images(tmp_path):
+    label_cols = ['answer_0']
+    expected = np.concatenate([
+        batch['matrix'].numpy() for batch in tfrecord_datasets.get_tfrecord_dataset(write_tfrecords(tmp_path, label_cols), label_cols, batch_size=4, shuffle=False)
+    ])
+
+    png_locs = write_tfrecords(tmp_path, label_cols, image_format='png', compression_type='GZIP')
+    png = np.concatenate([
+        batch['matrix'].numpy() for batch in tfrecord_datasets.get_tfrecord_dataset(png_locs, label_cols, batch_size=4, shuffle=False, image_format='png', compression_type='GZIP')
+    ])
+    np.testing.assert_array_equal(png, expected)  # lossless
+
+    jpeg_locs = write_tfrecords(tmp_path, label_cols, image_format='jpeg')
+    jpeg = np.concatenate([
+        batch['matrix'].numpy() for batch in tfrecord_datasets.get_tfrecord_dataset(jpeg_locs, label_cols, batch_size=4, shuffle=False, image_format='jpeg', keep_uint8=True)
+    ])
+    assert jpeg.dtype == np.uint8
+    assert jpeg.shape == expected.shape
+
+
+def test_greyscale_shards(tmp_path):
+    rng = np.random.default_rng(0)
+    file_locs = []
+    for n in range(6):
+        file_locs.append(str(tmp_path / 'galaxy_{}.png'.format(n)))
+        Image.fromarray(rng.integers(0, 256, size=(16, 16, 3)).astype(np.uint8)).save(file_locs[-1])
+    df = pd.DataFrame({'file_loc': file_locs, 'id_str': [str(n) for n in range(6)]})
+
+    images = {}
+    for channels in [3, 1]:
+        tfrecord_loc = str(tmp_path / 'channels_{}.tfrecord'.format(channels))
+        catalog_to_tfrecord.write_image_df_to_tfrecord(
+            df, tfrecord_loc, img_size=16, columns_to_save=['id_str'], reader=catalog_to_tfrecord.load_png_as_pil, greyscale=channels == 1)
+        config = preprocess.PreprocessingConfig([], input_size=16, make_greyscale=True, normalise_from_uint8=False, input_channels=channels)
+        dataset = preprocess.preprocess_dataset(tfrecord_datasets.get_tfrecord_dataset([tfrecord_loc], [], batch_size=4, shuffle=False), config)
+        images[channels] = np.concatenate([batch_images.numpy() for batch_images, _ in dataset])
+
+    assert images[1].shape == images[3].shape == (6, 16, 16, 1)
+    # averaged once when saved, then rounded to uint8
+    np.testing.assert_allclose(images[1], images[3], atol=0.5 / 255 + 1e-6)
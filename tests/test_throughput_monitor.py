@@ -0,0 +1,47 @@
+import json
+
+import pytest
+import torch
+import pytorch_lightning as pl
+
+from zoobot.pytorch.estimators import custom_callbacks
+
+
+class TinyModule(pl.LightningModule):
+
+    def __init__(self):
+        super().__init__()
+        self.model = torch.nn.Linear(4, 2)
+
+    def forward(self, x):
+        return self.model(x)
+
+    def training_step(self, batch, batch_idx):
+        x, y = batch
+        return torch.nn.functional.mse_loss(self(x), y)
+
+    def configure_optimizers(self):
+        return torch.optim.SGD(self.parameters(), lr=0.1)
+
+
+def test_throughput_monitor(tmp_path):
+    dataset = torch.utils.data.TensorDataset(torch.randn(32, 4), torch.randn(32, 2))
+    dataloader = torch.utils.data.DataLoader(dataset, batch_size=8)
+    save_loc = str(tmp_path / 'throughput.jsonl')
+
+    trainer = pl.Trainer(
+        max_epochs=2, accelerator='cpu', logger=pl.loggers.CSVLogger(str(tmp_path)), log_every_n_steps=1, enable_checkpointing=False, enable_progress_bar=False,
+        callbacks=[custom_callbacks.ThroughputMonitor(save_loc=save_loc)]
+    )
+    trainer.fit(TinyModule(), dataloader)
+
+    with open(save_loc, 'r') as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 8  # 4 steps per epoch
+    for record in records:
+        assert record['batch_size'] == 8
+        for key in ['data_wait', 'transfer', 'forward', 'loss', 'backward', 'optimizer']:
+            assert record[key] >= 0
+        assert sum(record[key] for key in ['data_wait', 'transfer', 'forward', 'loss', 'backward', 'optimizer']) <= record['step_time'] * 1.01
+        assert record['images_per_sec'] > 0
+        assert record['peak_rss_mb'] > 0
@@ -0,0 +1,48 @@
+import numpy as np
+import torch
+
+from zoobot.pytorch.transfer_learning import representations, finetune
+
+
+class RandomShiftDataset(torch.utils.data.Dataset):
+    # a different random 'augmentation' each time an item is loaded
+
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, idx):
+        return torch.full((4,), float(idx)) + torch.rand(4), 0
+
+
+def test_extract_representations(tmp_path):
+    torch.manual_seed(0)
+    encoder = torch.nn.Linear(4, 3)
+    dataloader = torch.utils.data.DataLoader(RandomShiftDataset(), batch_size=4)
+    save_loc = str(tmp_path / 'representations.npy')
+
+    features = representations.extract_representations(encoder, dataloader, save_loc, n_views=2, device='cpu')
+
+    assert features.shape == (2, 10, 3)
+    assert not np.allclose(features[0], features[1])  # views differ
+    loaded = representations.load_representations(save_loc)
+    assert np.allclose(loaded, features)
+    # galaxies stay in order
+    with torch.no_grad():
+        expected = encoder(torch.arange(10).float()[:, None].repeat(1, 4) + 0.5).numpy()
+    assert np.allclose(loaded.mean(axis=0), expected, atol=0.5)
+
+
+def test_train_head():
+    rng = np.random.default_rng(0)
+    features = rng.normal(size=(3, 500, 8)).astype(np.float32)
+    labels = (features.mean(axis=0)[:, 0] > 0).astype(np.int64)
+    train_loader = finetune.RepresentationLoader(features[:, :400], labels[:400], batch_size=64, shuffle=True)
+    val_loader = finetune.RepresentationLoader(features[:, 400:], labels[400:], batch_size=64)
+
+    head = finetune.get_head('linear', input_dim=8, output_dim=2)
+    head, history = finetune.train_head(head, train_loader, torch.nn.functional.cross_entropy, val_loader=val_loader, epochs=50, learning_rate=0.01)
+
+    assert history['val_loss'][-1] < history['val_loss'][0]
+    predictions = finetune.predict_with_head(head, val_loader)
+    assert predictions.shape == (100, 2)
+    assert np.mean(predictions.argmax(axis=1) == labels[400:]) > 0.8
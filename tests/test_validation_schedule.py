@@ -0,0 +1,69 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from zoobot.pytorch.data_utils import npy_shards
+
+
+def test_get_val_patience():
+    train_with_pytorch_lightning = pytest.importorskip('zoobot.pytorch.training.train_with_pytorch_lightning')
+
+    assert train_with_pytorch_lightning.get_val_patience(8) == 8
+    assert train_with_pytorch_lightning.get_val_patience(8, check_val_every_n_epoch=3) == 3
+    assert train_with_pytorch_lightning.get_val_patience(8, val_checks_per_epoch=train_with_pytorch_lightning.get_val_checks_per_epoch(0.25, None)) == 32
+    assert train_with_pytorch_lightning.get_val_checks_per_epoch(100, train_batches=450) == 4
+
+
+def test_get_validation_dataset():
+    tf = pytest.importorskip('tensorflow')
+    training_config = pytest.importorskip('zoobot.tensorflow.training.training_config')
+
+    test_dataset = tf.data.Dataset.range(10).batch(2)
+    train_config = training_config.TrainConfig(validation_steps=3, validation_repeats=2)
+    batches = [batch.numpy().tolist() for batch in training_config.get_validation_dataset(test_dataset, train_config)]
+    assert batches == [[0, 1], [2, 3], [4, 5]] * 2
+
+
+def test_get_validation_patience():
+    tf = pytest.importorskip('tensorflow')
+    training_config = pytest.importorskip('zoobot.tensorflow.training.training_config')
+
+    assert training_config.get_validation_patience(training_config.TrainConfig(patience=8, validation_freq=3)) == 3
+    # 400 batches per pass in keras epochs of 100 batches
+    train_config = training_config.TrainConfig(patience=8, validation_freq=2, steps_per_epoch=100)
+    train_batches = training_config.get_train_batches(tf.data.Dataset.range(1600).batch(4))
+    assert train_batches == 400
+    assert training_config.get_validation_patience(train_config, train_batches=train_batches) == 16
+    # length unknown, so patience counts keras epochs
+    assert training_config.get_train_batches(tf.data.Dataset.range(1600).filter(lambda x: x > 0).batch(4)) is None
+    assert training_config.get_validation_patience(train_config) == 4
+
+
+def test_val_subsample_and_mc_passes(tmp_path):
+    galaxy_datamodule = pytest.importorskip('zoobot.pytorch.data_utils.galaxy_datamodule')
+
+    rows = []
+    for n in range(30):
+        file_loc = str(tmp_path / 'galaxy_{}.png'.format(n))
+        Image.fromarray(np.random.randint(0, 255, size=(32, 32, 3), dtype=np.uint8)).save(file_loc)
+        rows.append({'id_str': 'galaxy_{}'.format(n), 'file_loc': file_loc, 'smooth-or-featured_smooth': n})
+    catalog = pd.DataFrame(rows)
+    split_dirs = npy_shards.prepare_npy_shards(catalog, ['smooth-or-featured_smooth'], str(tmp_path / 'shards'), size=32, shard_size=8, num_workers=1)
+
+    def get_val_labels(**kwargs):
+        datamodule = galaxy_datamodule.NpyShardDataModule(
+            train_dir=split_dirs['train'], val_dir=split_dirs['val'], test_dir=split_dirs['test'],
+            resize_size=24, batch_augmentation=True, batch_size=2, num_workers=0, prefetch_factor=None, **kwargs
+        )
+        datamodule.setup()
+        assert len(datamodule.val_dataloader().dataset) == len(datamodule.get_val_dataset())
+        return [float(label) for _, label in datamodule.get_val_dataset()]
+
+    all_labels = get_val_labels()
+    subsample = get_val_labels(val_subsample_size=2)
+    assert len(subsample) == 2
+    assert set(subsample) < set(all_labels)
+    assert get_val_labels(val_subsample_size=2) == subsample  # same galaxies every time
+    assert get_val_labels(val_subsample_size=2, val_mc_passes=2) == subsample * 2
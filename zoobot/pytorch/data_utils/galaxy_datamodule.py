@@ -0,0 +1,212 @@
+import os
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Subset, ConcatDataset
+from torchvision import transforms
+
+from pytorch_galaxy_datasets.galaxy_datamodule import GalaxyDataModule, default_torchvision_transforms
+
+from zoobot.pytorch.data_utils import image_cache, npy_shards
+
+
+class ZoobotDataModule(GalaxyDataModule):
+    """
+    GalaxyDataModule, optionally reading images from a preloaded uint8 cache instead of decoding every image every epoch.
+
+    With cache_images=True, every image in the provided catalog(s) is decoded and resized once into a single array under cache_dir
+    (by default /dev/shm i.e. shared memory; a local SSD also works).
+    All dataloader workers and all ranks on a node then memmap that same array. Augmentations run on the cached images as usual.
+
+    Args:
+        cache_images (bool, optional): if True, cache images before training. Defaults to False.
+        cache_dir (str, optional): directory for the cache. Must have enough space (images * cache_size^2 * channels bytes). Defaults to '/dev/shm'.
+        cache_size (int, optional): cached image size. Defaults to None, meaning large enough that the smallest crop is still ~resize_size.
+        cache_num_workers (int, optional): processes used to build the cache. Defaults to None, meaning all cpus.
+        cache_wait_timeout (float, optional): seconds for ranks other than local rank 0 to wait for the cache to be built. Defaults to 6 hours.
+        batch_augmentation (bool, optional): if True, workers only decode images to uint8 CHW tensors, leaving augmentation
+            to the model (see ZoobotLightningModule(batch_augmentation=True)). Images must then all be the same size (as in a cache). Defaults to False.
+        val_subsample_size (int, optional): validate on only this many val galaxies - the same (randomly chosen) galaxies every time. Defaults to None (all).
+        val_mc_passes (int, optional): validate on each val galaxy this many times, each with different augmentations, to reduce variance. Defaults to 1.
+        *args, **kwargs: passed to GalaxyDataModule
+    """
+    def __init__(self, *args, cache_images=False, cache_dir='/dev/shm', cache_size=None, cache_num_workers=None, cache_wait_timeout=6 * 3600, batch_augmentation=False, val_subsample_size=None, val_mc_passes=1, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.val_subsample_size = val_subsample_size
+        self.val_mc_passes = val_mc_passes
+
+        self.batch_augmentation = batch_augmentation
+        if self.batch_augmentation:
+            logging.info('Augmenting on device - dataloader will only decode images')
+            self.transform = to_uint8_tensor
+
+        self.cache_images = cache_images
+        self.cache_dir = cache_dir
+        if cache_size is None:
+            cache_size = image_cache.get_cache_size(self.resize_size, self.crop_scale_bounds)
+        self.cache_size = cache_size
+        if cache_num_workers is None:
+            cache_num_workers = os.cpu_count()
+        self.cache_num_workers = cache_num_workers
+        self.cache_wait_timeout = cache_wait_timeout
+
+        # optionally, train at a different resolution and batch size to validation. See set_train_resolution.
+        self.train_resize_size = None
+        self.train_batch_size = None
+
+        if self.cache_images:
+            # all images across all catalogs, in a fixed order, so every rank agrees on the cache contents and location
+            self.cached_file_locs = self.get_file_locs_to_cache()
+            self.cache_loc = image_cache.get_cache_loc(self.cached_file_locs, self.cache_dir, self.cache_size, self.greyscale)
+            logging.info('Caching {} images at {}px'.format(len(self.cached_file_locs), self.cache_size))
+
+    def get_file_locs_to_cache(self):
+        catalogs = [self.catalog, self.train_catalog, self.val_catalog, self.test_catalog, self.predict_catalog]
+        file_locs = pd.concat([df['file_loc'] for df in catalogs if df is not None])
+        return list(file_locs.drop_duplicates())
+
+    # only called on main process (per node)
+    def prepare_data(self):
+        if self.cache_images:
+            self.build_cache()
+
+    def build_cache(self):
+        image_cache.cache_images(
+            self.cached_file_locs,
+            self.cache_loc,
+            cache_size=self.cache_size,
+            greyscale=self.greyscale,
+            num_workers=self.cache_num_workers
+        )
+
+    # called on every gpu
+    def setup(self, stage: Optional[str] = None):
+        super().setup(stage)  # splits catalog if needed, creates (uncached) datasets
+
+        if self.cache_images:
+            if not os.path.isfile(self.cache_loc):
+                # e.g. setup called directly, without a trainer calling prepare_data first
+                # still only build once per node - other ranks wait, rather than each decoding every image into their own copy
+                if image_cache.get_local_rank() == 0:
+                    self.build_cache()
+                else:
+                    image_cache.wait_for_cache(self.cache_loc, timeout=self.cache_wait_timeout)
+            cache_index = pd.Index(self.cached_file_locs)
+            for dataset_attr in ['train_dataset', 'val_dataset', 'test_dataset', 'predict_dataset']:
+                dataset = getattr(self, dataset_attr, None)
+                if dataset is not None:
+                    setattr(self, dataset_attr, self.get_cached_dataset(dataset.catalog, cache_index))
+
+    def set_train_resolution(self, resize_size, batch_size):
+        """
+        Train at resize_size and batch_size, instead of self.resize_size and self.batch_size, from the next call to train_dataloader.
+        Other dataloaders are unchanged. Used by custom_callbacks.ProgressiveResizing.
+
+        Args:
+            resize_size (int): train image size
+            batch_size (int): train batch size
+        """
+        if self.album and not self.batch_augmentation:
+            raise NotImplementedError('Changing train resolution is only supported for torchvision or batch augmentations')
+        self.train_resize_size = resize_size
+        self.train_batch_size = batch_size
+
+    def get_train_transform(self):
+        if self.batch_augmentation or (self.train_resize_size is None):
+            return self.transform  # with batch augmentation, the model sets the resolution
+        return transforms.Compose(default_torchvision_transforms(self.greyscale, self.train_resize_size, self.crop_scale_bounds, self.crop_ratio_bounds))
+
+    def train_dataloader(self):
+        if self.train_resize_size is None:
+            return super().train_dataloader()
+        # datasets are created in setup, which may be called again by the trainer - so apply the train transform here
+        self.train_dataset.transform = self.get_train_transform()
+        return DataLoader(self.train_dataset, batch_size=self.train_batch_size, shuffle=True, num_workers=self.num_workers, pin_memory=True, persistent_workers=self.num_workers > 0, prefetch_factor=self.prefetch_factor, timeout=self.dataloader_timeout)
+
+    def val_dataloader(self):
+        if (self.val_subsample_size is None) and (self.val_mc_passes == 1):
+            return super().val_dataloader()
+        return DataLoader(self.get_val_dataset(), batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers, pin_memory=True, persistent_workers=self.num_workers > 0, prefetch_factor=self.prefetch_factor, timeout=self.dataloader_timeout)
+
+    def get_val_dataset(self):
+        """
+        Val dataset, cut to val_subsample_size galaxies and repeated val_mc_passes times.
+
+        Returns:
+            torch.utils.data.Dataset: val galaxies to use for each validation
+        """
+        dataset = self.val_dataset
+        if (self.val_subsample_size is not None) and (self.val_subsample_size < len(dataset)):
+            dataset = Subset(dataset, get_subsample_indices(len(dataset), self.val_subsample_size))
+        if self.val_mc_passes > 1:
+            dataset = ConcatDataset([dataset] * self.val_mc_passes)
+        return dataset
+
+    def get_cached_dataset(self, catalog, cache_index):
+        return image_cache.CachedGalaxyDataset(
+            catalog=catalog,
+            label_cols=self.label_cols,
+            cache_loc=self.cache_loc,
+            cache_indices=cache_index.get_indexer(catalog['file_loc']),
+            # images are already greyscale if requested. GrayscaleUnweighted is then a no-op on the single channel.
+            transform=self.transform
+        )
+
+
+class NpyShardDataModule(ZoobotDataModule):
+    """
+    Datamodule reading pre-resized images and labels from npy shards (see npy_shards.prepare_npy_shards), so workers never decode or resize.
+    Label columns are read from the shards. Augmentations are as for ZoobotDataModule (including batch_augmentation).
+
+    Args:
+        train_dir (str, optional): directory of train shards. Defaults to None.
+        val_dir (str, optional): directory of val shards. Defaults to None.
+        test_dir (str, optional): directory of test shards. Defaults to None.
+        predict_dir (str, optional): directory of shards to predict on. Defaults to None.
+        **kwargs: passed to ZoobotDataModule (excluding catalogs and label_cols)
+    """
+    def __init__(self, train_dir=None, val_dir=None, test_dir=None, predict_dir=None, **kwargs):
+        assert not kwargs.get('cache_images', False), 'npy shards are already decoded - no need to cache'
+        self.shard_dirs = {'train': train_dir, 'val': val_dir, 'test': test_dir, 'predict': predict_dir}
+        # use the shard indices as catalogs, so GalaxyDataModule can check which splits are available as usual
+        catalogs = dict([
+            (split + '_catalog', npy_shards.load_npy_shard_index(shard_dir))
+            for split, shard_dir in self.shard_dirs.items() if shard_dir is not None
+        ])
+        first_dir = [shard_dir for shard_dir in self.shard_dirs.values() if shard_dir is not None][0]
+        label_cols = npy_shards.load_npy_shard_config(first_dir)['label_cols']
+        super().__init__(label_cols=label_cols, **catalogs, **kwargs)
+
+    # called on every gpu
+    def setup(self, stage: Optional[str] = None):
+        # as GalaxyDataModule.setup, for pre-split shards
+        if stage == "fit" or stage is None:
+            self.train_dataset = self.get_shard_dataset('train')
+            self.val_dataset = self.get_shard_dataset('val')
+        if stage == "test" or stage is None:
+            self.test_dataset = self.get_shard_dataset('test')
+        if stage == 'predict':
+            self.predict_dataset = self.get_shard_dataset('predict')
+
+    def get_shard_dataset(self, split):
+        assert self.shard_dirs[split] is not None, 'No {} shards provided'.format(split)
+        return npy_shards.NpyShardDataset(self.shard_dirs[split], transform=self.transform)
+
+
+def get_subsample_indices(n_galaxies, subsample_size, seed=0):
+    # fixed seed, so every validation (and every rank, and every run) uses the same galaxies
+    # random rather than the first subsample_size galaxies, in case the catalog is sorted
+    # sorted, to read shards and caches in order
+    return np.sort(np.random.default_rng(seed).choice(n_galaxies, size=subsample_size, replace=False))
+
+
+def to_uint8_tensor(image):
+    # PIL image or HWC uint8 array (e.g. from cache) to CHW uint8 tensor, with no augmentation or rescaling
+    image = np.array(image)
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    return torch.from_numpy(image).permute(2, 0, 1)
@@ -0,0 +1,226 @@
+import os
+import logging
+import hashlib
+import shutil
+import time
+from functools import partial
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from tqdm import tqdm
+from torch.utils.data import Dataset
+
+
+def get_cache_size(resize_size, crop_scale_bounds):
+    """
+    Size (in pixels) at which to cache images, such that the smallest random crop still contains ~resize_size pixels across.
+    Caching directly at resize_size would mean every crop is then upsampled, blurring the training images.
+
+    Args:
+        resize_size (int): final (square) size of images after augmentations
+        crop_scale_bounds (tuple): min and max fraction of image area kept by RandomResizedCrop
+
+    Returns:
+        int: size to cache images at
+    """
+    return int(np.ceil(resize_size / np.sqrt(min(crop_scale_bounds))))
+
+
+def get_cache_loc(file_locs, cache_dir, cache_size, greyscale):
+    """
+    Deterministic cache location for a list of images at a given size.
+    All DDP ranks and dataloader workers calculate the same location, so only one copy is made (per node).
+
+    Args:
+        file_locs (list): paths to images to cache, in cache order
+        cache_dir (str): directory to place the cache. /dev/shm (RAM) or a local SSD are good choices.
+        cache_size (int): size of cached (square) images
+        greyscale (bool): if True, cache as greyscale (one channel)
+
+    Returns:
+        str: path to .npy cache file
+    """
+    hasher = hashlib.sha1()
+    hasher.update('\n'.join(file_locs).encode('utf-8'))
+    hasher.update('{}_{}'.format(cache_size, greyscale).encode('utf-8'))
+    return os.path.join(cache_dir, 'zoobot_image_cache_{}.npy'.format(hasher.hexdigest()[:16]))
+
+
+def cache_images(file_locs, cache_loc, cache_size, greyscale=True, num_workers=8, chunk_size=512):
+    """
+    Decode and resize every image in file_locs once, writing to a single uint8 .npy array of shape (image, height, width, channel).
+
+    Images are written in parallel into a temporary memmap, then atomically renamed to cache_loc.
+    If cache_loc already exists, does nothing (and so is safe to call from every rank).
+    Greyscale conversion (unweighted channel mean, as GrayscaleUnweighted) is done here to save memory.
+
+    Args:
+        file_locs (list): paths to images to cache. Cached image i corresponds to file_locs[i].
+        cache_loc (str): path to save cache, from get_cache_loc
+        cache_size (int): size of cached (square) images
+        greyscale (bool, optional): if True, cache as greyscale (one channel). Defaults to True.
+        num_workers (int, optional): processes used to decode images. Defaults to 8.
+        chunk_size (int, optional): images per decoding task. Defaults to 512.
+
+    Returns:
+        str: cache_loc
+    """
+    if os.path.isfile(cache_loc):
+        logging.info('Using existing image cache at {}'.format(cache_loc))
+        return cache_loc
+
+    channels = 1 if greyscale else 3
+    shape = (len(file_locs), cache_size, cache_size, channels)
+    cache_bytes = int(np.prod(shape))
+    cache_dir = os.path.dirname(cache_loc)
+    free_bytes = shutil.disk_usage(cache_dir).free
+    logging.info('Caching {} images at {}px to {} ({:.1f}GB, {:.1f}GB free)'.format(
+        len(file_locs), cache_size, cache_loc, cache_bytes / 1e9, free_bytes / 1e9))
+    if cache_bytes > free_bytes:
+        raise IOError('Image cache needs {:.1f}GB but only {:.1f}GB free in {}'.format(cache_bytes / 1e9, free_bytes / 1e9, cache_dir))
+
+    # unique per process, in case several ranks build the same cache simultaneously
+    temp_loc = cache_loc.replace('.npy', '_{}.npy.tmp'.format(os.getpid()))
+    images = np.lib.format.open_memmap(temp_loc, mode='w+', dtype=np.uint8, shape=shape)
+    del images  # flush header, workers will open their own handles
+
+    chunk_starts = range(0, len(file_locs), chunk_size)
+    chunks = [(start, file_locs[start:start + chunk_size]) for start in chunk_starts]
+    write_chunk = partial(_write_chunk_to_cache, cache_loc=temp_loc, cache_size=cache_size, greyscale=greyscale)
+    try:
+        # spawn, not fork - forking after torch/tensorflow have started threads can deadlock or crash
+        with multiprocessing.get_context('spawn').Pool(num_workers) as pool:
+            for _ in tqdm(pool.imap_unordered(write_chunk, chunks), total=len(chunks), unit='chunks'):
+                pass
+    except Exception as e:
+        os.remove(temp_loc)
+        raise e
+    os.replace(temp_loc, cache_loc)
+    logging.info('Image cache complete: {}'.format(cache_loc))
+    return cache_loc
+
+
+def get_local_rank():
+    """
+    Rank of this process on this node, from the environment set by the launcher (Lightning DDP or SLURM srun).
+    Works before any trainer exists (e.g. in datamodule.setup called directly).
+
+    Returns:
+        int: local rank, or 0 if not launched as one of several processes
+    """
+    for env_var in ['LOCAL_RANK', 'SLURM_LOCALID']:
+        if env_var in os.environ:
+            return int(os.environ[env_var])
+    return 0
+
+
+def wait_for_cache(cache_loc, timeout=6 * 3600, poll_interval=10):
+    """
+    Wait for another process (e.g. local rank 0) to finish cache_images. cache_loc only appears once complete (renamed from a temporary file).
+
+    Args:
+        cache_loc (str): path to cache, from get_cache_loc
+        timeout (float, optional): seconds to wait. Defaults to 6 hours.
+        poll_interval (float, optional): seconds between checks. Defaults to 10.
+
+    Raises:
+        TimeoutError: cache_loc still missing after timeout
+
+    Returns:
+        str: cache_loc
+    """
+    start_time = time.time()
+    logging.info('Waiting for image cache at {}'.format(cache_loc))
+    while not os.path.isfile(cache_loc):
+        if time.time() - start_time > timeout:
+            raise TimeoutError('Image cache {} not built within {}s - did local rank 0 fail?'.format(cache_loc, timeout))
+        time.sleep(poll_interval)
+    return cache_loc
+
+
+def _write_chunk_to_cache(chunk, cache_loc, cache_size, greyscale):
+    start, file_locs = chunk
+    images = np.load(cache_loc, mmap_mode='r+')
+    for n, file_loc in enumerate(file_locs):
+        images[start + n] = load_resized_image(file_loc, cache_size, greyscale)
+    images.flush()
+
+
+def load_resized_image(file_loc, size, greyscale):
+    """
+    Load image as uint8 HWC array, resized (bilinear) to (size, size).
+
+    Args:
+        file_loc (str): path to image (png or jpeg)
+        size (int): size of (square) output image
+        greyscale (bool): if True, take unweighted mean over channels, keeping a channel dimension of 1
+
+    Returns:
+        np.ndarray: uint8 image of shape (size, size, channels)
+    """
+    with Image.open(file_loc) as im:
+        im = im.convert('RGB').resize((size, size), resample=Image.BILINEAR)
+        image = np.asarray(im)
+    if greyscale:
+        image = np.round(image.mean(axis=2, keepdims=True)).astype(np.uint8)
+    return image
+
+
+class CachedGalaxyDataset(Dataset):
+    """
+    Like pytorch_galaxy_datasets' GalaxyDataset, but reads images from a (memmapped) cache made by cache_images rather than decoding from disk.
+
+    The cache is opened lazily, so each dataloader worker maps the same file rather than receiving a pickled copy.
+    Pages are shared between all workers and ranks via the OS page cache (or /dev/shm), so no image is copied more than once in RAM.
+
+    Args:
+        catalog (pd.DataFrame): galaxies to load, with file_loc and label_cols columns
+        label_cols (list): columns to use as labels
+        cache_loc (str): path to .npy cache from cache_images
+        cache_indices (np.ndarray): row of cache for each row of catalog
+        transform (callable, optional): applied to each uint8 HWC image array e.g. torchvision transforms starting with ToTensor. Defaults to None.
+        target_transform (callable, optional): applied to each label. Defaults to None.
+    """
+    def __init__(self, catalog: pd.DataFrame, label_cols, cache_loc, cache_indices, transform=None, target_transform=None):
+        assert len(catalog) == len(cache_indices)
+        assert np.all(cache_indices >= 0), 'Some galaxies are missing from the image cache'
+        self.catalog = catalog
+        self.label_cols = label_cols
+        self.cache_loc = cache_loc
+        self.cache_indices = np.asarray(cache_indices)
+        self.transform = transform
+        self.target_transform = target_transform
+
+        # avoid a pandas row lookup per image
+        self.labels = catalog[label_cols].infer_objects().values
+        self._images = None
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(self.cache_loc, mmap_mode='r')
+        return self._images
+
+    def __getstate__(self):
+        # never pickle the memmap to workers, let each open its own
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __getitem__(self, idx):
+        # copy out of the (read-only) memmap, one image only
+        image = np.array(self.images[self.cache_indices[idx]])
+        label = self.labels[idx].squeeze()  # squeeze for if there's one label_col
+
+        if self.transform:
+            image = self.transform(image)
+
+        if self.target_transform:
+            label = self.target_transform(label)
+
+        return image, label
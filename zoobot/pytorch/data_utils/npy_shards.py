@@ -0,0 +1,212 @@
+"""
+Save catalog images, pre-resized and decoded, to fixed-size uint8 .npy shards for fast pytorch training.
+The pytorch counterpart of zoobot/tensorflow/data_utils/create_shards.py.
+
+Each shard n in a directory is a pair of files:
+- s{size}_shard_{n}_images.npy: uint8 array of shape (galaxy, size, size, channel)
+- s{size}_shard_{n}_labels.npy: float32 array of shape (galaxy, label_col)
+plus, for the whole directory, npy_shard_index.csv (id_str -> shard, offset) and npy_shard_config.json (size, channels, label_cols).
+
+NpyShardDataset memory-maps the shards, so training never decodes or resizes an image.
+"""
+import os
+import json
+import logging
+import multiprocessing
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from sklearn.model_selection import train_test_split
+from torch.utils.data import Dataset
+
+from zoobot.pytorch.data_utils import image_cache
+
+
+INDEX_FILENAME = 'npy_shard_index.csv'
+CONFIG_FILENAME = 'npy_shard_config.json'
+
+
+def prepare_npy_shards(catalog: pd.DataFrame, label_cols, shard_dir, size, greyscale=True, shard_size=4096, val_fraction=0.1, test_fraction=0.2, seed=42, num_workers=None):
+    """
+    Split catalog into train, val and test, and save each to npy shards under shard_dir/{train, val, test}_shards.
+
+    Args:
+        catalog (pd.DataFrame): labelled galaxies, with id_str, file_loc and label_cols columns
+        label_cols (list): columns to save alongside each image
+        shard_dir (str): directory into which to save shards. Will be created.
+        size (int): resolution to save images (i.e. width in pixels)
+        greyscale (bool, optional): if True, save unweighted mean over channels (one channel). Defaults to True.
+        shard_size (int, optional): galaxies per shard. Defaults to 4096.
+        val_fraction (float, optional): fraction of catalog for validation. Defaults to 0.1.
+        test_fraction (float, optional): fraction of catalog for testing. Defaults to 0.2.
+        seed (int, optional): random seed for split and shuffle. Defaults to 42.
+        num_workers (int, optional): processes used to write shards. Defaults to None, meaning all cpus.
+
+    Returns:
+        dict: of form {'train': train_dir, 'val': val_dir, 'test': test_dir}
+    """
+    train_df, hidden_df = train_test_split(catalog, test_size=val_fraction + test_fraction, random_state=seed)
+    val_df, test_df = train_test_split(hidden_df, test_size=test_fraction / (val_fraction + test_fraction), random_state=seed)
+    logging.info('Train: {}, val: {}, test: {}'.format(len(train_df), len(val_df), len(test_df)))
+
+    split_dirs = {}
+    for split, df in [('train', train_df), ('val', val_df), ('test', test_df)]:
+        split_dirs[split] = os.path.join(shard_dir, '{}_shards'.format(split))
+        write_catalog_to_npy_shards(df, size, label_cols, split_dirs[split], shard_size=shard_size, greyscale=greyscale, seed=seed, num_workers=num_workers)
+    return split_dirs
+
+
+def write_catalog_to_npy_shards(df: pd.DataFrame, img_size, label_cols, save_dir, shard_size=4096, greyscale=True, seed=42, num_workers=None):
+    """
+    Write galaxy catalog (shuffled) across many npy shards, with an index of where each galaxy is saved.
+
+    Args:
+        df (pd.DataFrame): galaxy catalog with id_str, file_loc and label_cols columns
+        img_size (int): height/width of saved images
+        label_cols (list): catalog columns to save alongside images (as float32)
+        save_dir (str): directory into which to save shards. Will be created if needed.
+        shard_size (int, optional): max galaxies per shard. Final shard has fewer. Defaults to 4096.
+        greyscale (bool, optional): if True, save unweighted mean over channels (one channel). Defaults to True.
+        seed (int, optional): random seed for shuffle. Defaults to 42.
+        num_workers (int, optional): processes used to write shards. Defaults to None, meaning all cpus.
+
+    Returns:
+        pd.DataFrame: index with columns id_str, shard (images filename) and offset (row within shard)
+    """
+    assert not df.empty
+    missing_cols = set(['id_str', 'file_loc'] + list(label_cols)) - set(df.columns.values)
+    if missing_cols:
+        raise IndexError('Columns not found in df: {}'.format(missing_cols))
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    os.makedirs(save_dir, exist_ok=True)
+
+    df = df.sample(frac=1, random_state=seed).reset_index(drop=True)  # shuffle, so each shard is representative
+    n_shards = int(np.ceil(len(df) / shard_size))
+    shards = [
+        (os.path.join(save_dir, 's{}_shard_{}'.format(img_size, shard_n)), df.iloc[shard_n * shard_size:(shard_n + 1) * shard_size])
+        for shard_n in range(n_shards)
+    ]
+
+    logging.info('Writing {} galaxies to {} shards in {}'.format(len(df), n_shards, save_dir))
+    write_shard = partial(_write_npy_shard, img_size=img_size, greyscale=greyscale)
+    shard_tasks = [(shard_stem, df_shard['file_loc'].values, df_shard[label_cols].values.astype(np.float32)) for shard_stem, df_shard in shards]
+    # spawn, not fork - forking after torch/tensorflow have started threads can deadlock or crash
+    with multiprocessing.get_context('spawn').Pool(num_workers) as pool:
+        for _ in tqdm(pool.imap_unordered(write_shard, shard_tasks), total=n_shards, unit='shards'):
+            pass
+
+    index = pd.concat([
+        pd.DataFrame({
+            'id_str': df_shard['id_str'].values,
+            'shard': os.path.basename(shard_stem) + '_images.npy',
+            'offset': np.arange(len(df_shard))
+        })
+        for shard_stem, df_shard in shards
+    ])
+    index.to_csv(os.path.join(save_dir, INDEX_FILENAME), index=False)
+
+    config = {
+        'size': img_size,
+        'channels': 1 if greyscale else 3,
+        'shard_size': shard_size,
+        'label_cols': list(label_cols)
+    }
+    with open(os.path.join(save_dir, CONFIG_FILENAME), 'w') as f:
+        json.dump(config, f)
+
+    return index
+
+
+def _write_npy_shard(shard_task, img_size, greyscale):
+    shard_stem, file_locs, labels = shard_task
+    _save_atomic(shard_stem + '_labels.npy', labels)
+    # written image by image into a memmap (as image_cache.cache_images), so a whole shard is never held in memory
+    images_loc = shard_stem + '_images.npy'
+    images = np.lib.format.open_memmap(images_loc + '.tmp', mode='w+', dtype=np.uint8, shape=(len(file_locs), img_size, img_size, 1 if greyscale else 3))
+    for n, file_loc in enumerate(file_locs):
+        images[n] = image_cache.load_resized_image(file_loc, img_size, greyscale)
+    images.flush()
+    del images
+    os.replace(images_loc + '.tmp', images_loc)
+
+
+def _save_atomic(save_loc, arr):
+    # write then rename, so a partially-written shard is never mistaken for a complete one
+    with open(save_loc + '.tmp', 'wb') as f:
+        np.save(f, arr)
+    os.replace(save_loc + '.tmp', save_loc)
+
+
+def load_npy_shard_index(shard_dir):
+    return pd.read_csv(os.path.join(shard_dir, INDEX_FILENAME), dtype={'id_str': str})
+
+
+def load_npy_shard_config(shard_dir):
+    with open(os.path.join(shard_dir, CONFIG_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+class NpyShardDataset(Dataset):
+    """
+    Dataset of galaxies saved with write_catalog_to_npy_shards, reading images and labels from memory-mapped shards.
+
+    Shards are opened lazily in each dataloader worker, and pages are shared via the OS page cache, so
+    every worker can read every shard without copies and without decoding.
+
+    Args:
+        shard_dir (str): directory of shards, as written by write_catalog_to_npy_shards
+        id_strs (list, optional): only include these galaxies, in this order. Defaults to None, meaning all galaxies in shard order.
+        transform (callable, optional): applied to each uint8 HWC image array e.g. transforms.ToTensor or galaxy_datamodule.to_uint8_tensor. Defaults to None.
+        target_transform (callable, optional): applied to each label. Defaults to None.
+    """
+    def __init__(self, shard_dir, id_strs=None, transform=None, target_transform=None):
+        self.shard_dir = shard_dir
+        self.config = load_npy_shard_config(shard_dir)
+        self.label_cols = self.config['label_cols']
+
+        index = load_npy_shard_index(shard_dir)
+        if id_strs is not None:
+            index = index.set_index('id_str').loc[list(id_strs)].reset_index()
+        self.index = index
+        self.shard_locs = [os.path.join(shard_dir, shard) for shard in index['shard'].unique()]
+        shard_numbers = {shard: n for n, shard in enumerate(index['shard'].unique())}
+        # plain arrays, cheap to pickle to workers and to index
+        self.shard_n = index['shard'].map(shard_numbers).values
+        self.offsets = index['offset'].values
+
+        self.transform = transform
+        self.target_transform = target_transform
+        self._shards = {}
+
+    def __getstate__(self):
+        # never pickle the memmaps to workers, let each open their own
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def get_shard(self, shard_n):
+        if shard_n not in self._shards:
+            images_loc = self.shard_locs[shard_n]
+            labels_loc = images_loc.replace('_images.npy', '_labels.npy')
+            self._shards[shard_n] = (np.load(images_loc, mmap_mode='r'), np.load(labels_loc, mmap_mode='r'))
+        return self._shards[shard_n]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        images, labels = self.get_shard(self.shard_n[idx])
+        offset = self.offsets[idx]
+        image = np.array(images[offset])  # copy out of the (read-only) memmap, one image only
+        label = np.array(labels[offset]).squeeze()  # squeeze for if there's one label_col
+
+        if self.transform:
+            image = self.transform(image)
+
+        if self.target_transform:
+            label = self.target_transform(label)
+
+        return image, label
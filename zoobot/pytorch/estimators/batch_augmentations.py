@@ -0,0 +1,105 @@
+import math
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from zoobot.pytorch.data_utils import image_cache
+
+
+class BatchAugmentation(nn.Module):
+    """
+    Random resized crop, horizontal flip, rotation and (unweighted) greyscale, applied to a whole batch at once on the model's device.
+
+    Follows the same distribution as the per-image torchvision augmentations in pytorch_galaxy_datasets (default_torchvision_transforms):
+    crop of area fraction ~U(crop_scale_bounds) and log aspect ratio ~U(log crop_ratio_bounds), resized to resize_size,
+    flipped horizontally with p=0.5, then rotated by ~U(-180, 180) degrees about the centre, with zeros outside the rotated image.
+
+    All three are composed into one sampling grid per image, so each output pixel is interpolated (bilinear) only once.
+    Input batches are first area-downsampled (if larger) such that the smallest crop is still ~resize_size pixels across,
+    which approximates the antialiasing of resizing each crop with PIL.
+
+    Args:
+        resize_size (int, optional): size of (square) output images. Defaults to 224.
+        crop_scale_bounds (tuple, optional): min and max fraction of image area to crop. Defaults to (0.7, 0.8).
+        crop_ratio_bounds (tuple, optional): min and max aspect ratio (width / height) of crop. Defaults to (0.9, 1.1).
+        greyscale (bool, optional): if True, average over channels (keeping a channel dim of 1). Defaults to True.
+        flip (bool, optional): if True, randomly flip horizontally. Defaults to True.
+        rotate (bool, optional): if True, randomly rotate. Defaults to True.
+    """
+    def __init__(self, resize_size=224, crop_scale_bounds=(0.7, 0.8), crop_ratio_bounds=(0.9, 1.1), greyscale=True, flip=True, rotate=True):
+        super().__init__()
+        self.resize_size = resize_size
+        self.crop_scale_bounds = crop_scale_bounds
+        self.log_ratio_bounds = (math.log(crop_ratio_bounds[0]), math.log(crop_ratio_bounds[1]))
+        self.greyscale = greyscale
+        self.flip = flip
+        self.rotate = rotate
+        self.prescale_size = image_cache.get_cache_size(resize_size, crop_scale_bounds)
+
+        # output pixel centres in normalised [-1, 1] coordinates (as align_corners=False)
+        coords = torch.linspace(-1 + 1 / resize_size, 1 - 1 / resize_size, resize_size)
+        grid_y, grid_x = torch.meshgrid(coords, coords, indexing='ij')
+        self.register_buffer('grid_x', grid_x, persistent=False)
+        self.register_buffer('grid_y', grid_y, persistent=False)
+
+    def forward(self, images):
+        """
+        Args:
+            images (torch.Tensor): batch of shape (batch, channel, height, width), either uint8 (0-255) or float (0-1)
+
+        Returns:
+            torch.Tensor: float batch of shape (batch, 1 if greyscale else channel, resize_size, resize_size), 0-1
+        """
+        if images.dtype == torch.uint8:
+            images = images.float() / 255.
+        if self.greyscale and images.shape[1] > 1:
+            images = images.mean(dim=1, keepdim=True)  # as GrayscaleUnweighted
+
+        batch_size, _, height, width = images.shape
+        if min(height, width) > self.prescale_size:
+            new_height = round(height * self.prescale_size / min(height, width))
+            new_width = round(width * self.prescale_size / min(height, width))
+            images = F.interpolate(images, size=(new_height, new_width), mode='area')
+            height, width = new_height, new_width
+
+        def uniform(low, high):
+            return torch.empty(batch_size, 1, 1, device=images.device).uniform_(low, high)
+
+        # crop size, as fraction of input width/height
+        scale = uniform(*self.crop_scale_bounds)
+        ratio = torch.exp(uniform(*self.log_ratio_bounds))
+        # torchvision resamples crops which don't fit, and eventually falls back to a centre crop. Clamping is near-identical for sensible bounds.
+        crop_width = torch.sqrt(scale * ratio * height / width).clamp(max=1.)
+        crop_height = torch.sqrt(scale / ratio * width / height).clamp(max=1.)
+        # crop centre, such that crop is fully inside image
+        crop_x = uniform(-1., 1.) * (1. - crop_width)
+        crop_y = uniform(-1., 1.) * (1. - crop_height)
+
+        grid_x = self.grid_x.to(images.dtype)
+        grid_y = self.grid_y.to(images.dtype)
+        # work backwards from output pixels: undo rotation, undo flip, then map crop onto input
+        if self.rotate:
+            angle = uniform(-math.pi, math.pi)
+            cos, sin = torch.cos(angle), torch.sin(angle)
+            grid_x, grid_y = cos * grid_x + sin * grid_y, -sin * grid_x + cos * grid_y
+            # as RandomRotation, anything rotated in from outside the (cropped) image is 0
+            inside = (grid_x.abs() <= 1.) & (grid_y.abs() <= 1.)
+        else:
+            inside = None
+        if self.flip:
+            flip_sign = 1. - 2. * (uniform(0., 1.) < 0.5).to(images.dtype)
+            grid_x = flip_sign * grid_x
+
+        sample_x = (crop_x + crop_width * grid_x).expand(batch_size, -1, -1)
+        sample_y = (crop_y + crop_height * grid_y).expand(batch_size, -1, -1)
+        grid = torch.stack([sample_x, sample_y], dim=-1)  # (batch, resize_size, resize_size, xy)
+
+        augmented = F.grid_sample(images, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+        if inside is not None:
+            augmented = augmented * inside.unsqueeze(1).to(augmented.dtype)
+        return augmented
+
+    def extra_repr(self):
+        return 'resize_size={}, crop_scale_bounds={}, greyscale={}, flip={}, rotate={}'.format(
+            self.resize_size, self.crop_scale_bounds, self.greyscale, self.flip, self.rotate)
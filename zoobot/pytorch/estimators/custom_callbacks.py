@@ -0,0 +1,327 @@
+import os
+import math
+import json
+import time
+import logging
+import resource
+
+import torch
+import pytorch_lightning as pl
+
+from zoobot.pytorch.estimators import batch_augmentations
+
+
+class ThroughputMonitor(pl.Callback):
+    """
+    Record where the time goes in each training step, to tell if training is I/O-bound (increase num_workers/prefetch_factor, cache images)
+    or compute-bound (increase batch size, use mixed precision).
+
+    Per step, records wall time (seconds) split into:
+    - data_wait: waiting for the dataloader to yield the next batch
+    - transfer: host to device copy (LightningModule.transfer_batch_to_device)
+    - forward: model forward pass
+    - loss: from end of forward pass to start of backward pass (i.e. loss calculation and logging)
+    - backward: backward pass
+    - optimizer: from end of backward pass to end of step (optimizer step and zero_grad)
+    plus images_per_sec, dataloader queue_depth (batches ready and waiting, if available), and peak RSS of the main process and current RSS of workers.
+
+    Records are logged to the trainer's logger (under throughput/) and appended to a JSON-lines file.
+    With DDP, each rank writes its own file.
+
+    CUDA is asynchronous, so by default each boundary calls torch.cuda.synchronize. This adds some overhead.
+    Without synchronizing, gpu time is attributed to whichever phase next waits for the gpu.
+
+    Args:
+        save_loc (str, optional): JSON-lines file to append step records to. Rank is added for rank > 0. Defaults to None (no file).
+        synchronize (bool, optional): if True, synchronize cuda at each boundary for accurate timings. Defaults to True.
+    """
+    def __init__(self, save_loc=None, synchronize=True):
+        super().__init__()
+        self.save_loc = save_loc
+        self.synchronize = synchronize
+        self._file = None
+        self._in_train_step = False
+        self._hook_handles = []
+
+    def on_fit_start(self, trainer, pl_module):
+        if self.save_loc is not None:
+            save_loc = self.save_loc
+            if trainer.global_rank > 0:
+                save_loc = save_loc.replace('.jsonl', '_rank{}.jsonl'.format(trainer.global_rank))
+            self._file = open(save_loc, 'a')
+            logging.info('Recording training throughput to {}'.format(save_loc))
+
+        self._hook_handles = [
+            pl_module.register_forward_pre_hook(self._on_forward_start),
+            pl_module.register_forward_hook(self._on_forward_end)
+        ]
+        # time host->device copies by wrapping the (possibly user-overridden) transfer hook
+        self._original_transfer = pl_module.transfer_batch_to_device
+        monitor = self
+
+        def timed_transfer_batch_to_device(*args, **kwargs):
+            start = monitor._now(pl_module)
+            batch = monitor._original_transfer(*args, **kwargs)
+            monitor._pending_transfer += monitor._now(pl_module) - start
+            return batch
+        pl_module.transfer_batch_to_device = timed_transfer_batch_to_device
+        self._pending_transfer = 0.
+
+    def on_fit_end(self, trainer, pl_module):
+        for handle in self._hook_handles:
+            handle.remove()
+        self._hook_handles = []
+        pl_module.transfer_batch_to_device = self._original_transfer
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _now(self, pl_module):
+        if self.synchronize and pl_module.device.type == 'cuda':
+            torch.cuda.synchronize(pl_module.device)
+        return time.perf_counter()
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self._step_end = self._now(pl_module)
+        self._pending_transfer = 0.
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx, *args):
+        self._step_start = self._now(pl_module)
+        # the gap since the last step was spent fetching (and, usually, transferring) this batch
+        transfer = self._pending_transfer
+        self._times = {
+            'data_wait': max(self._step_start - self._step_end - transfer, 0.),
+            'transfer': transfer
+        }
+        self._pending_transfer = 0.
+        self._forward_end = None
+        self._backward_end = None
+        self._in_train_step = True
+
+    def _on_forward_start(self, module, inputs):
+        if self._in_train_step:
+            self._forward_start = self._now(module)
+
+    def _on_forward_end(self, module, inputs, outputs):
+        if self._in_train_step:
+            self._forward_end = self._now(module)
+            self._times['forward'] = self._forward_end - self._forward_start
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        self._backward_start = self._now(pl_module)
+        forward_end = self._forward_end if self._forward_end is not None else self._step_start
+        self._times['loss'] = self._backward_start - forward_end
+
+    def on_after_backward(self, trainer, pl_module):
+        self._backward_end = self._now(pl_module)
+        self._times['backward'] = self._backward_end - self._backward_start
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, *args):
+        previous_step_end = self._step_end
+        self._step_end = self._now(pl_module)
+        self._in_train_step = False
+
+        batch_size = len(batch[0])
+        step_time = self._step_end - previous_step_end
+        record = {
+            'step': trainer.global_step,
+            'epoch': trainer.current_epoch,
+            'batch_size': batch_size,
+            **self._times,
+            'optimizer': self._step_end - (self._backward_end if self._backward_end is not None else self._step_start),
+            'step_time': step_time,
+            'images_per_sec': batch_size / step_time,
+            'queue_depth': get_queue_depth(trainer),
+            'peak_rss_mb': get_peak_rss_mb(),
+            'workers_rss_mb': get_workers_rss_mb(trainer)
+        }
+
+        pl_module.log_dict(
+            dict([('throughput/' + key, float(value)) for key, value in record.items() if key not in ['step', 'epoch'] and value is not None]),
+            on_step=True, on_epoch=False, logger=True, prog_bar=False
+        )
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+
+def get_train_dataloader_iterator(trainer):
+    # only available for persistent workers (as in GalaxyDataModule), where the DataLoader keeps its iterator
+    loaders = trainer.train_dataloader
+    loaders = getattr(loaders, 'loaders', loaders)  # CombinedLoader in lightning < 2.0
+    if isinstance(loaders, torch.utils.data.DataLoader):
+        return getattr(loaders, '_iterator', None)
+    return None
+
+
+def get_queue_depth(trainer):
+    """
+    Batches loaded by workers and waiting to be used. Near 0: I/O bound. Near num_workers * prefetch_factor: compute bound.
+    Relies on DataLoader internals, so returns None if unavailable (e.g. num_workers=0, non-persistent workers, or macOS).
+    """
+    iterator = get_train_dataloader_iterator(trainer)
+    data_queue = getattr(iterator, '_data_queue', None)
+    if data_queue is None:
+        return None
+    try:
+        return data_queue.qsize()
+    except NotImplementedError:  # macOS multiprocessing queues
+        return None
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is kilobytes on linux (bytes on macOS, but zoobot trains on linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def get_workers_rss_mb(trainer):
+    return get_dataloader_workers_rss_mb(get_train_dataloader_iterator(trainer))
+
+
+def get_dataloader_workers_rss_mb(iterator):
+    # total current RSS of dataloader worker processes, via /proc (linux only). None if unavailable.
+    workers = getattr(iterator, '_workers', None)
+    if not workers:
+        return None
+    try:
+        return sum([get_process_rss_mb(worker.pid) for worker in workers])
+    except (OSError, ValueError):
+        return None
+
+
+def get_process_rss_mb(pid='self'):
+    # current (not peak) RSS, via /proc (linux only)
+    with open('/proc/{}/statm'.format(pid), 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024. ** 2
+
+
+class ProgressiveResizing(pl.Callback):
+    """
+    Train early epochs at lower resolution (and larger batch size), stepping up to the final resolution in stages.
+    Low resolution epochs are much cheaper, so this reaches a given validation loss sooner, especially for larger efficientnets.
+
+    The datamodule must have a set_train_resolution(resize_size, batch_size) method (e.g. ZoobotDataModule).
+    The train dataloader is reloaded only when the stage changes, by setting trainer.reload_dataloaders_every_n_epochs for the next epoch -
+    rebuilding it every epoch would respawn every (persistent) worker, long after the final stage.
+    Validation (and test) always uses the datamodule's own resize_size and batch_size, so validation losses are comparable across stages.
+
+    If the model augments on device (ZoobotLightningModule(batch_augmentation=True)), the model's augmentation is swapped instead,
+    at the start of each training epoch and back again for validation.
+
+    The schedule is saved to JSON (on rank 0) and the current resize_size and batch_size are logged each epoch.
+
+    Args:
+        schedule (list): of dicts like {'epoch': 0, 'resize_size': 160, 'batch_size': 512}, sorted by epoch, first at epoch 0.
+            Each stage applies from that epoch until the next stage. See get_progressive_resizing_schedule.
+        save_loc (str, optional): JSON file to save schedule. Defaults to None (not saved).
+    """
+    def __init__(self, schedule, save_loc=None):
+        super().__init__()
+        assert schedule[0]['epoch'] == 0, 'First stage must start at epoch 0'
+        assert all(a['epoch'] < b['epoch'] for a, b in zip(schedule[:-1], schedule[1:])), 'Stages must be sorted by epoch'
+        self.schedule = schedule
+        self.save_loc = save_loc
+        self._stage = None
+        self._eval_batch_augmentation = None
+        self._train_batch_augmentation = None
+
+    def get_stage(self, epoch):
+        return [stage for stage in self.schedule if stage['epoch'] <= epoch][-1]
+
+    def on_fit_start(self, trainer, pl_module):
+        datamodule = trainer.datamodule
+        assert hasattr(datamodule, 'set_train_resolution'), 'ProgressiveResizing requires a datamodule with set_train_resolution e.g. ZoobotDataModule'
+        if trainer.global_rank == 0 and self.save_loc is not None:
+            with open(self.save_loc, 'w') as f:
+                json.dump({
+                    'schedule': self.schedule,
+                    'eval_resize_size': getattr(datamodule, 'resize_size', None),
+                    'eval_batch_size': getattr(datamodule, 'batch_size', None)
+                }, f, indent=4)
+            logging.info('Saved progressive resizing schedule to {}'.format(self.save_loc))
+        self._eval_batch_augmentation = getattr(pl_module, 'batch_augmentation', None)
+        # the first train dataloader is created after on_fit_start (and after resuming, so current_epoch is correct)
+        self.set_stage(trainer, pl_module, trainer.current_epoch)
+
+    def on_train_epoch_end(self, trainer, pl_module, *args):
+        # lightning reloads the train dataloader before on_train_epoch_start, so set up the next epoch now
+        next_stage = self.get_stage(trainer.current_epoch + 1)
+        trainer.reload_dataloaders_every_n_epochs = 1 if next_stage is not self._stage else 0
+        self.set_stage(trainer, pl_module, trainer.current_epoch + 1)
+
+    def set_stage(self, trainer, pl_module, epoch):
+        stage = self.get_stage(epoch)
+        if stage is self._stage:
+            return
+        logging.info('Progressive resizing: training at {}px with batch size {} from epoch {}'.format(stage['resize_size'], stage['batch_size'], epoch))
+        self._stage = stage
+        trainer.datamodule.set_train_resolution(stage['resize_size'], stage['batch_size'])
+        if self._eval_batch_augmentation is not None:
+            self._train_batch_augmentation = batch_augmentations.BatchAugmentation(
+                resize_size=stage['resize_size'],
+                crop_scale_bounds=self._eval_batch_augmentation.crop_scale_bounds,
+                crop_ratio_bounds=tuple(math.exp(x) for x in self._eval_batch_augmentation.log_ratio_bounds),
+                greyscale=self._eval_batch_augmentation.greyscale,
+                flip=self._eval_batch_augmentation.flip,
+                rotate=self._eval_batch_augmentation.rotate
+            ).to(pl_module.device)
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        if self._train_batch_augmentation is not None:
+            use_batch_augmentation(pl_module, self._train_batch_augmentation)
+        pl_module.log_dict(
+            {'progressive_resizing/resize_size': float(self._stage['resize_size']), 'progressive_resizing/batch_size': float(self._stage['batch_size'])},
+            on_step=False, on_epoch=True, logger=True, prog_bar=False
+        )
+
+    def on_validation_epoch_start(self, trainer, pl_module):
+        if self._train_batch_augmentation is not None:
+            use_batch_augmentation(pl_module, None)
+
+    def on_validation_epoch_end(self, trainer, pl_module):
+        # validation can run mid-epoch (val_check_interval), so go back to the training augmentation
+        if self._train_batch_augmentation is not None:
+            use_batch_augmentation(pl_module, self._train_batch_augmentation)
+
+    def on_fit_end(self, trainer, pl_module):
+        if self._train_batch_augmentation is not None:
+            use_batch_augmentation(pl_module, None)
+
+
+def use_batch_augmentation(pl_module, batch_augmentation):
+    # shadow the model's own (registered) batch_augmentation via __dict__, rather than replacing it, so the state_dict is unchanged.
+    # None restores the model's own. Only for models with batch_augmentation registered as a submodule.
+    if batch_augmentation is None:
+        pl_module.__dict__.pop('batch_augmentation', None)
+    else:
+        pl_module.__dict__['batch_augmentation'] = batch_augmentation
+
+
+def get_progressive_resizing_schedule(resize_size, batch_size, min_resize_size=None, stages=3, epochs_per_stage=5):
+    """
+    Evenly-spaced resolutions from min_resize_size up to resize_size, with batch size scaled inversely with pixel count
+    (keeping memory per batch roughly constant), rounded down to a multiple of 8.
+    The final stage (at resize_size and batch_size) lasts for the rest of training.
+
+    Args:
+        resize_size (int): final resolution e.g. 380 for efficientnet_b4
+        batch_size (int): batch size at final resolution
+        min_resize_size (int, optional): first stage resolution. Defaults to None, meaning resize_size // 2.
+        stages (int, optional): number of stages, including the final stage. Defaults to 3.
+        epochs_per_stage (int, optional): epochs for each stage before the final stage. Defaults to 5.
+
+    Returns:
+        list: of dicts like {'epoch': 0, 'resize_size': 190, 'batch_size': 1024}, for ProgressiveResizing
+    """
+    if min_resize_size is None:
+        min_resize_size = resize_size // 2
+    assert min_resize_size <= resize_size
+    if stages == 1:
+        sizes = [resize_size]
+    else:
+        sizes = [int(round(min_resize_size + (resize_size - min_resize_size) * n / (stages - 1))) for n in range(stages)]
+    schedule = []
+    for n, size in enumerate(sizes):
+        stage_batch_size = max(int(batch_size * (resize_size / size) ** 2) // 8 * 8, batch_size)
+        schedule.append({'epoch': n * epochs_per_stage, 'resize_size': size, 'batch_size': stage_batch_size})
+    return schedule
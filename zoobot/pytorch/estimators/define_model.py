@@ -5,7 +5,7 @@ from torch import nn
 import pytorch_lightning as pl
 from torchmetrics import Accuracy
 
-from zoobot.pytorch.estimators import efficientnet_standard, efficientnet_custom, resnet_torchvision_custom, custom_layers
+from zoobot.pytorch.estimators import efficientnet_standard, efficientnet_custom, resnet_torchvision_custom, custom_layers, batch_augmentations
 from zoobot.pytorch.training import losses
 
 
@@ -27,6 +27,18 @@ class GenericLightningModule(pl.LightningModule):
 
         self.setup_metrics()
 
+        # optionally, augment whole batches on device (see on_after_batch_transfer) instead of per image in dataloader workers
+        self.batch_augmentation = None
+
+        # optionally, run self.model through torch.compile. See forward.
+        self.compile_model = False
+        self._compiled_model = None
+
+        # learning rate, optionally scaled by effective batch size / reference_batch_size. See configure_optimizers.
+        self.learning_rate = 0.001
+        self.reference_batch_size = None
+        self._accumulated_losses = []
+
 
     def setup_metrics(self):
         # these are ignored unless output dim = 2
@@ -37,8 +49,46 @@ class GenericLightningModule(pl.LightningModule):
 
 
     def forward(self, x):
+        if self.compile_model:
+            return self.compiled_model(x)
         return self.model.forward(x)
 
+    @property
+    def compiled_model(self):
+        # compiled lazily (i.e. on the training device) and kept out of the registered submodules,
+        # so state_dict keys (and hence checkpoints) are identical with or without compiling
+        if self._compiled_model is None:
+            self.__dict__['_compiled_model'] = torch.compile(self.model)
+        return self._compiled_model
+
+    def __getstate__(self):
+        # compiled models can't be pickled (e.g. for ddp_spawn) - recompile in each process instead
+        state = super().__getstate__()  # Lightning drops the trainer reference
+        state['_compiled_model'] = None
+        return state
+
+    def on_fit_start(self):
+        if self.compile_model:
+            # compile now rather than during the first (timed, logged) training step
+            batch_size = getattr(self.trainer.datamodule, 'batch_size', None)
+            resize_size, channels = self.hparams.get('resize_size'), self.hparams.get('channels')
+            if None not in (batch_size, resize_size, channels):
+                warmup_compiled_model(self, (batch_size, channels, resize_size, resize_size), self.device)
+            else:
+                logging.info('Cannot infer input shape - model will compile during first step')
+
+    def on_load_checkpoint(self, checkpoint):
+        # accept checkpoints saved from a model wrapped directly with torch.compile (e.g. get_plain_pytorch_zoobot_model(compile_model=True))
+        checkpoint['state_dict'] = strip_compiled_prefix(checkpoint['state_dict'])
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # applies to every stage, as with the per-image dataloader augmentations
+        # only uint8 (i.e. decoded but not yet augmented) batches are augmented, so float batches from a standard datamodule are left alone
+        x, labels = batch
+        if (self.batch_augmentation is not None) and (x.dtype == torch.uint8):
+            x = self.batch_augmentation(x)
+        return x, labels
+
     def training_step(self, batch, batch_idx):
         x, labels = batch
         predictions = self(x)  # by default, these are Dirichlet concentrations
@@ -47,9 +97,12 @@ class GenericLightningModule(pl.LightningModule):
         # self.loss_func returns shape of (galaxy, question), mean to ()
         loss = torch.mean(self.loss_func(predictions, labels))
         self.log("train/supervised_loss", loss, on_step=self.log_on_step, on_epoch=True, prog_bar=True, logger=True)
+        if self.trainer.accumulate_grad_batches > 1:
+            # per-step train/supervised_loss is only the last batch of each accumulated step. Log the mean over all of them too.
+            self._accumulated_losses.append(loss.detach())
         if predictions.shape[1] == 2:  # will only do for binary classifications
             # logging.info(predictions.shape, labels.shape)
-            self.log("train_accuracy", self.train_accuracy(predictions, torch.argmax(labels, dim=1, keepdim=False)), prog_bar=True)
+            self.log("train_accuracy", self.train_accuracy(predictions, torch.argmax(labels[:, :2], dim=1, keepdim=False)), prog_bar=True)
         return loss
 
     def validation_step(self, batch, batch_idx):
@@ -60,7 +113,7 @@ class GenericLightningModule(pl.LightningModule):
         self.log("val/supervised_loss", loss, on_step=self.log_on_step, on_epoch=True, prog_bar=True, logger=True, sync_dist=True)
         if predictions.shape[1] == 2:  # will only do for binary classifications
             # logging.info(predictions.shape, labels.shape)
-            self.log("val_accuracy", self.val_accuracy(predictions, torch.argmax(labels, dim=1, keepdim=False)), prog_bar=True)
+            self.log("val_accuracy", self.val_accuracy(predictions, torch.argmax(labels[:, :2], dim=1, keepdim=False)), prog_bar=True)
         return loss
 
     def test_step(self, batch, batch_idx):
@@ -79,9 +132,21 @@ class GenericLightningModule(pl.LightningModule):
         return self(x)
 
 
+    def on_before_optimizer_step(self, optimizer, *args):
+        # called once per accumulated step (*args is optimizer_idx, for lightning < 2.0)
+        if self._accumulated_losses:
+            accumulated_loss = torch.mean(torch.stack(self._accumulated_losses))
+            self.log("train/accumulated_supervised_loss", accumulated_loss, on_step=self.log_on_step, on_epoch=False, prog_bar=False, logger=True)
+            self._accumulated_losses = []
+
     def configure_optimizers(self):
+        learning_rate = self.learning_rate
+        if self.reference_batch_size is not None:
+            effective_batch_size = get_effective_batch_size(self.trainer)
+            learning_rate = scale_learning_rate(learning_rate, effective_batch_size, self.reference_batch_size)
+            logging.info('Effective batch size {} (reference {}): learning rate {}'.format(effective_batch_size, self.reference_batch_size, learning_rate))
         # torch and tf defaults are the same (now), but be explicit anyway just for clarity
-        return torch.optim.Adam(self.parameters(), lr=0.001, betas=(0.9, 0.999))  
+        return torch.optim.Adam(self.parameters(), lr=learning_rate, betas=(0.9, 0.999))
 
 
 class ZoobotLightningModule(GenericLightningModule):
@@ -100,7 +165,18 @@ class ZoobotLightningModule(GenericLightningModule):
         always_augment=True,
         dropout_rate=0.2,
         drop_connect_rate=0.2,
-        architecture_name="efficientnet"  # recently changed from model_architecture
+        architecture_name="efficientnet",  # recently changed from model_architecture
+        sparse_loss=False,
+        # augment on device, for use with ZoobotDataModule(batch_augmentation=True) which then only decodes images
+        batch_augmentation=False,
+        resize_size=224,
+        crop_scale_bounds=(0.7, 0.8),
+        crop_ratio_bounds=(0.9, 1.1),
+        compile_model=False,  # use torch.compile (torch >= 2.0). Checkpoints are unaffected.
+        checkpoint_stages=False,  # recompute efficientnet activations during backward, to fit larger batches. Not to be confused with model checkpoints.
+        learning_rate=0.001,
+        reference_batch_size=None,  # if set, scale learning_rate by effective batch size / reference_batch_size e.g. 512 for the 2xA100 recipe
+        question_mask=False  # labels end with schema.question_mask_cols, choosing which questions count for each galaxy. Requires sparse_loss.
         ):
 
         # now, finally, can pass only standard variables as hparams to save
@@ -111,14 +187,32 @@ class ZoobotLightningModule(GenericLightningModule):
             always_augment,
             dropout_rate,
             drop_connect_rate,
-            architecture_name  # TODO can add any more specific params if needed
+            architecture_name,
+            sparse_loss,
+            batch_augmentation,
+            resize_size,
+            crop_scale_bounds,
+            crop_ratio_bounds,
+            compile_model,
+            checkpoint_stages,
+            learning_rate,
+            reference_batch_size,
+            question_mask  # TODO can add any more specific params if needed
         )
 
         logging.info('Generic __init__ complete - moving to Zoobot __init__')
 
         get_architecture, representation_dim = select_base_architecture_func_from_name(architecture_name)
 
-        self.loss_func = get_loss_func(question_index_groups)
+        if compile_model:
+            check_compile_available()
+            logging.info('Compiling model with torch.compile')
+            self.compile_model = True
+
+        self.loss_func = get_loss_func(question_index_groups, sparse=sparse_loss, masked=question_mask, compile_loss=compile_model)
+
+        self.learning_rate = learning_rate
+        self.reference_batch_size = reference_batch_size
 
         self.model = get_plain_pytorch_zoobot_model(
             output_dim=output_dim,
@@ -130,21 +224,45 @@ class ZoobotLightningModule(GenericLightningModule):
             dropout_rate=dropout_rate,
             drop_connect_rate=drop_connect_rate,
             get_architecture=get_architecture,
-            representation_dim=representation_dim
+            representation_dim=representation_dim,
+            checkpoint_stages=checkpoint_stages
         )
 
+        if batch_augmentation:
+            logging.info('Augmenting batches on device')
+            self.batch_augmentation = batch_augmentations.BatchAugmentation(
+                resize_size=resize_size,
+                crop_scale_bounds=crop_scale_bounds,
+                crop_ratio_bounds=crop_ratio_bounds,
+                greyscale=channels == 1
+            )
+
         logging.info('Zoobot __init__ complete')
 
 
     
 
-def get_loss_func(question_index_groups):
+def get_loss_func(question_index_groups, sparse=False, masked=False, compile_loss=False):
     # This just adds schema.question_index_groups as an arg to the usual (labels, preds) loss arg format
     # Would use lambda but multi-gpu doesn't support as lambda can't be pickled
+    # sparse=True skips questions without votes e.g. from other campaigns, see losses.calculate_sparse_multiquestion_loss
+    # masked=True instead skips questions according to mask columns at the end of labels, see losses.split_question_mask
+    if masked and not sparse:
+        raise ValueError('Question mask requires sparse loss')
+    if sparse:
+        multiquestion_loss = losses.calculate_sparse_multiquestion_loss
+    else:
+        multiquestion_loss = losses.calculate_multiquestion_loss
+    if compile_loss:
+        # torch.compile is lazy, compiles on first call. Sparse loss has data-dependent shapes, so will partly fall back to eager.
+        multiquestion_loss = torch.compile(multiquestion_loss)
 
     # accept (labels, preds), return losses of shape (batch)
     def loss_func(preds, labels):  # pytorch convention is preds, labels
-        return losses.calculate_multiquestion_loss(labels, preds, question_index_groups)  # my and sklearn convention is labels, preds
+        if masked:
+            labels, question_mask = losses.split_question_mask(labels, len(question_index_groups))
+            return multiquestion_loss(labels, preds, question_index_groups, question_mask=question_mask)
+        return multiquestion_loss(labels, preds, question_index_groups)  # my and sklearn convention is labels, preds
     return loss_func
 
 
@@ -189,7 +307,9 @@ def get_plain_pytorch_zoobot_model(
     dropout_rate=0.2,
     drop_connect_rate=0.2,
     get_architecture=efficientnet_standard.efficientnet_b0,
-    representation_dim=1280  # or 2048 for resnet
+    representation_dim=1280,  # or 2048 for resnet
+    compile_model=False,
+    checkpoint_stages=False
     ):
     """
     Create a trainable efficientnet model.
@@ -209,6 +329,10 @@ def get_plain_pytorch_zoobot_model(
         include_top (bool, optional): If True, include head used for GZ DECaLS: global pooling and dense layer. Defaults to True.
         expect_partial (bool, optional): If True, do not raise partial match error when loading weights (likely for optimizer state). Defaults to False.
         channels (int, default 1): Number of channels i.e. C in NHWC-dimension inputs. 
+        compile_model (bool, optional): If True, return the model wrapped with torch.compile (torch >= 2.0).
+            The wrapped model's state_dict keys gain an '_orig_mod.' prefix - see strip_compiled_prefix. Defaults to False.
+        checkpoint_stages (bool, optional): If True, recompute activations within each efficientnet stage during backward (activation checkpointing),
+            trading speed (~1/3 slower) for less memory per image. Efficientnets only. Defaults to False.
 
     Returns:
         torch.nn.Sequential: trainable efficientnet model including augmentations and optional head
@@ -216,6 +340,9 @@ def get_plain_pytorch_zoobot_model(
 
     modules_to_use = []
 
+    architecture_kwargs = {}
+    if checkpoint_stages:
+        architecture_kwargs['checkpoint_stages'] = True  # only efficientnets accept this
     effnet = get_architecture(
         input_channels=channels,
         # TODO this arg will break resnet, at the moment - needs tweaking
@@ -223,6 +350,7 @@ def get_plain_pytorch_zoobot_model(
         stochastic_depth_prob=drop_connect_rate,  # this is used though! It's about skipping *layers* inside the main model.
         use_imagenet_weights=use_imagenet_weights,
         include_top=False,  # no final three layers: pooling, dropout and dense
+        **architecture_kwargs
     )
     modules_to_use.append(effnet)
 
@@ -245,4 +373,78 @@ def get_plain_pytorch_zoobot_model(
 
     model = nn.Sequential(*modules_to_use)
 
+    if compile_model:
+        check_compile_available()
+        model = torch.compile(model)
+
     return model
+
+
+def get_effective_batch_size(trainer):
+    """
+    Galaxies per optimizer step: per-device batch size * devices * gradient accumulation steps.
+
+    Args:
+        trainer (pl.Trainer): trainer, with a datamodule (with batch_size attribute) attached
+
+    Returns:
+        int: effective batch size
+    """
+    datamodule = trainer.datamodule
+    # train_batch_size may differ from batch_size e.g. with progressive resizing. Use the final (target) batch size.
+    batch_size = datamodule.batch_size
+    return batch_size * trainer.world_size * trainer.accumulate_grad_batches
+
+
+def scale_learning_rate(learning_rate, effective_batch_size, reference_batch_size):
+    # linear scaling rule (Goyal et al. 2017): learning_rate was tuned for reference_batch_size
+    return learning_rate * effective_batch_size / reference_batch_size
+
+
+def check_compile_available():
+    if not hasattr(torch, 'compile'):
+        raise ValueError('compile_model=True requires torch >= 2.0, but found torch {}'.format(torch.__version__))
+
+
+def strip_compiled_prefix(state_dict):
+    """
+    Remove the '_orig_mod.' prefix that torch.compile adds to state_dict keys, so that weights saved from a compiled model
+    load into an uncompiled one (and into ZoobotLightningModule, compiled or not).
+
+    Args:
+        state_dict (dict): state dict, possibly from a compiled model
+
+    Returns:
+        dict: state dict with any '_orig_mod.' prefixes removed
+    """
+    return type(state_dict)([(key.replace('_orig_mod.', ''), value) for key, value in state_dict.items()])
+
+
+def warmup_compiled_model(model, input_shape, device, train=True):
+    """
+    Run one forward (and, if train, backward) pass on zeros to trigger compilation, in both train and eval mode.
+
+    torch.compile specializes on input shape, so input_shape should match the real batches (including batch size).
+    Gradients from the warmup pass are discarded, and buffers (e.g. BatchNorm running statistics) are restored afterwards.
+
+    Args:
+        model (nn.Module): compiled model (or module using one)
+        input_shape (tuple): shape of warmup batch, (batch, channel, height, width)
+        device (torch.device): device to run warmup on
+        train (bool, optional): if True, also warm up the backward pass. Defaults to True.
+    """
+    logging.info('Warming up compiled model with input shape {}'.format(input_shape))
+    was_training = model.training
+    x = torch.zeros(input_shape, device=device)
+    # train mode forward passes update BatchNorm running stats, which the warmup batch should not affect
+    buffers = {name: buffer.clone() for name, buffer in model.named_buffers()}
+    if train:
+        model.train()
+        model(x).sum().backward()
+        model.zero_grad(set_to_none=True)
+    model.eval()
+    with torch.no_grad():
+        model(x)
+        for name, buffer in model.named_buffers():
+            buffer.copy_(buffers[name])
+    model.train(was_training)
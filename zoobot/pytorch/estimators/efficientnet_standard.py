@@ -3,17 +3,22 @@
 
 import copy
 import math
+import inspect
 from functools import partial
 from typing import Callable, Optional, List, Sequence
 
 import torch
 from torch import nn, Tensor
+from torch.utils.checkpoint import checkpoint
 
 from torchvision._internally_replaced_utils import load_state_dict_from_url
 from torchvision.ops.misc import ConvNormActivation
 
 from torchvision.models.efficientnet import MBConvConfig, MBConv
 
+# non-reentrant checkpointing (torch >= 1.11) supports inputs without gradients and is recommended by recent torch
+CHECKPOINT_KWARGS = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(checkpoint).parameters else {}
+
 
 class EfficientNet(nn.Module):  # could make lightning, but I think it's clearer to do that one level up
     def __init__(
@@ -25,7 +30,8 @@ class EfficientNet(nn.Module):  # could make lightning, but I think it's clearer
         stochastic_depth_prob: float = 0.2,
         num_classes: int = 1000,
         block: Optional[Callable[..., nn.Module]] = None,
-        norm_layer: Optional[Callable[..., nn.Module]] = None
+        norm_layer: Optional[Callable[..., nn.Module]] = None,
+        checkpoint_stages: bool = False
     ) -> None:
         """
         EfficientNet main class
@@ -37,6 +43,9 @@ class EfficientNet(nn.Module):  # could make lightning, but I think it's clearer
             num_classes (int): Number of classes
             block (Optional[Callable[..., nn.Module]]): Module specifying inverted residual building block for mobilenet
             norm_layer (Optional[Callable[..., nn.Module]]): Module specifying the normalization layer to use
+            checkpoint_stages (bool): If True, when training, don't keep activations inside each MBConv stage for the backward pass -
+                recompute them instead (activation checkpointing). Uses less memory per image (so allows larger batches) but trains ~1/3 slower.
+                BatchNorm running statistics are updated again during recomputation, so their effective momentum is slightly higher.
         """
         super().__init__()
         # _log_api_usage_once(self)
@@ -102,6 +111,7 @@ class EfficientNet(nn.Module):  # could make lightning, but I think it's clearer
         )
 
         self.features = nn.Sequential(*layers)
+        self.checkpoint_stages = checkpoint_stages
         # pytorch version includes the pooling outside of include_top
         self.avgpool = nn.AdaptiveAvgPool2d(1)
 
@@ -128,7 +138,10 @@ class EfficientNet(nn.Module):  # could make lightning, but I think it's clearer
                 nn.init.zeros_(m.bias)
 
     def _forward_impl(self, x: Tensor) -> Tensor:
-        x = self.features(x)
+        if self.checkpoint_stages and self.training and torch.is_grad_enabled():
+            x = self._checkpointed_features(x)
+        else:
+            x = self.features(x)
 
         x = self.avgpool(x)
         x = torch.flatten(x, 1)
@@ -137,6 +150,15 @@ class EfficientNet(nn.Module):  # could make lightning, but I think it's clearer
 
         return x
 
+    def _checkpointed_features(self, x: Tensor) -> Tensor:
+        # first and last layers are single convs, not worth recomputing. Stages in between are the MBConv stages.
+        stem, stages, final_conv = self.features[0], self.features[1:-1], self.features[-1]
+        x = stem(x)
+        for stage in stages:
+            # checkpoint restores the RNG state when recomputing, so stochastic depth drops the same blocks
+            x = checkpoint(stage, x, **CHECKPOINT_KWARGS)
+        return final_conv(x)
+
     def forward(self, x: Tensor) -> Tensor:
         return self._forward_impl(x)
 
@@ -150,7 +172,8 @@ def _efficientnet(
     include_top: bool,
     input_channels: int,
     stochastic_depth_prob: float,
-    progress: bool
+    progress: bool,
+    checkpoint_stages: bool = False
 ) -> EfficientNet:
     bneck_conf = partial(MBConvConfig, width_mult=width_mult, depth_mult=depth_mult)
     # ratio, kernel, stride, input channels, output channels, layers, width/depth kwargs
@@ -164,7 +187,7 @@ def _efficientnet(
         bneck_conf(6, 3, 1, 192, 320, 1),
     ]
     model = EfficientNet(
-        inverted_residual_setting, dropout, include_top, input_channels, stochastic_depth_prob)
+        inverted_residual_setting, dropout, include_top, input_channels, stochastic_depth_prob, checkpoint_stages=checkpoint_stages)
     if use_imagenet_weights:
         assert include_top  # otherwise not sure if weights will load as I've changed code
         if model_urls.get(arch, None) is None:
@@ -179,7 +202,8 @@ def efficientnet_b0(
     stochastic_depth_prob: float = 0.2,
     use_imagenet_weights: bool = False,
     include_top: bool = True,
-    progress: bool = True) -> EfficientNet:
+    progress: bool = True,
+    checkpoint_stages: bool = False) -> EfficientNet:
     """
     Constructs a EfficientNet B0 architecture from
     `"EfficientNet: Rethinking Model Scaling for Convolutional Neural Networks" <https://arxiv.org/abs/1905.11946>`_.
@@ -187,6 +211,7 @@ def efficientnet_b0(
     Args:
         use_imagenet_weights (bool): If True, returns a model pre-trained on ImageNet
         progress (bool): If True, displays a progress bar of the download to stderr
+        checkpoint_stages (bool): If True, recompute activations within each stage during backward to save memory. See EfficientNet.
     """
     # added include_top and input_channels, renamed pretrained to use_imagenet_weights
     return _efficientnet(
@@ -198,7 +223,8 @@ def efficientnet_b0(
         use_imagenet_weights=use_imagenet_weights,
         include_top=include_top,
         input_channels=input_channels,
-        progress=progress)
+        progress=progress,
+        checkpoint_stages=checkpoint_stages)
 
 
 def efficientnet_b2(
@@ -206,7 +232,8 @@ def efficientnet_b2(
     stochastic_depth_prob: float = 0.2,
     use_imagenet_weights: bool = False,
     include_top: bool = True,
-    progress: bool = True) -> EfficientNet:
+    progress: bool = True,
+    checkpoint_stages: bool = False) -> EfficientNet:
     """
     See efficientnet_b0, identical other than multipliers and dropout
     """
@@ -221,7 +248,8 @@ def efficientnet_b2(
         use_imagenet_weights=use_imagenet_weights,  # will likely fail
         include_top=include_top,
         input_channels=input_channels,
-        progress=progress)
+        progress=progress,
+        checkpoint_stages=checkpoint_stages)
 
 
 def efficientnet_b4(
@@ -229,7 +257,8 @@ def efficientnet_b4(
     stochastic_depth_prob: float = 0.2,
     use_imagenet_weights: bool = False,
     include_top: bool = True,
-    progress: bool = True) -> EfficientNet:
+    progress: bool = True,
+    checkpoint_stages: bool = False) -> EfficientNet:
     """
     See efficientnet_b0, identical other than multipliers and dropout
     """
@@ -244,7 +273,8 @@ def efficientnet_b4(
         use_imagenet_weights=use_imagenet_weights,  # will likely fail
         include_top=include_top,
         input_channels=input_channels,
-        progress=progress)
+        progress=progress,
+        checkpoint_stages=checkpoint_stages)
 
 
 # TODO efficientnet_v2_*, perhaps?
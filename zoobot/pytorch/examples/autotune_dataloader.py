@@ -0,0 +1,73 @@
+import logging
+import argparse
+
+import pandas as pd
+
+from zoobot.shared import label_metadata, schemas
+from zoobot.pytorch.data_utils.galaxy_datamodule import ZoobotDataModule
+from zoobot.pytorch.estimators import define_model
+from zoobot.pytorch.training import autotune
+
+
+if __name__ == '__main__':
+
+    """
+    Find the fastest batch_size, num_workers and prefetch_factor for your catalog, model and hardware.
+    Pass the saved JSON to train_model_on_catalog.py (--dataloader-config) or predict_on_catalog.predict(dataloader_config_loc=...)
+
+    Example:
+    python zoobot/pytorch/examples/autotune_dataloader.py --catalog /path/to/catalog.csv --save-loc dataloader_config.json --gpus 2
+    """
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s: %(message)s'
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalog', dest='catalog_loc', type=str)
+    parser.add_argument('--save-loc', dest='save_loc', type=str, default='dataloader_config.json')
+    parser.add_argument('--mode', dest='mode', type=str, default='train', help='train or predict')
+    parser.add_argument('--architecture', dest='architecture_name', default='efficientnet', type=str)
+    parser.add_argument('--resize-size', dest='resize_size', type=int, default=224)
+    parser.add_argument('--color', default=False, action='store_true')
+    parser.add_argument('--gpus', default=1, type=int)
+    parser.add_argument('--batch-sizes', dest='batch_sizes', type=int, nargs='+', default=[64, 128, 256, 512])
+    parser.add_argument('--num-workers', dest='num_workers_options', type=int, nargs='+', default=[2, 4, 8, 16])
+    parser.add_argument('--prefetch-factors', dest='prefetch_factors', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--gpu-memory-budget-gb', dest='gpu_memory_budget_gb', type=float, default=None)
+    parser.add_argument('--host-memory-budget-gb', dest='host_memory_budget_gb', type=float, default=None)
+    args = parser.parse_args()
+
+    schema = schemas.Schema(label_metadata.decals_all_campaigns_ortho_pairs, label_metadata.decals_ortho_dependencies)
+    catalog = pd.read_csv(args.catalog_loc)
+
+    datamodule = ZoobotDataModule(
+        label_cols=schema.label_cols,
+        predict_catalog=catalog,  # only used to build a dataset with the usual transforms
+        greyscale=not args.color,
+        resize_size=args.resize_size
+    )
+    datamodule.setup(stage='predict')
+
+    model = define_model.ZoobotLightningModule(
+        output_dim=len(schema.label_cols),
+        question_index_groups=schema.question_index_groups,
+        channels=3 if args.color else 1,
+        architecture_name=args.architecture_name
+    )
+
+    autotune.autotune_dataloader(
+        model,
+        datamodule.predict_dataset,
+        save_loc=args.save_loc,
+        mode=args.mode,
+        batch_sizes=args.batch_sizes,
+        num_workers_options=args.num_workers_options,
+        prefetch_factors=args.prefetch_factors,
+        gpus=args.gpus,
+        steps=args.steps,
+        gpu_memory_budget_gb=args.gpu_memory_budget_gb,
+        host_memory_budget_gb=args.host_memory_budget_gb
+    )
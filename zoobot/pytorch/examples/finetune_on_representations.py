@@ -0,0 +1,91 @@
+import os
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.model_selection import train_test_split
+
+from pytorch_galaxy_datasets.galaxy_datamodule import GalaxyDataModule
+
+from zoobot.pytorch.estimators import define_model
+from zoobot.pytorch.transfer_learning import representations, finetune
+
+
+if __name__ == '__main__':
+
+    """
+    Train a new head on a frozen Zoobot encoder, via cached representations.
+    The encoder runs once per galaxy (per view), not once per galaxy per epoch, so training the head takes seconds.
+
+    The catalog needs id_str, file_loc and a label column of integer classes (e.g. ring: 0 or 1).
+
+    Example:
+    python zoobot/pytorch/examples/finetune_on_representations.py --checkpoint /path/to/checkpoint.ckpt --catalog /path/to/catalog.csv --label-col ring --save-dir results/finetune --views 5
+    """
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s: %(message)s'
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', dest='checkpoint_loc', type=str)
+    parser.add_argument('--catalog', dest='catalog_loc', type=str)
+    parser.add_argument('--label-col', dest='label_col', type=str, default='ring')
+    parser.add_argument('--save-dir', dest='save_dir', type=str)
+    parser.add_argument('--views', dest='n_views', type=int, default=5,
+                        help='Augmented views of each training galaxy to extract')
+    parser.add_argument('--head', dest='head_type', type=str, default='mlp', help='linear, mlp or dirichlet')
+    parser.add_argument('--resize-size', dest='resize_size', type=int, default=224)
+    parser.add_argument('--color', default=False, action='store_true')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=256)
+    parser.add_argument('--num-workers', dest='num_workers', type=int, default=4)
+    args = parser.parse_args()
+
+    os.makedirs(args.save_dir, exist_ok=True)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    catalog = pd.read_csv(args.catalog_loc)
+    train_catalog, val_catalog = train_test_split(catalog, test_size=0.2, random_state=42)
+
+    model = define_model.ZoobotLightningModule.load_from_checkpoint(args.checkpoint_loc)
+    encoder = representations.get_encoder(model)
+
+    representation_locs = {}
+    for split, split_catalog, n_views in [('train', train_catalog, args.n_views), ('val', val_catalog, 1)]:
+        representation_locs[split] = os.path.join(args.save_dir, '{}_representations.npy'.format(split))
+        if os.path.isfile(representation_locs[split]):
+            logging.info('Using existing representations at {}'.format(representation_locs[split]))
+            continue
+        # the default (random) augmentations, so each view is different
+        datamodule = GalaxyDataModule(
+            label_cols=[args.label_col],
+            predict_catalog=split_catalog,
+            greyscale=not args.color,
+            resize_size=args.resize_size,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers
+        )
+        datamodule.setup(stage='predict')
+        representations.extract_representations(encoder, datamodule.predict_dataloader(), representation_locs[split], n_views=n_views, device=device)
+
+    train_loader = finetune.RepresentationLoader(
+        representations.load_representations(representation_locs['train']), train_catalog[args.label_col].values.astype(np.int64),
+        shuffle=True, device=device
+    )
+    val_loader = finetune.RepresentationLoader(
+        representations.load_representations(representation_locs['val']), val_catalog[args.label_col].values.astype(np.int64),
+        device=device
+    )
+
+    n_classes = int(catalog[args.label_col].max()) + 1
+    head = finetune.get_head(args.head_type, input_dim=train_loader.representations.shape[-1], output_dim=n_classes)
+    head, history = finetune.train_head(head, train_loader, torch.nn.functional.cross_entropy, val_loader=val_loader, device=device)
+
+    val_predictions = finetune.predict_with_head(head, val_loader)
+    val_accuracy = np.mean(val_predictions.argmax(axis=1) == val_catalog[args.label_col].values)
+    logging.info('Best val loss: {:.4f}, val accuracy: {:.3f}'.format(min(history['val_loss']), val_accuracy))
+
+    torch.save(head.state_dict(), os.path.join(args.save_dir, 'head.pt'))
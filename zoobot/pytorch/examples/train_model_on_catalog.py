@@ -47,6 +47,20 @@ if __name__ == '__main__':
                         default=0.2, type=float)
     parser.add_argument('--mixed-precision', dest='mixed_precision', default=False, action='store_true',
                         help='If true, use automatic mixed precision (via PyTorch Lightning) to reduce GPU memory use (~x2). Else, use full (32 bit) precision')
+    parser.add_argument('--cache-images', dest='cache_images', default=False, action='store_true',
+                        help='If true, decode and resize every image once into a shared uint8 array (under --cache-dir) rather than every epoch')
+    parser.add_argument('--cache-dir', dest='cache_dir', default='/dev/shm', type=str)
+    parser.add_argument('--dataloader-config', dest='dataloader_config_loc', default=None, type=str,
+                        help='JSON from autotune_dataloader.py. Overrides --batch-size and --num_workers.')
+    parser.add_argument('--progressive-resizing', dest='progressive_resizing', default=False, action='store_true',
+                        help='If true, train early epochs at lower resolution and larger batch size, stepping up to --resize-size')
+    parser.add_argument('--effective-batch-size', dest='effective_batch_size', default=None, type=int,
+                        help='Galaxies per optimizer step, over all gpus. Accumulates gradients over several batches if larger than --batch-size * --gpus.')
+    parser.add_argument('--check-val-every-n-epoch', dest='check_val_every_n_epoch', default=1, type=int)
+    parser.add_argument('--val-subsample-size', dest='val_subsample_size', default=None, type=int,
+                        help='Validate on only this many (fixed) val galaxies, to save time on large catalogs')
+    parser.add_argument('--val-mc-passes', dest='val_mc_passes', default=1, type=int,
+                        help='Validate on each val galaxy this many times, with different augmentations')
     parser.add_argument('--debug', dest='debug', default=False, action='store_true',
                         help='If true, cut each catalog down to 5k galaxies (for quick training). Should cause overfitting.')
     args = parser.parse_args()
@@ -91,16 +105,24 @@ if __name__ == '__main__':
         schema=schema,
         model_architecture=args.model_architecture,
         batch_size=args.batch_size,
+        effective_batch_size=args.effective_batch_size,
         epochs=args.epochs,
         patience=args.patience,
+        check_val_every_n_epoch=args.check_val_every_n_epoch,
+        val_subsample_size=args.val_subsample_size,
+        val_mc_passes=args.val_mc_passes,
         # augmentation parameters
         color=args.color,
         resize_size=args.resize_size,
+        cache_images=args.cache_images,
+        cache_dir=args.cache_dir,
+        progressive_resizing=args.progressive_resizing,
         # hardware parameters
         accelerator=args.accelerator,
         nodes=args.nodes,
         gpus=args.gpus,
         num_workers=args.num_workers,
+        dataloader_config_loc=args.dataloader_config_loc,
         mixed_precision=args.mixed_precision,
         wandb_logger=wandb_logger
     )
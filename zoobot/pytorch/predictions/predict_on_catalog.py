@@ -8,13 +8,18 @@ import torch
 import pytorch_lightning as pl
 
 from zoobot.shared import save_predictions
+from zoobot.pytorch.training import autotune
 from pytorch_galaxy_datasets.galaxy_datamodule import GalaxyDataModule
 
 
-def predict(catalog: pd.DataFrame, model: pl.LightningModule, n_samples: int, label_cols: List, save_loc: str, datamodule_kwargs, trainer_kwargs):
+def predict(catalog: pd.DataFrame, model: pl.LightningModule, n_samples: int, label_cols: List, save_loc: str, datamodule_kwargs, trainer_kwargs, dataloader_config_loc=None):
 
     image_id_strs = list(catalog['id_str'])
 
+    if dataloader_config_loc is not None:
+        # e.g. from autotune.autotune_dataloader(mode='predict'), overrides batch_size, num_workers and prefetch_factor
+        datamodule_kwargs = {**datamodule_kwargs, **autotune.load_dataloader_config(dataloader_config_loc)}
+
     predict_datamodule = GalaxyDataModule(
         label_cols=label_cols,
         predict_catalog=catalog,  # no need to specify the other catalogs
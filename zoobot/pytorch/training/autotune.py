@@ -0,0 +1,220 @@
+"""
+Choose batch_size, num_workers and prefetch_factor by timing short trials on the real dataset and model,
+rather than guessing (and hoping num_workers * gpus <= cpu count).
+
+Saves the best configuration to JSON, which train_with_pytorch_lightning.train_default_zoobot_from_scratch and
+predict_on_catalog.predict accept via dataloader_config_loc.
+"""
+import os
+import copy
+import json
+import time
+import logging
+import itertools
+
+import torch
+from torch.utils.data import DataLoader
+
+from zoobot.pytorch.estimators import custom_callbacks
+
+
+def autotune_dataloader(
+    model,
+    dataset,
+    save_loc=None,
+    mode='train',
+    batch_sizes=(64, 128, 256, 512),
+    num_workers_options=(2, 4, 8, 16),
+    prefetch_factors=(2, 4),
+    gpus=1,
+    steps=20,
+    warmup_steps=5,
+    gpu_memory_budget_gb=None,
+    host_memory_budget_gb=None,
+    device=None
+    ):
+    """
+    Time each combination of batch_size, num_workers and prefetch_factor for a few steps, and pick the one with the best
+    sustained images/sec (i.e. after warmup_steps) within the memory budgets.
+
+    Trials use a copy of model, so model is not changed.
+    Batch sizes are tried in increasing order - once one runs out of gpu memory, larger batch sizes are skipped.
+    num_workers_options above cpu_count // gpus are skipped, as each DDP process has its own workers.
+
+    Note that batch size also affects training dynamics (e.g. the best learning rate), not only speed.
+
+    Args:
+        model (pl.LightningModule): e.g. define_model.ZoobotLightningModule, with loss_func attribute (if mode='train')
+        dataset (torch.utils.data.Dataset): e.g. datamodule.train_dataset, after datamodule.setup()
+        save_loc (str, optional): save best configuration (and all trials) to this JSON file. Defaults to None.
+        mode (str, optional): 'train' (forward, backward and optimizer step) or 'predict' (forward only). Defaults to 'train'.
+        batch_sizes (tuple, optional): batch sizes (per gpu) to try. Defaults to (64, 128, 256, 512).
+        num_workers_options (tuple, optional): dataloader workers (per gpu) to try. Defaults to (2, 4, 8, 16).
+        prefetch_factors (tuple, optional): batches prefetched per worker to try. Defaults to (2, 4).
+        gpus (int, optional): gpus that will be used for training, to limit workers per gpu. Defaults to 1.
+        steps (int, optional): steps per trial, including warmup. Defaults to 20.
+        warmup_steps (int, optional): steps to ignore at the start of each trial (worker startup, cudnn autotuning). Defaults to 5.
+        gpu_memory_budget_gb (float, optional): max gpu memory reserved. Defaults to None, meaning 90% of the device.
+        host_memory_budget_gb (float, optional): max RSS of main process plus workers. Defaults to None (no limit).
+        device (str, optional): device for trials. Defaults to None, meaning cuda if available else cpu.
+
+    Returns:
+        dict: best configuration (batch_size, num_workers, prefetch_factor, images_per_sec, ...) and all trials (under 'trials')
+    """
+    assert mode in ['train', 'predict']
+    assert steps > warmup_steps
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    device = torch.device(device)
+    if device.type == 'cuda' and gpu_memory_budget_gb is None:
+        gpu_memory_budget_gb = 0.9 * torch.cuda.get_device_properties(device).total_memory / 1024 ** 3
+
+    max_workers = max(os.cpu_count() // gpus, 1)
+    num_workers_options = [n for n in num_workers_options if n <= max_workers]
+    if not num_workers_options:
+        num_workers_options = [max_workers]
+    logging.info('Autotuning over batch sizes {}, num_workers {}, prefetch factors {}'.format(batch_sizes, num_workers_options, prefetch_factors))
+
+    trial_model = copy.deepcopy(model).to(device)
+    if mode == 'train':
+        trial_model.train()
+        optimizer = torch.optim.Adam(trial_model.parameters())
+    else:
+        trial_model.eval()
+        optimizer = None
+
+    trials = []
+    for batch_size in sorted(batch_sizes):
+        out_of_memory = False
+        for num_workers, prefetch_factor in itertools.product(num_workers_options, prefetch_factors):
+            trial = run_trial(trial_model, optimizer, dataset, batch_size, num_workers, prefetch_factor, steps, warmup_steps, device)
+            trial['within_budget'] = (not trial['out_of_memory']) and within_budget(trial, gpu_memory_budget_gb, host_memory_budget_gb)
+            logging.info('Autotune trial: {}'.format(trial))
+            trials.append(trial)
+            if trial['out_of_memory']:
+                out_of_memory = True
+                break
+        if out_of_memory:
+            logging.info('Batch size {} ran out of memory - not trying larger batch sizes'.format(batch_size))
+            break
+
+    valid_trials = [trial for trial in trials if trial['within_budget']]
+    if not valid_trials:
+        raise ValueError('No autotune trial fit within the memory budget: {}'.format(trials))
+    best = max(valid_trials, key=lambda trial: trial['images_per_sec'])
+    config = {
+        'batch_size': best['batch_size'],
+        'num_workers': best['num_workers'],
+        'prefetch_factor': best['prefetch_factor'],
+        'images_per_sec': best['images_per_sec'],
+        'mode': mode,
+        'device': str(device),
+        'gpus': gpus,
+        'trials': trials
+    }
+    logging.info('Best dataloader config: batch_size={}, num_workers={}, prefetch_factor={} ({:.1f} images/sec)'.format(
+        best['batch_size'], best['num_workers'], best['prefetch_factor'], best['images_per_sec']))
+
+    if save_loc is not None:
+        with open(save_loc, 'w') as f:
+            json.dump(config, f, indent=4)
+    return config
+
+
+def run_trial(model, optimizer, dataset, batch_size, num_workers, prefetch_factor, steps, warmup_steps, device):
+    trial = {
+        'batch_size': batch_size,
+        'num_workers': num_workers,
+        'prefetch_factor': prefetch_factor,
+        'images_per_sec': 0.,
+        'out_of_memory': False,
+        'gpu_memory_gb': None,
+        'host_memory_gb': None
+    }
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+
+    # same settings as GalaxyDataModule, except persistent_workers (each trial is a fresh loader)
+    dataloader = DataLoader(
+        dataset, batch_size=batch_size, shuffle=True, drop_last=True, num_workers=num_workers,
+        pin_memory=device.type == 'cuda', prefetch_factor=prefetch_factor
+    )
+    iterator = iter(dataloader)
+    host_memory_mb = 0.
+    images = 0
+    try:
+        for step in range(steps):
+            if step == warmup_steps:
+                synchronize(device)
+                start = time.perf_counter()
+                images = 0
+            try:
+                batch = next(iterator)
+            except StopIteration:  # small dataset, start again
+                iterator = iter(dataloader)
+                batch = next(iterator)
+            run_step(model, optimizer, batch, device)
+            images += len(batch[0])
+            if step == steps - 1:  # measure memory while workers are still alive
+                workers_rss_mb = custom_callbacks.get_dataloader_workers_rss_mb(iterator) or 0.
+                host_memory_mb = custom_callbacks.get_process_rss_mb() + workers_rss_mb
+        synchronize(device)
+        trial['images_per_sec'] = images / (time.perf_counter() - start)
+    except RuntimeError as e:
+        if 'out of memory' not in str(e):
+            raise e
+        trial['out_of_memory'] = True
+    finally:
+        del iterator  # shut down workers
+        if optimizer is not None:
+            optimizer.zero_grad(set_to_none=True)
+
+    trial['host_memory_gb'] = host_memory_mb / 1024.
+    if device.type == 'cuda':
+        trial['gpu_memory_gb'] = torch.cuda.max_memory_reserved(device) / 1024 ** 3
+    return trial
+
+
+def run_step(model, optimizer, batch, device):
+    # as GenericLightningModule.training_step/predict_step, without the trainer (no logging)
+    x, labels = batch
+    x, labels = model.on_after_batch_transfer((x.to(device, non_blocking=True), labels.to(device, non_blocking=True)), 0)
+    if optimizer is None:
+        with torch.no_grad():
+            model(x)
+    else:
+        loss = torch.mean(model.loss_func(model(x), labels))
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def within_budget(trial, gpu_memory_budget_gb, host_memory_budget_gb):
+    if (gpu_memory_budget_gb is not None) and (trial['gpu_memory_gb'] is not None) and (trial['gpu_memory_gb'] > gpu_memory_budget_gb):
+        return False
+    if (host_memory_budget_gb is not None) and (trial['host_memory_gb'] > host_memory_budget_gb):
+        return False
+    return True
+
+
+def load_dataloader_config(config_loc):
+    """
+    Load dataloader settings saved by autotune_dataloader.
+
+    Args:
+        config_loc (str): path to JSON saved by autotune_dataloader
+
+    Returns:
+        dict: of form {'batch_size': int, 'num_workers': int, 'prefetch_factor': int}
+    """
+    with open(config_loc, 'r') as f:
+        config = json.load(f)
+    logging.info('Loaded dataloader config from {}: batch_size={}, num_workers={}, prefetch_factor={}'.format(
+        config_loc, config['batch_size'], config['num_workers'], config['prefetch_factor']))
+    return dict([(key, config[key]) for key in ['batch_size', 'num_workers', 'prefetch_factor']])
@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import pyro
 
@@ -34,6 +35,93 @@ def calculate_multiquestion_loss(labels, predictions, question_index_groups):
     return total_loss  # leave the reduction to pytorch lightning
 
 
+def calculate_sparse_multiquestion_loss(labels, predictions, question_index_groups, question_mask=None):
+    """
+    Equivalent to :meth:`calculate_multiquestion_loss`, but only calculates the likelihood for questions which have votes.
+
+    With a schema combining several campaigns (e.g. ``label_metadata.decals_all_campaigns_ortho_pairs``), each galaxy only has votes for one campaign's questions.
+    The remaining questions have zero votes and hence zero neg. log likelihood, but the dense loss calculates them anyway.
+    Here, the answers of populated questions are gathered into a compact (flat) tensor, the likelihood is calculated on those with ``torch.lgamma``,
+    and the results are scattered back into a (batch, question) tensor of zeros. Cost then scales with the votes present, not with the schema size.
+
+    Args:
+        labels (torch.Tensor): (galaxy, k successes) where k successes dimension is indexed by question_index_groups.
+        predictions (torch.Tensor):  Dirichlet concentrations, matching shape of labels
+        question_index_groups (list): Paired (tuple) integers of (first, last) indices of answers to each question, listed for all questions.
+        question_mask (torch.Tensor, optional): bool of shape (batch, question), True where that galaxy's question should be included e.g. questions from that galaxy's campaign.
+            If None, include questions with any votes. Defaults to None.
+
+    Returns:
+        torch.Tensor: neg. log likelihood of shape (batch, question). Zero where ``question_mask`` is False.
+    """
+    labels = labels.to(predictions.dtype)
+    batch_size, num_answers = predictions.shape
+    num_questions = len(question_index_groups)
+    segment_ids = torch.from_numpy(get_answer_segment_ids(question_index_groups, num_answers)).to(predictions.device)
+    in_question = segment_ids >= 0
+    safe_segment_ids = segment_ids.clamp(min=0)  # answers outside any question are masked out by in_question
+
+    if question_mask is None:
+        total_count_by_question = labels.new_zeros(batch_size, num_questions).index_add_(1, safe_segment_ids[in_question], labels[:, in_question])
+        question_mask = total_count_by_question > 0
+    question_mask = question_mask.bool()
+
+    # gather the answers of included questions into a flat tensor
+    answer_mask = question_mask[:, safe_segment_ids] & in_question
+    galaxy_indices, answer_indices = answer_mask.nonzero(as_tuple=True)
+    answer_labels = labels[galaxy_indices, answer_indices]
+    answer_concentrations = predictions[galaxy_indices, answer_indices]
+    answer_terms = torch.lgamma(answer_labels + answer_concentrations) - torch.lgamma(answer_concentrations) - torch.lgamma(answer_labels + 1.)
+
+    # index each included (galaxy, question) pair in row-major order, matching masked_scatter below
+    compact_question_ids = torch.cumsum(question_mask.flatten().long(), dim=0) - 1
+    answer_question_ids = compact_question_ids[galaxy_indices * num_questions + segment_ids[answer_indices]]
+    num_included = int(question_mask.sum())
+
+    def sum_by_question(x):
+        return x.new_zeros(num_included).index_add_(0, answer_question_ids, x)
+
+    total_count = sum_by_question(answer_labels)
+    total_concentration = sum_by_question(answer_concentrations)
+    log_prob = torch.lgamma(total_count + 1.) + torch.lgamma(total_concentration) - torch.lgamma(total_count + total_concentration) + sum_by_question(answer_terms)
+
+    # scatter back, with zero neg. log prob (i.e. prob of 1) for excluded questions
+    return predictions.new_zeros(batch_size, num_questions).masked_scatter(question_mask, -log_prob)
+
+
+def split_question_mask(labels, num_questions):
+    """
+    Split labels with question mask columns appended (see schemas.Schema.question_mask_cols) into answer counts and question mask.
+
+    Args:
+        labels (torch.Tensor): of shape (batch, answers + questions)
+        num_questions (int): number of questions, i.e. of mask columns
+
+    Returns:
+        torch.Tensor: answer counts, of shape (batch, answers)
+        torch.Tensor: bool question mask, of shape (batch, questions)
+    """
+    return labels[:, :-num_questions], labels[:, -num_questions:] > 0
+
+
+def get_answer_segment_ids(question_index_groups, answers):
+    """
+    Label each answer (i.e. each column of labels/predictions) with the index of the question it belongs to.
+    Columns not covered by any question get segment id -1.
+
+    Args:
+        question_index_groups (list): Paired (tuple) integers of (first, last) indices of answers to each question, listed for all questions.
+        answers (int): total number of answers (i.e. labels.shape[1])
+
+    Returns:
+        np.ndarray: int64 question index for each answer, of shape (answers)
+    """
+    segment_ids = np.full(answers, -1, dtype=np.int64)
+    for q_n, (q_start, q_end) in enumerate(question_index_groups):
+        segment_ids[q_start:q_end+1] = q_n
+    return segment_ids
+
+
 def dirichlet_loss(labels_for_q, concentrations_for_q):
     """
     Negative log likelihood of ``labels_for_q`` being drawn from Dirichlet-Multinomial distribution with ``concentrations_for_q`` concentrations.
@@ -56,49 +144,8 @@ def dirichlet_loss(labels_for_q, concentrations_for_q):
 
     # pytorch dirichlet multinomial implementation will not accept zero total votes, need to handle separately
     return get_dirichlet_neg_log_prob(labels_for_q, total_count, concentrations_for_q)
-
-
-    # # return tf.where(
-    # #     tf.math.equal(total_count, 0),  # if total_count is 0 (i.e. no votes)
-    # #     tf.constant(0.),  # prob is 1 and (neg) log prob is 0, with no gradients attached. broadcasts
-    # #     get_dirichlet_neg_log_prob(labels_for_q, total_count, concentrations_for_q)  # else, calculate neg log prob
-    # # )
-    # # # slightly inefficient as get_dirichlet_neg_log_prob forward pass done for all, but avoids gradients
-    # # # https://www.tensorflow.org/api_docs/python/tf/where
-    # # works great, but about 50% slower than optimal
-
-    # logging.info(total_count)
-
-    # indices = torch.arange(0, len(total_count), dtype=torch.long)
-    # indices_with_nonzero_counts = indices[total_count > 0]  # returns a tuple for some reason
-    #     # torch.equal(total_count, torch.zeros(size=(1,)))
-
-    # logging.info(indices_with_nonzero_counts)
-    # # logging.info(type(indices_with_nonzero_counts))
-    # # logging.info('Nonzero indices: {}'.format(indices_with_nonzero_counts.cpu().numpy()))
-    
-    # # may potentially need to deal with the situation where there are 0 valid indices?
-    # nonzero_total_count = total_count[indices_with_nonzero_counts]
-    # nonzero_labels_for_q = labels_for_q[indices_with_nonzero_counts]
-    # nonzero_concentrations_for_q = concentrations_for_q[indices_with_nonzero_counts]
-
-    # logging.info(nonzero_total_count)
-
-    # neg_log_prob_of_indices_with_nonzero_counts = get_dirichlet_neg_log_prob(nonzero_labels_for_q, nonzero_total_count, nonzero_concentrations_for_q)
-    # logging.info(neg_log_prob_of_indices_with_nonzero_counts)
-    # # logging.info('Probs of nonzero indices: {}'.format(neg_log_prob_of_indices_with_nonzero_counts.numpy()))
-
-    # # not needed, scatter_nd has 0 where no value is placed (and 0 as log prob = 0 as prob = 1)
-    # # neg_log_prob_of_indices_with_zero_counts = tf.zeros_like(indices_with_zero_counts)
-
-    # # now mix back together
-    # # The backward pass is implemented only for src.shape == index.shape, true in my case (each neg lob prob goes exactly one place)
-    # mixed_back = torch.zeros_like(total_count).scatter_(dim=0, index=indices_with_nonzero_counts, src=neg_log_prob_of_indices_with_nonzero_counts)
-    # return mixed_back
-    # # return tf.scatter_nd(indices_with_nonzero_counts, neg_log_prob_of_indices_with_nonzero_counts, shape=output_shape)
-
-
-    # # return get_dirichlet_neg_log_prob(labels_for_q, total_count, concentrations_for_q)
+    # galaxies with no votes for this question have zero neg. log prob (and zero gradients) anyway
+    # to skip computing them entirely, see calculate_sparse_multiquestion_loss
 
 
 def get_dirichlet_neg_log_prob(labels_for_q, total_count, concentrations_for_q):
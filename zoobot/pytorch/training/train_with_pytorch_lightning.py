@@ -1,15 +1,17 @@
 import logging
 import os
 
+import numpy as np
+
 from pytorch_lightning.plugins.training_type import DDPPlugin
 # https://github.com/PyTorchLightning/pytorch-lightning/blob/1.1.6/pytorch_lightning/plugins/ddp_plugin.py
 import pytorch_lightning as pl
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.callbacks.early_stopping import EarlyStopping
 
-from pytorch_galaxy_datasets.galaxy_datamodule import GalaxyDataModule
-
-from zoobot.pytorch.estimators import define_model
+from zoobot.pytorch.data_utils.galaxy_datamodule import ZoobotDataModule, NpyShardDataModule
+from zoobot.pytorch.estimators import define_model, custom_callbacks
+from zoobot.pytorch.training import autotune
 
 
 # convenient API for training Zoobot (aka a base cnn model + dirichlet head) from scratch on a big galaxy catalog using sensible augmentations
@@ -23,30 +25,56 @@ def train_default_zoobot_from_scratch(
     train_catalog=None,
     val_catalog=None,
     test_catalog=None,
+    # or, pre-resized npy shards from data_utils.npy_shards.prepare_npy_shards (with {train, val, test}_shards subdirectories)
+    npy_shard_dir=None,
     # training parameters
     epochs=1000,
-    patience=8,
+    patience=8,  # epochs without improved val loss, however often validation runs
+    # validation parameters. Validation can be a large share of each epoch on big catalogs - these make it cheaper.
+    check_val_every_n_epoch=1,
+    val_check_interval=None,  # validate every this many train batches (int) or fraction of an epoch (float). Defaults to once per epoch.
+    val_subsample_size=None,  # validate on only this many val galaxies, always the same ones. Defaults to all.
+    val_mc_passes=1,  # validate on each galaxy this many times (with different augmentations)
     # model hparams
     architecture_name='efficientnet',  # recently changed
     batch_size=256,
     dropout_rate=0.2,
     drop_connect_rate=0.2,
+    sparse_loss=False,  # skip questions without votes, useful for schemas combining several campaigns
+    question_mask=False,  # instead, skip questions according to schema.question_mask_cols columns in the catalog (or shards). Requires sparse_loss.
+    learning_rate=0.001,
+    # optimizer step every accumulate_grad_batches batches (per device). Or, set effective_batch_size (galaxies per optimizer step, over all devices) to choose it for you.
+    accumulate_grad_batches=1,
+    effective_batch_size=None,
+    reference_batch_size=None,  # if set, scale learning_rate by effective batch size / reference_batch_size. 512 for the 2xA100 recipe (2x256, lr=0.001).
     # data and augmentation parameters
     # datamodule_class=GalaxyDataModule,  # generic catalog of galaxies, will not download itself. Can replace with any datamodules from pytorch_galaxy_datasets
     color=False,
     resize_size=224,
     crop_scale_bounds=(0.7, 0.8),
     crop_ratio_bounds=(0.9, 1.1),
+    # decode and resize all images once into a shared uint8 array, rather than every epoch
+    cache_images=False,
+    cache_dir='/dev/shm',  # shared memory. Or a local SSD, if the catalog is too big for RAM.
+    batch_augmentation=False,  # augment whole batches on the gpu, rather than per image in dataloader workers
+    # train early epochs at lower resolution and larger batch size, see custom_callbacks.ProgressiveResizing
+    progressive_resizing=False,
+    progressive_resizing_schedule=None,  # list of {'epoch', 'resize_size', 'batch_size'}. Defaults to custom_callbacks.get_progressive_resizing_schedule.
     # hardware parameters
     accelerator='auto',
     nodes=1,
     gpus=2,
     num_workers=4,
     prefetch_factor=4,
+    dataloader_config_loc=None,  # JSON from autotune.autotune_dataloader. Overrides batch_size, num_workers and prefetch_factor.
     mixed_precision=False,
+    compile_model=False,  # torch.compile the model and loss (requires torch >= 2.0)
+    checkpoint_stages=False,  # recompute efficientnet activations in backward pass - slower, but fits larger batches
     # replication parameters
     random_state=42,
     wandb_logger=None,
+    # record where the time goes in each step (to save_dir/throughput.jsonl), see custom_callbacks.ThroughputMonitor
+    monitor_throughput=False,
     # checkpointing
     checkpoint_file_template=None,
     auto_insert_metric_name=True,
@@ -55,6 +83,11 @@ def train_default_zoobot_from_scratch(
 
     slurm_debugging_logs()
 
+    if question_mask and not sparse_loss:
+        raise ValueError('question_mask requires sparse_loss')
+    # mask columns are loaded alongside the labels, and split off by the loss
+    label_cols = schema.label_cols + schema.question_mask_cols if question_mask else schema.label_cols
+
     pl.seed_everything(random_state)
 
     assert save_dir is not None
@@ -87,8 +120,20 @@ def train_default_zoobot_from_scratch(
             'Training with automatic mixed precision. Will reduce memory footprint but may cause training instability for e.g. resnet')
         precision = 16
 
+    if dataloader_config_loc is not None:
+        dataloader_config = autotune.load_dataloader_config(dataloader_config_loc)
+        batch_size = dataloader_config['batch_size']
+        num_workers = dataloader_config['num_workers']
+        prefetch_factor = dataloader_config['prefetch_factor']
+
     assert num_workers > 0
 
+    if effective_batch_size is not None:
+        accumulate_grad_batches = get_accumulate_grad_batches(effective_batch_size, batch_size, devices=(gpus or 1) * nodes)
+    if accumulate_grad_batches > 1:
+        logging.info('Accumulating gradients over {} batches (effective batch size {})'.format(
+            accumulate_grad_batches, accumulate_grad_batches * batch_size * (gpus or 1) * nodes))
+
     if (gpus is not None) and (num_workers * gpus > os.cpu_count()):
         logging.warning(
             """num_workers * gpu > num cpu.
@@ -102,25 +147,39 @@ def train_default_zoobot_from_scratch(
             Suggest reducing num_workers."""
         )
 
-    if catalog is not None:
-        assert train_catalog is None
-        assert val_catalog is None
-        assert test_catalog is None
-        catalogs_to_use = {
-            'catalog': catalog
-        }
+    if npy_shard_dir is not None:
+        assert catalog is None and train_catalog is None
+        datamodule_class = NpyShardDataModule
+        data_kwargs = dict([
+            (split + '_dir', os.path.join(npy_shard_dir, split + '_shards')) for split in ['train', 'val', 'test']
+        ])
     else:
-        assert catalog is None
-        catalogs_to_use = {
-            'train_catalog': train_catalog,
-            'val_catalog': val_catalog,
-            'test_catalog': test_catalog
+        if catalog is not None:
+            assert train_catalog is None
+            assert val_catalog is None
+            assert test_catalog is None
+            catalogs_to_use = {
+                'catalog': catalog
+            }
+        else:
+            assert catalog is None
+            catalogs_to_use = {
+                'train_catalog': train_catalog,
+                'val_catalog': val_catalog,
+                'test_catalog': test_catalog
+            }
+        datamodule_class = ZoobotDataModule
+        data_kwargs = {
+            'label_cols': label_cols,
+            # can take either a catalog (and split it), or a pre-split catalog
+            **catalogs_to_use,
+            'cache_images': cache_images,
+            'cache_dir': cache_dir
         }
+    data_kwargs.update({'val_subsample_size': val_subsample_size, 'val_mc_passes': val_mc_passes})
 
-    datamodule = GalaxyDataModule(
-        label_cols=schema.label_cols,
-        # can take either a catalog (and split it), or a pre-split catalog
-        **catalogs_to_use,
+    datamodule = datamodule_class(
+        **data_kwargs,
         #   augmentations parameters
         album=False,
         greyscale=not color,
@@ -130,8 +189,10 @@ def train_default_zoobot_from_scratch(
         #   hardware parameters
         batch_size=batch_size, # on 2xA100s, 256 with DDP, 512 with distributed (i.e. split batch)
         num_workers=num_workers,
-        prefetch_factor=prefetch_factor
+        prefetch_factor=prefetch_factor,
+        batch_augmentation=batch_augmentation
     )
+    assert list(datamodule.label_cols) == list(label_cols)
     datamodule.setup()
 
     lightning_model = define_model.ZoobotLightningModule(
@@ -143,9 +204,28 @@ def train_default_zoobot_from_scratch(
         always_augment=True,
         dropout_rate=dropout_rate,
         drop_connect_rate=drop_connect_rate,
-        architecture_name=architecture_name
+        architecture_name=architecture_name,
+        sparse_loss=sparse_loss,
+        batch_augmentation=batch_augmentation,
+        resize_size=resize_size,
+        crop_scale_bounds=crop_scale_bounds,
+        crop_ratio_bounds=crop_ratio_bounds,
+        compile_model=compile_model,
+        checkpoint_stages=checkpoint_stages,
+        learning_rate=learning_rate,
+        reference_batch_size=reference_batch_size,
+        question_mask=question_mask
     )
 
+    # EarlyStopping counts validations, not epochs
+    train_batches = None
+    if isinstance(val_check_interval, int):
+        train_batches = len(datamodule.train_dataloader()) // ((gpus or 1) * nodes)  # per device
+    val_checks_per_epoch = get_val_checks_per_epoch(val_check_interval, train_batches)
+    val_patience = get_val_patience(patience, check_val_every_n_epoch, val_checks_per_epoch)
+    if val_patience != patience:
+        logging.info('Early stopping after {} validations without improvement ({} epochs)'.format(val_patience, patience))
+
     callbacks = [
         ModelCheckpoint(
             dirpath=os.path.join(save_dir, 'checkpoints'),
@@ -159,8 +239,17 @@ def train_default_zoobot_from_scratch(
             auto_insert_metric_name=auto_insert_metric_name,
             save_top_k=save_top_k
         ),
-        EarlyStopping(monitor='val/supervised_loss', patience=patience, check_finite=True)
+        EarlyStopping(monitor='val/supervised_loss', patience=val_patience, check_finite=True)
     ]
+    if progressive_resizing:
+        if progressive_resizing_schedule is None:
+            progressive_resizing_schedule = custom_callbacks.get_progressive_resizing_schedule(resize_size, batch_size)
+        callbacks.append(custom_callbacks.ProgressiveResizing(
+            progressive_resizing_schedule,
+            save_loc=os.path.join(save_dir, 'progressive_resizing_schedule.json')
+        ))
+    if monitor_throughput:
+        callbacks.append(custom_callbacks.ThroughputMonitor(save_loc=os.path.join(save_dir, 'throughput.jsonl')))
 
     trainer = pl.Trainer(
         log_every_n_steps=200,
@@ -172,7 +261,11 @@ def train_default_zoobot_from_scratch(
         logger=wandb_logger,
         callbacks=callbacks,
         max_epochs=epochs,
+        accumulate_grad_batches=accumulate_grad_batches,
+        check_val_every_n_epoch=check_val_every_n_epoch,
+        val_check_interval=val_check_interval if val_check_interval is not None else 1.0,
         default_root_dir=save_dir
+        # with progressive_resizing, the callback reloads the train dataloader at each new stage
     )
 
     logging.info((trainer.training_type_plugin, trainer.world_size,
@@ -216,6 +309,55 @@ def train_default_zoobot_from_scratch(
     #       break  # only inner loop aka don't log the whole dataloader
 
 
+def get_accumulate_grad_batches(effective_batch_size, batch_size, devices=1):
+    """
+    Gradient accumulation steps such that batch_size (per device) * devices * steps = effective_batch_size.
+
+    Args:
+        effective_batch_size (int): galaxies per optimizer step, over all devices
+        batch_size (int): galaxies per batch, per device
+        devices (int, optional): number of devices (gpus * nodes). Defaults to 1.
+
+    Returns:
+        int: batches to accumulate per optimizer step
+    """
+    galaxies_per_batch = batch_size * devices
+    if effective_batch_size % galaxies_per_batch != 0:
+        raise ValueError('effective_batch_size {} is not a multiple of batch_size {} * devices {}'.format(effective_batch_size, batch_size, devices))
+    return max(effective_batch_size // galaxies_per_batch, 1)
+
+
+def get_val_checks_per_epoch(val_check_interval, train_batches):
+    """
+    Args:
+        val_check_interval (int or float): as for pl.Trainer - train batches between validations (int), or fraction of an epoch (float). None for once per epoch.
+        train_batches (int): train batches per epoch (per device). Only needed if val_check_interval is an int.
+
+    Returns:
+        int: validations per epoch
+    """
+    if val_check_interval is None:
+        return 1
+    if isinstance(val_check_interval, float):
+        return max(int(1 / val_check_interval), 1)
+    return max(train_batches // val_check_interval, 1)
+
+
+def get_val_patience(patience, check_val_every_n_epoch=1, val_checks_per_epoch=1):
+    """
+    Convert early stopping patience in epochs to patience in validations, which is what EarlyStopping counts.
+
+    Args:
+        patience (int): epochs without improvement before stopping
+        check_val_every_n_epoch (int, optional): as for pl.Trainer. Defaults to 1.
+        val_checks_per_epoch (int, optional): from get_val_checks_per_epoch. Defaults to 1.
+
+    Returns:
+        int: validations without improvement before stopping
+    """
+    return max(int(np.ceil(patience * val_checks_per_epoch / check_val_every_n_epoch)), 1)
+
+
 def slurm_debugging_logs():
     # https://hpcc.umd.edu/hpcc/help/slurmenv.html
     # logging.info(os.environ)
@@ -0,0 +1,88 @@
+"""
+Extract representations (pooled encoder outputs, 1280-dim for efficientnet_b0) from a trained Zoobot model, once, and cache them to disk.
+New heads can then be trained on the cached representations in seconds (see finetune.train_head),
+rather than running the (frozen) encoder on every galaxy every epoch.
+
+Representations are saved as a float32 .npy array of shape (view, galaxy, feature), readable with np.load(mmap_mode='r').
+With augmentations in the dataloader, each view is a different augmentation of every galaxy - a cheap stand-in for augmenting during finetuning.
+"""
+import os
+import logging
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+
+def get_encoder(model):
+    """
+    Encoder (everything up to and including global pooling) of a Zoobot model.
+
+    Args:
+        model (nn.Module): define_model.ZoobotLightningModule, or a plain model from define_model.get_plain_pytorch_zoobot_model
+
+    Returns:
+        nn.Module: encoder, giving representations of shape (batch, representation_dim)
+    """
+    plain_model = getattr(model, 'model', model)  # lightning module or plain model
+    plain_model = getattr(plain_model, '_orig_mod', plain_model)  # in case compiled
+    return plain_model[0]  # efficientnet (or resnet) with pooling but no head, as first layer of get_plain_pytorch_zoobot_model
+
+
+def extract_representations(encoder, dataloader, save_loc, n_views=1, device=None):
+    """
+    Save the representation of every galaxy in dataloader, n_views times, to a .npy file.
+
+    dataloader must not shuffle - galaxy i is row i of every view. Augmentations (if any) are whatever the dataloader applies,
+    so for n_views > 1 use a dataloader with random augmentations, and for n_views = 1 probably without.
+    The encoder runs in eval mode (no dropout, fixed batchnorm) and without gradients.
+
+    Written to a temporary file then renamed, so save_loc is only ever complete.
+
+    Args:
+        encoder (nn.Module): e.g. from get_encoder
+        dataloader (torch.utils.data.DataLoader): yields (images, labels) batches, not shuffled
+        save_loc (str): path for .npy file of shape (n_views, galaxies, representation_dim)
+        n_views (int, optional): passes through dataloader. Defaults to 1.
+        device (str, optional): device to run encoder. Defaults to None, meaning cuda if available else cpu.
+
+    Returns:
+        np.memmap: representations, of shape (n_views, galaxies, representation_dim)
+    """
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    encoder = encoder.to(device)
+    encoder.eval()
+
+    n_galaxies = len(dataloader.dataset)
+    tmp_loc = save_loc + '.tmp'
+    representations = None
+    with torch.no_grad():
+        for view in range(n_views):
+            logging.info('Extracting representations: view {} of {}'.format(view + 1, n_views))
+            row = 0
+            for images, _ in tqdm(dataloader, unit='batches'):
+                batch_representations = encoder(images.to(device, non_blocking=True)).float().cpu().numpy()
+                if representations is None:  # now we know the representation_dim
+                    representations = np.lib.format.open_memmap(
+                        tmp_loc, mode='w+', dtype=np.float32, shape=(n_views, n_galaxies, batch_representations.shape[1]))
+                representations[view, row:row + len(batch_representations)] = batch_representations
+                row += len(batch_representations)
+            assert row == n_galaxies, 'dataloader yielded {} galaxies, expected {} - drop_last?'.format(row, n_galaxies)
+
+    representations.flush()
+    del representations
+    os.replace(tmp_loc, save_loc)
+    logging.info('Saved representations to {}'.format(save_loc))
+    return load_representations(save_loc)
+
+
+def load_representations(save_loc):
+    """
+    Args:
+        save_loc (str): .npy file saved by extract_representations
+
+    Returns:
+        np.memmap: representations, of shape (n_views, galaxies, representation_dim)
+    """
+    return np.load(save_loc, mmap_mode='r')
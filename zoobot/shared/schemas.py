@@ -205,6 +205,17 @@ class Schema():
         return [(q.start_index, q.end_index) for q in self.questions]
 
 
+    @property
+    def question_mask_cols(self):
+        """
+
+        Returns:
+            list: name of an (optional) catalog column for each question, like 'smooth-or-featured_mask'. 1 where that galaxy's question should count towards the loss (e.g. asked in that galaxy's campaign), else 0.
+                Used with sparse losses (see losses.get_multiquestion_loss(masked=True)).
+        """
+        return [q.text + '_mask' for q in self.questions]
+
+
     @property
     def named_index_groups(self):
         """
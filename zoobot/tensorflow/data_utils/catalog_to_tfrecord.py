@@ -6,10 +6,10 @@ import pandas as pd
 import tensorflow as tf
 from PIL import Image
 
-from zoobot.tensorflow.data_utils import create_tfrecord
+from zoobot.tensorflow.data_utils import create_tfrecord, checks, tfrecord_index
 
 
-def write_image_df_to_tfrecord(df, tfrecord_loc, img_size, columns_to_save, reader):
+def write_image_df_to_tfrecord(df, tfrecord_loc, img_size, columns_to_save, reader, image_format='raw', jpeg_quality=95, compression_type=None, greyscale=False, skip_errors=False, index_loc=None):
     """
     Write a galaxy catalog to TFRecord file.
     For example, the training catalog to the training TFRecord, to then be trained on by a model.
@@ -20,21 +20,48 @@ def write_image_df_to_tfrecord(df, tfrecord_loc, img_size, columns_to_save, read
         img_size (int): image edge length e.g. 256 for 256x256 image. Assumed square.
         columns_to_save (list): columns to save as features in tfrecord. e.g. ['id_str', smooth_votes', 'featured_votes'].
         reader (function): expecting galaxy row (dictlike), returning loaded PIL image for that galaxy
+        image_format (str, optional): 'raw', 'png' or 'jpeg'. See create_tfrecord.serialize_image_example. Defaults to 'raw'.
+        jpeg_quality (int, optional): if image_format='jpeg'. Defaults to 95.
+        compression_type (str, optional): compress whole tfrecord with None, 'GZIP' or 'ZLIB'. Defaults to None.
+        greyscale (bool, optional): if True, save single-channel images (averaged over channels). 3x smaller. Defaults to False.
+        skip_errors (bool, optional): if True, log and skip galaxies whose image fails to load or save (e.g. corrupted file), rather than raising. Defaults to False.
+        index_loc (str, optional): if given, also save the byte offset of each galaxy's record here, for random access. See tfrecord_index. Uncompressed only. Defaults to None.
+
+    Returns:
+        list: id_str of galaxies skipped (if skip_errors), in catalog order
     """
 
+    if index_loc is not None and compression_type is not None:
+        raise ValueError('Cannot index compressed tfrecords ({})'.format(compression_type))
+
     if os.path.exists(tfrecord_loc):
         logging.warning('{} already exists - deleting'.format(tfrecord_loc))
         os.remove(tfrecord_loc)
 
-    writer = tf.io.TFRecordWriter(tfrecord_loc)
+    writer = tf.io.TFRecordWriter(tfrecord_loc, options=tf.io.TFRecordOptions(compression_type=compression_type))
+    skipped = []
+    index_rows = []
+    offset = 0
     # for _, subject in tqdm(df.iterrows(), total=len(df), unit=' subjects saved'):
     for _, subject in df.iterrows():
-        serialized_example = row_to_serialized_example(subject, img_size, columns_to_save, reader)
+        try:
+            serialized_example = row_to_serialized_example(subject, img_size, columns_to_save, reader, image_format=image_format, jpeg_quality=jpeg_quality, greyscale=greyscale)
+        except Exception as e:
+            if not skip_errors:
+                raise
+            logging.warning('Skipping {} ({}): {}'.format(subject['id_str'], subject.get('file_loc'), e))
+            skipped.append(subject['id_str'])
+            continue
         writer.write(serialized_example)
+        index_rows.append({'id_str': subject['id_str'], 'offset': offset, 'length': len(serialized_example)})
+        offset += tfrecord_index.get_record_bytes(serialized_example)
     writer.close()  # good to be explicit - will give 'DataLoss' error if writer not closed
+    if index_loc is not None:
+        tfrecord_index.save_index(pd.DataFrame(index_rows, columns=['id_str', 'offset', 'length']), index_loc)
+    return skipped
 
 
-def row_to_serialized_example(row, img_size, columns_to_save, reader):
+def row_to_serialized_example(row, img_size, columns_to_save, reader, image_format='raw', jpeg_quality=95, greyscale=False):
     """
     Convert a galaxy catalog to serialized binary format, as part of saving to TFRecord
 
@@ -47,6 +74,9 @@ def row_to_serialized_example(row, img_size, columns_to_save, reader):
         img_size (int): image edge length e.g. 256 for 256x256 image. Assumed square.
         columns_to_save (list): columns to save as features in tfrecord. e.g. ['id_str', smooth_votes', 'featured_votes'].
         reader (function): expecting galaxy row (dictlike), returning loaded PIL image for that galaxy
+        image_format (str, optional): 'raw', 'png' or 'jpeg'. See create_tfrecord.serialize_image_example. Defaults to 'raw'.
+        jpeg_quality (int, optional): if image_format='jpeg'. Defaults to 95.
+        greyscale (bool, optional): if True, save single-channel images. See ``to_greyscale``. Defaults to False.
     
     Returns:
         str: binary serialized representation of the galaxy row, including ``columns_to_save`` features.
@@ -55,23 +85,61 @@ def row_to_serialized_example(row, img_size, columns_to_save, reader):
     final_pil_img = pil_img.resize(size=(img_size, img_size), resample=Image.LANCZOS).transpose(
         Image.FLIP_TOP_BOTTOM)
     matrix = np.array(final_pil_img)
+    if greyscale:
+        matrix = to_greyscale(matrix)
 
     extra_data_dict = {}
     for col in columns_to_save:
         extra_data_dict.update({col: row[col]})
 
-    return create_tfrecord.serialize_image_example(matrix, **extra_data_dict)
+    return create_tfrecord.serialize_image_example(matrix, image_format=image_format, jpeg_quality=jpeg_quality, **extra_data_dict)
+
+
+def to_greyscale(matrix):
+    """
+    Average over channels, as preprocess.preprocess_images(make_greyscale=True) would do every batch, but once at write time.
+    Rounds to the nearest uint8, so pixels may differ from averaging on the fly by up to 0.5/255.
+
+    Args:
+        matrix (np.array): uint8 pixel data, shape [height, width, channels] (or [height, width] if already greyscale)
+
+    Returns:
+        np.array: uint8 pixel data, shape [height, width, 1]
+    """
+    if len(matrix.shape) == 2:
+        return matrix[:, :, np.newaxis]
+    return np.round(matrix.mean(axis=2, keepdims=True)).astype(np.uint8)
 
 
-def get_reader(paths):
+def get_reader(paths, check_paths=True, cache_loc=None):
+    """
+    Get the function to load each galaxy image, according to file format, checking all paths use that format.
+    Call once per catalog (e.g. before writing shards), not once per shard.
+
+    Args:
+        paths (list): image paths (e.g. catalog['file_loc'])
+        check_paths (bool, optional): If True, check every path exists (see checks.find_missing_files). Defaults to True.
+        cache_loc (str, optional): json file caching directory listings, to skip re-listing unchanged directories. Defaults to None.
+
+    Raises:
+        ValueError: paths have more than one file format
+        FileNotFoundError: any paths are missing. All missing paths are logged.
+
+    Returns:
+        function: expecting galaxy row (dictlike) with 'file_loc', returning loaded PIL image for that galaxy
+    """
+    paths = list(paths)
     # find file format
     file_format = paths[0].split('.')[-1]
     # check for consistency
     if not all([loc.split('.')[-1] == file_format for loc in paths]):
         raise ValueError('File formats are not all consistent (e.g. [a.png, b.fits]')
-    logging.info('Checking that all file paths resolve correctly')
-    if not all(os.path.isfile(loc) for loc in paths):
-        raise FileNotFoundError('Check file paths: currently prefixed like {}'.format(paths[0]))
+    if check_paths:
+        logging.info('Checking that all file paths resolve correctly')
+        missing_paths = checks.find_missing_files(paths, cache_loc=cache_loc)
+        if missing_paths:
+            logging.error('Missing {} files:\n{}'.format(len(missing_paths), '\n'.join(missing_paths)))
+            raise FileNotFoundError('Missing {} of {} files e.g. {} - see log for all'.format(len(missing_paths), len(paths), missing_paths[:3]))
     if file_format == 'png':
         reader = load_png_as_pil
     elif file_format == 'fits':
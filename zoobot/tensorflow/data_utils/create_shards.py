@@ -9,17 +9,25 @@ For a full working example, see `zoobot/tensorflow/examples/decals_dr5_to_shards
 """
 
 import os
+import re
 import shutil
 import logging
 import json
+import multiprocessing
 from typing import List
 
+import numpy as np
 import pandas as pd
+import tensorflow as tf
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split
 
 
-from zoobot.tensorflow.data_utils import catalog_to_tfrecord, checks
+from zoobot.tensorflow.data_utils import catalog_to_tfrecord, tfrecord_index
+
+
+MANIFEST_FILENAME = 'shard_manifest.csv'
+LABELLED_SPLITS = ['train', 'val', 'test']
 
 
 class ShardConfig():
@@ -39,7 +47,11 @@ class ShardConfig():
         self,
         shard_dir,
         size,
-        shard_size=4096
+        shard_size=4096,
+        image_format='raw',
+        jpeg_quality=95,
+        compression_type=None,
+        greyscale=False
         ):
         """
         Args:
@@ -47,12 +59,22 @@ class ShardConfig():
             size (int, optional): Defaults to 128. Resolution to save png to tfrecord (i.e. width in pixels)
             final_size (int, optional): Defaults to 64. Resolution to load from tfrecord into model
             shard_size (int, optional): Defaults to 4096. Galaxies per shard.
+            image_format (str, optional): Defaults to 'raw'. Save images as 'raw' uint8 bytes, or encoded 'png' (lossless) or 'jpeg' (lossy) bytes.
+            jpeg_quality (int, optional): Defaults to 95. Quality if image_format='jpeg'.
+            compression_type (str, optional): Defaults to None. Compress whole shards with 'GZIP' or 'ZLIB'.
+            greyscale (bool, optional): Defaults to False. Save single-channel (greyscale) images, 3x smaller. Only for training greyscale models.
         """
         self.size = size
         self.shard_size = shard_size
         self.shard_dir = shard_dir
+        # must be passed to tfrecord_datasets.get_tfrecord_dataset when loading
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.compression_type = compression_type
+        self.greyscale = greyscale
 
-        self.channels = 3  # save 3-band image to tfrecord. Augmented later by model input func.
+        # save 3-band image to tfrecord (or 1-band if greyscale). Augmented later by model input func.
+        self.channels = 1 if greyscale else 3
 
         # paths for fixed tfrecords for initial training and (permanent) evaluation
         self.train_dir = os.path.join(self.shard_dir, 'train_shards') 
@@ -65,6 +87,9 @@ class ShardConfig():
 
         self.config_save_loc = os.path.join(self.shard_dir, 'shard_config.json')
 
+        # which galaxy is in which shard, and a hash of what was saved, for update_shards
+        self.manifest_loc = os.path.join(self.shard_dir, MANIFEST_FILENAME)
+
 
     def train_tfrecord_locs(self):
         return [os.path.join(self.train_dir, loc) for loc in os.listdir(self.train_dir)
@@ -81,7 +106,7 @@ class ShardConfig():
             if loc.endswith('.tfrecord')]
 
 
-    def prepare_shards(self, labelled_catalog: pd.DataFrame, unlabelled_catalog: pd.DataFrame, labelled_columns_to_save: List,  val_fraction=0.1, test_fraction=0.2):
+    def prepare_shards(self, labelled_catalog: pd.DataFrame, unlabelled_catalog: pd.DataFrame, labelled_columns_to_save: List,  val_fraction=0.1, test_fraction=0.2, num_workers=None, file_check_cache_loc=None):
         """
         Save the images in labelled_catalog and unlabelled_catalog to tfrecord shards.
 
@@ -102,6 +127,8 @@ class ShardConfig():
             unlabelled_catalog (pd.DataFrame): unlabelled galaxies, including file_loc column
             train_test_fraction (float): fraction of labelled catalog to use as training data
             labelled_columns_to_save list: Save catalog cols to tfrecord, under same name. 
+            num_workers (int, optional): processes used to write shards. Defaults to None, meaning all cpus.
+            file_check_cache_loc (str, optional): json file caching directory listings, to check file paths faster when re-run. See checks.find_missing_files. Defaults to None.
         """
 
         # personal file manipulation, because my catalogs are old. Just make sure file_loc actually points to the files in the first place...
@@ -111,6 +138,12 @@ class ShardConfig():
 
         assert 'id_str' in labelled_columns_to_save
 
+        # check that file paths resolve correctly (all of them, once) before deleting any previous shards
+        logging.info('Example file locs: \n{}'.format(labelled_catalog['file_loc'][:3].values))
+        labelled_reader = catalog_to_tfrecord.get_reader(labelled_catalog['file_loc'], cache_loc=file_check_cache_loc)
+        if unlabelled_catalog is not None:
+            unlabelled_reader = catalog_to_tfrecord.get_reader(unlabelled_catalog['file_loc'], cache_loc=file_check_cache_loc)
+
         if os.path.isdir(self.shard_dir):
             shutil.rmtree(self.shard_dir)  # always fresh
         os.mkdir(self.shard_dir)
@@ -118,12 +151,6 @@ class ShardConfig():
         os.mkdir(self.val_dir)
         os.mkdir(self.test_dir)
 
-        # check that file paths resolve correctly
-        logging.info('Example file locs: \n{}'.format(labelled_catalog['file_loc'][:3].values))
-        checks.check_no_missing_files(labelled_catalog['file_loc'], max_to_check=2000)
-        if unlabelled_catalog is not None:
-            checks.check_no_missing_files(unlabelled_catalog['file_loc'], max_to_check=2000)
-
         logging.info('\nLabelled subjects: {}'.format(len(labelled_catalog)))
         labelled_catalog.to_csv(self.labelled_catalog_loc)
 
@@ -145,34 +172,170 @@ class ShardConfig():
         test_df.to_csv(os.path.join(self.test_dir, 'test_df.csv'))
 
         logging.info('Writing {} train, {} val, and {} test galaxies to shards'.format(len(train_df), len(val_df), len(test_df)))
-        for (df, save_dir) in [(train_df, self.train_dir), (val_df, self.val_dir), (test_df, self.test_dir)]:
-            write_catalog_to_tfrecord_shards(
-                df,
-                img_size=self.size,
-                columns_to_save=labelled_columns_to_save,
-                save_dir=save_dir,
-                shard_size=self.shard_size
-            )
+        manifests = []
+        for (df, split) in [(train_df, 'train'), (val_df, 'val'), (test_df, 'test')]:
+            manifests.append(self.write_split_shards(df, split, labelled_columns_to_save, labelled_reader, num_workers=num_workers))
 
         if unlabelled_catalog is not None:
             logging.info('Writing {} unlabelled galaxies to shards (optional)'.format(len(unlabelled_catalog)))
             columns_to_save = ['id_str']
-            write_catalog_to_tfrecord_shards(
-                unlabelled_catalog,
-                self.size,
-                columns_to_save,
-                self.shard_dir,
-                self.shard_size
-            )
+            manifests.append(self.write_split_shards(unlabelled_catalog, 'unlabelled', columns_to_save, unlabelled_reader, num_workers=num_workers))
         else:
             self.unlabelled_catalog_loc = ''  # record that no unlabelled catalog was used 
 
+        save_shard_manifest(pd.concat(manifests), self.manifest_loc)
+
         assert self.ready()
 
         # serialized for later/logs
         self.write()
 
 
+    def update_shards(self, labelled_catalog: pd.DataFrame, unlabelled_catalog: pd.DataFrame, labelled_columns_to_save: List, val_fraction=0.1, test_fraction=0.2, num_workers=None, file_check_cache_loc=None):
+        """
+        Update shards previously made by prepare_shards (or update_shards) to match new catalogs, rewriting as little as possible.
+
+        Compares the catalogs with the shard manifest (id_str -> shard, and a hash of the saved columns and file_loc):
+        - new galaxies are written to new shards. New labelled galaxies are assigned to train/val/test by hashing their id_str (see assign_splits).
+        - changed galaxies (e.g. new votes) are written to new shards, keeping their previous train/val/test split.
+        - removed or changed galaxies are retired: removed from their previous shard (see remove_from_tfrecord), without reloading any images.
+
+        Galaxies already in the shards keep their train/val/test split. Galaxies newly labelled move from the unlabelled shards to the labelled shards.
+        If there is no manifest yet, runs prepare_shards instead.
+
+        The manifest is only saved once all shards are written and retired. If an update is interrupted, re-run it:
+        shards not in the manifest (i.e. written by the interrupted update) are deleted first, and the update repeated.
+
+        Args:
+            labelled_catalog (pd.DataFrame): all labelled galaxies (not just new ones), including file_loc column
+            unlabelled_catalog (pd.DataFrame): all unlabelled galaxies, including file_loc column. None if no unlabelled galaxies.
+            labelled_columns_to_save (list): Save catalog cols to tfrecord, under same name. Should match previous shards.
+            val_fraction (float, optional): fraction of new labelled galaxies to use for validation. Defaults to 0.1.
+            test_fraction (float, optional): fraction of new labelled galaxies to use for testing. Defaults to 0.2.
+            num_workers (int, optional): processes used to write shards. Defaults to None, meaning all cpus.
+            file_check_cache_loc (str, optional): json file caching directory listings. See checks.find_missing_files. Defaults to None.
+        """
+        if not os.path.isfile(self.manifest_loc):
+            logging.warning('No shard manifest at {} - preparing all shards from scratch'.format(self.manifest_loc))
+            return self.prepare_shards(labelled_catalog, unlabelled_catalog, labelled_columns_to_save, val_fraction=val_fraction, test_fraction=test_fraction, num_workers=num_workers, file_check_cache_loc=file_check_cache_loc)
+        self.check_matches_saved_config()
+        assert 'id_str' in labelled_columns_to_save
+
+        manifest = load_shard_manifest(self.manifest_loc)
+        self.remove_unlisted_shards(manifest)
+        catalogs = [
+            (labelled_catalog, labelled_columns_to_save, LABELLED_SPLITS),
+            (unlabelled_catalog if unlabelled_catalog is not None else pd.DataFrame(columns=['id_str', 'file_loc']), ['id_str'], ['unlabelled'])
+        ]
+        stale = []
+        new_manifests = []
+        for catalog, columns_to_save, splits in catalogs:
+            assert not catalog['id_str'].duplicated().any()
+            previous = manifest[manifest['split'].isin(splits)]
+            catalog_hashes = pd.Series(get_row_hashes(catalog, columns_to_save).values, index=catalog['id_str'].values)
+            is_stale = previous['id_str'].map(catalog_hashes) != previous['row_hash']  # NaN (removed) != anything
+            stale.append(previous[is_stale])
+
+            to_write = catalog[~catalog['id_str'].isin(previous[~is_stale]['id_str'])].copy()
+            if to_write.empty:
+                continue
+            # changed galaxies keep their split
+            previous_splits = pd.Series(previous['split'].values, index=previous['id_str'].values)
+            to_write['split'] = to_write['id_str'].map(previous_splits)
+            is_new = to_write['split'].isna()
+            if splits == LABELLED_SPLITS:
+                to_write.loc[is_new, 'split'] = assign_splits(to_write.loc[is_new, 'id_str'], val_fraction, test_fraction)
+            else:
+                to_write.loc[is_new, 'split'] = 'unlabelled'
+            logging.info('Writing {} new and {} changed galaxies to {} shards'.format(is_new.sum(), (~is_new).sum(), '/'.join(splits)))
+
+            reader = catalog_to_tfrecord.get_reader(to_write['file_loc'], cache_loc=file_check_cache_loc)
+            for split, df in to_write.groupby('split'):
+                new_manifests.append(self.write_split_shards(
+                    df.drop(columns='split'), split, columns_to_save, reader, num_workers=num_workers,
+                    first_shard_n=get_next_shard_n(self.get_split_dir(split), self.size)
+                ))
+
+        stale = pd.concat(stale)
+        logging.info('Retiring {} removed or changed galaxies from {} shards'.format(len(stale), stale.groupby(['split', 'shard']).ngroups))
+        for (split, shard), stale_in_shard in stale.groupby(['split', 'shard']):
+            tfrecord_loc = os.path.join(self.get_split_dir(split), shard)
+            if os.path.isfile(tfrecord_loc):  # else already emptied and deleted by an interrupted update
+                remove_from_tfrecord(tfrecord_loc, stale_in_shard['id_str'], compression_type=self.compression_type)
+
+        # stale galaxies removed first, in case changed galaxies were rewritten
+        manifest = pd.concat([manifest.drop(stale.index)] + new_manifests)
+        save_shard_manifest(manifest, self.manifest_loc)
+
+        labelled_catalog.to_csv(self.labelled_catalog_loc)
+        for split in LABELLED_SPLITS:
+            split_ids = manifest[manifest['split'] == split]['id_str']
+            labelled_catalog[labelled_catalog['id_str'].isin(split_ids)].to_csv(os.path.join(self.get_split_dir(split), '{}_df.csv'.format(split)))
+        if unlabelled_catalog is not None:
+            unlabelled_catalog.to_csv(self.unlabelled_catalog_loc)
+        else:
+            self.unlabelled_catalog_loc = ''
+
+        assert self.ready()
+        self.write()
+
+
+    def remove_unlisted_shards(self, manifest):
+        # delete shards written by an interrupted update (before the manifest was saved), so their galaxies are not duplicated
+        for split in LABELLED_SPLITS + ['unlabelled']:
+            split_dir = self.get_split_dir(split)
+            listed = set(manifest[manifest['split'] == split]['shard'])
+            for loc in os.listdir(split_dir):
+                if loc.endswith('.tfrecord') and loc not in listed:
+                    logging.warning('Removing shard {} in {} - not in manifest, likely from an interrupted update'.format(loc, split_dir))
+                    tfrecord_loc = os.path.join(split_dir, loc)
+                    os.remove(tfrecord_loc)
+                    if os.path.isfile(tfrecord_index.get_index_loc(tfrecord_loc)):
+                        os.remove(tfrecord_index.get_index_loc(tfrecord_loc))
+
+
+    def write_split_shards(self, df, split, columns_to_save, reader, num_workers=None, first_shard_n=0):
+        """
+        Write df to shards in the directory for split, according to this config.
+
+        Returns:
+            pd.DataFrame: manifest rows for the galaxies written, with columns id_str, split, shard and row_hash
+        """
+        written = write_catalog_to_tfrecord_shards(
+            df,
+            img_size=self.size,
+            columns_to_save=columns_to_save,
+            save_dir=self.get_split_dir(split),
+            shard_size=self.shard_size,
+            image_format=self.image_format,
+            jpeg_quality=self.jpeg_quality,
+            compression_type=self.compression_type,
+            greyscale=self.greyscale,
+            num_workers=num_workers,
+            reader=reader,
+            first_shard_n=first_shard_n
+        )
+        written['split'] = split
+        row_hashes = pd.Series(get_row_hashes(df, columns_to_save).values, index=df['id_str'].values)
+        written['row_hash'] = written['id_str'].map(row_hashes)
+        return written
+
+
+    def get_split_dir(self, split):
+        if split == 'unlabelled':
+            return self.shard_dir
+        return {'train': self.train_dir, 'val': self.val_dir, 'test': self.test_dir}[split]
+
+
+    def check_matches_saved_config(self):
+        # shards written with different settings could not be read together
+        with open(self.config_save_loc, 'r') as f:
+            saved_config = json.load(f)
+        for key in ['size', 'image_format', 'compression_type', 'greyscale']:
+            if saved_config.get(key, getattr(self, key)) != getattr(self, key):
+                raise ValueError('{} is {} but existing shards in {} have {}'.format(key, getattr(self, key), self.shard_dir, saved_config[key]))
+
+
     def ready(self):
         assert os.path.isdir(self.shard_dir)
         assert os.path.isdir(self.train_dir)
@@ -190,6 +353,10 @@ class ShardConfig():
             'size': self.size,
             'shard_size': self.shard_size,
             'shard_dir': self.shard_dir,
+            'image_format': self.image_format,
+            'jpeg_quality': self.jpeg_quality,
+            'compression_type': self.compression_type,
+            'greyscale': self.greyscale,
             'channels': self.channels,
             'train_dir': self.train_dir,
             'val_dir': self.val_dir,
@@ -239,10 +406,16 @@ def get_train_test_fraction(total_size, eval_size):
     return train_test_fraction
 
 
-def write_catalog_to_tfrecord_shards(df: pd.DataFrame, img_size, columns_to_save, save_dir, shard_size=1000):
+def write_catalog_to_tfrecord_shards(df: pd.DataFrame, img_size, columns_to_save, save_dir, shard_size=1000, image_format='raw', jpeg_quality=95, compression_type=None, greyscale=False, seed=42, num_workers=None, reader=None, first_shard_n=0):
     """Write galaxy catalog of id_str and file_loc across many tfrecords, and record in db.
     Useful to quickly load images for repeated predictions.
 
+    Shards are written in parallel, one shard per process at a time (as in zoobot.pytorch.data_utils.npy_shards).
+    Shard names and contents depend only on ``df`` and ``seed``, not on how many processes are used.
+    Galaxies whose image fails to load or save are skipped (and logged), rather than stopping the whole run.
+    Each shard is written to a temporary file first, so an interrupted or failed run never leaves a partial shard.
+    Uncompressed shards are written with an index of where each galaxy is in the shard, for random access (see tfrecord_index).
+
     Args:
         df (pd.DataFrame): Galaxy catalog with 'id_str' and 'fits_loc' fields
         db (sqlite3.Connection): database with `catalog` table to record df id_col and fits_loc
@@ -250,26 +423,175 @@ def write_catalog_to_tfrecord_shards(df: pd.DataFrame, img_size, columns_to_save
         columns_to_save (list): Catalog data to save with each subject. Names will match tfrecord.
         save_dir (str): disk directory path into which to save tfrecords
         shard_size (int, optional): Defaults to 1000. Max subjects per shard. Final shard has less.
+        image_format (str, optional): Defaults to 'raw'. See create_tfrecord.serialize_image_example.
+        jpeg_quality (int, optional): Defaults to 95. Quality if image_format='jpeg'.
+        compression_type (str, optional): Defaults to None. Compress whole shards with 'GZIP' or 'ZLIB'.
+        greyscale (bool, optional): Defaults to False. Save single-channel images.
+        seed (int, optional): Defaults to 42. Random seed for shuffling galaxies between shards.
+        num_workers (int, optional): Defaults to None, meaning all cpus. Processes used to write shards.
+        reader (function, optional): Defaults to None, meaning resolve (and check paths) with catalog_to_tfrecord.get_reader. Pass if already resolved.
+        first_shard_n (int, optional): Defaults to 0. Number of the first shard, to add shards alongside existing ones.
+
+    Raises:
+        IOError: any whole shard failed to write (e.g. out of disk space), after the other shards finish
+
+    Returns:
+        pd.DataFrame: with columns id_str and shard (tfrecord filename) for each galaxy written. Skipped galaxies are not included.
     """
     assert not df.empty
     assert 'id_str' in columns_to_save
     if not all(column in df.columns.values for column in columns_to_save):
         raise IndexError('Columns not found in df: {}'.format(set(columns_to_save) - set(df.columns.values)))
 
-    df = df.copy().sample(frac=1).reset_index(drop=True)  # shuffle - note that this means acquired subjects will be in random order
+    df = df.copy().sample(frac=1, random_state=seed).reset_index(drop=True)  # shuffle - note that this means acquired subjects will be in random order
     # split into shards
-    shard_n = 0
-    n_shards = (len(df) // shard_size) + 1
+    n_shards = int(np.ceil(len(df) / shard_size))
     df_shards = [df.iloc[n * shard_size:(n + 1) * shard_size] for n in range(n_shards)]
 
-    logging.info(f'Writing shards to {save_dir}')
-    for shard_n, df_shard in tqdm(enumerate(df_shards), total=len(df_shards), unit='shards'):
-        save_loc = os.path.join(save_dir, 's{}_shard_{}.tfrecord'.format(img_size, shard_n))
-        catalog_to_tfrecord.write_image_df_to_tfrecord(
-            df_shard, 
-            save_loc,
-            img_size,
-            columns_to_save,
-            reader=catalog_to_tfrecord.get_reader(df['file_loc'])
-        )
+    if reader is None:
+        reader = catalog_to_tfrecord.get_reader(df['file_loc'])
+    write_kwargs = {
+        'img_size': img_size,
+        'columns_to_save': columns_to_save,
+        'reader': reader,
+        'image_format': image_format,
+        'jpeg_quality': jpeg_quality,
+        'compression_type': compression_type,
+        'greyscale': greyscale
+    }
+    tasks = [
+        (df_shard, os.path.join(save_dir, 's{}_shard_{}.tfrecord'.format(img_size, shard_n)), write_kwargs)
+        for shard_n, df_shard in enumerate(df_shards, start=first_shard_n)
+    ]
+
+    if num_workers is None:
+        num_workers = os.cpu_count()
+
+    logging.info(f'Writing {len(df)} galaxies to {n_shards} shards in {save_dir}')
+    skipped = []
+    failed = {}
+    # spawn, not fork - tensorflow is not fork-safe once initialised
+    with multiprocessing.get_context('spawn').Pool(min(num_workers, n_shards)) as pool, tqdm(total=len(df), unit=' galaxies') as progress_bar:
+        for save_loc, n_galaxies, shard_skipped, error in pool.imap_unordered(_write_shard, tasks):
+            skipped += shard_skipped
+            if error is not None:
+                failed[save_loc] = error
+            progress_bar.update(n_galaxies)  # across all workers
+
+    if failed:
+        # unlike a bad image, a lost shard means the caller should not go on to record these galaxies as written
+        raise IOError('Failed to write {} of {} shards in {}: {}'.format(len(failed), n_shards, save_dir, failed))
+    if skipped:
+        logging.warning('Skipped {} of {} galaxies in {}: {}'.format(len(skipped), len(df), save_dir, skipped))
+    written = pd.concat([
+        pd.DataFrame({'id_str': df_shard['id_str'].values, 'shard': os.path.basename(save_loc)})
+        for df_shard, save_loc, _ in tasks
+    ])
+    return written[~written['id_str'].isin(skipped)].reset_index(drop=True)
+
+
+def get_row_hashes(df, columns_to_save):
+    """
+    Hash the saved columns (and file_loc) of each galaxy, to tell if a galaxy has changed since being saved.
+
+    Args:
+        df (pd.DataFrame): galaxy catalog
+        columns_to_save (list): columns saved to tfrecord
+
+    Returns:
+        pd.Series: hex string hash for each row of df
+    """
+    columns = sorted(set(columns_to_save) | {'file_loc'})
+    # as strings, so hashes don't depend on dtype inference when loading catalogs
+    return pd.util.hash_pandas_object(df[columns].astype(str), index=False).map('{:016x}'.format)
+
+
+def assign_splits(id_strs, val_fraction=0.1, test_fraction=0.2):
+    """
+    Assign each galaxy to 'train', 'val' or 'test', by hashing its id_str.
+    The split for each galaxy never depends on which other galaxies are assigned at the same time.
+
+    Args:
+        id_strs (pd.Series): galaxy identifiers
+        val_fraction (float, optional): Defaults to 0.1.
+        test_fraction (float, optional): Defaults to 0.2.
+
+    Returns:
+        np.array: split for each galaxy
+    """
+    uniform = pd.util.hash_pandas_object(pd.Series(id_strs, dtype=str), index=False).values / 2. ** 64
+    return np.where(uniform < val_fraction, 'val', np.where(uniform < val_fraction + test_fraction, 'test', 'train'))
 
+
+def get_next_shard_n(save_dir, img_size):
+    # first shard number not yet used in save_dir
+    shard_ns = [int(match.group(1)) for match in (re.fullmatch(r's{}_shard_(\d+)\.tfrecord'.format(img_size), loc) for loc in os.listdir(save_dir)) if match]
+    return max(shard_ns, default=-1) + 1
+
+
+def remove_from_tfrecord(tfrecord_loc, id_strs, compression_type=None):
+    """
+    Rewrite a tfrecord without the galaxies in id_strs, copying the other (serialized) galaxies as they are - no images are reloaded.
+    If uncompressed, the index is rewritten too (see tfrecord_index). If no galaxies are left, the tfrecord (and index) is deleted.
+
+    Args:
+        tfrecord_loc (str): tfrecord to rewrite
+        id_strs (list): galaxies to remove
+        compression_type (str, optional): as written. Defaults to None.
+
+    Returns:
+        int: galaxies left in tfrecord
+    """
+    id_strs = set(id_strs)
+    index_rows = []
+    offset = 0
+    options = tf.io.TFRecordOptions(compression_type=compression_type)
+    with tf.io.TFRecordWriter(tfrecord_loc + '.tmp', options=options) as writer:
+        for serialized_example in tf.data.TFRecordDataset(tfrecord_loc, compression_type=compression_type).as_numpy_iterator():
+            id_str = tfrecord_index.get_id_str(serialized_example)
+            if id_str not in id_strs:
+                writer.write(serialized_example)
+                index_rows.append({'id_str': id_str, 'offset': offset, 'length': len(serialized_example)})
+                offset += tfrecord_index.get_record_bytes(serialized_example)
+    index_loc = tfrecord_index.get_index_loc(tfrecord_loc)
+    if index_rows:
+        if compression_type is None:
+            tfrecord_index.save_index(pd.DataFrame(index_rows), index_loc + '.tmp')
+            os.replace(index_loc + '.tmp', index_loc)
+        os.replace(tfrecord_loc + '.tmp', tfrecord_loc)
+    else:
+        os.remove(tfrecord_loc + '.tmp')
+        os.remove(tfrecord_loc)
+        if os.path.isfile(index_loc):
+            os.remove(index_loc)
+    return len(index_rows)
+
+
+def load_shard_manifest(manifest_loc):
+    return pd.read_csv(manifest_loc, dtype={'id_str': str, 'row_hash': str})
+
+
+def save_shard_manifest(manifest, manifest_loc):
+    # write then rename, so an interrupted update never leaves a partial manifest
+    manifest.to_csv(manifest_loc + '.tmp', index=False)
+    os.replace(manifest_loc + '.tmp', manifest_loc)
+
+
+def _write_shard(args):
+    df_shard, save_loc, write_kwargs = args
+    # compressed shards can't be indexed
+    index_loc = tfrecord_index.get_index_loc(save_loc) if write_kwargs['compression_type'] is None else None
+    try:
+        skipped = catalog_to_tfrecord.write_image_df_to_tfrecord(
+            df_shard, save_loc + '.tmp', skip_errors=True, index_loc=index_loc and index_loc + '.tmp', **write_kwargs)
+        if index_loc is not None:
+            os.replace(index_loc + '.tmp', index_loc)
+        os.replace(save_loc + '.tmp', save_loc)
+    except Exception as e:
+        # e.g. out of disk space. Report back rather than raise, so the other workers' shards still finish cleanly.
+        logging.error('Failed to write shard {}: {}'.format(save_loc, e))
+        for tmp_loc in [save_loc + '.tmp', index_loc and index_loc + '.tmp']:
+            if tmp_loc is not None and os.path.isfile(tmp_loc):
+                os.remove(tmp_loc)
+        return save_loc, len(df_shard), [], repr(e)
+    return save_loc, len(df_shard), skipped, None
@@ -1,21 +1,28 @@
+import io
 
 from tqdm import tqdm
 import numpy as np
 import tensorflow as tf
+from PIL import Image
 
 
-def serialize_image_example(matrix, **extra_kwargs):
+def serialize_image_example(matrix, image_format='raw', jpeg_quality=95, **extra_kwargs):
     """
     Save an image, label and any additional data to serialized byte string
 
     Args:
         matrix (np.array): pixel data. Floats in shape [height, width, depth]
+        image_format (str, optional): 'raw' to save flat uint8 bytes, or 'png'/'jpeg' to save encoded (smaller) bytes. Load with the same image_format. Defaults to 'raw'.
+        jpeg_quality (int, optional): quality (1-95) if image_format='jpeg'. Lossy! Defaults to 95.
         **extra_kwargs (dict): any further keyword args will be saved as named in the tfrecord
 
     Returns:
         None
     """
-    matrix_feature = uint8_array_to_feature(matrix)
+    if image_format == 'raw':
+        matrix_feature = uint8_array_to_feature(matrix)
+    else:
+        matrix_feature = encoded_image_to_feature(matrix, image_format, jpeg_quality)
 
     # Expects TensorFlow data format convention, "Height-Width-Depth".
     if matrix.shape[1] > matrix.shape[0]:
@@ -47,7 +54,8 @@ def serialize_image_example(matrix, **extra_kwargs):
             # Features contains a map of string to Feature proto objects
             feature=features_to_save))
     # use the proto object to serialize the example to a string
-    return example.SerializeToString()
+    # deterministic: same bytes for the same example, in any process (features are a map, otherwise in arbitrary order)
+    return example.SerializeToString(deterministic=True)
 
 
 def value_to_feature(value):
@@ -105,3 +113,33 @@ def uint8_array_to_feature(matrix_to_save):
     return tf.train.Feature(
         bytes_list=tf.train.BytesList(value=[bytes_to_save])
     )
+
+
+def encoded_image_to_feature(matrix_to_save, image_format, jpeg_quality=95):
+    """Like uint8_array_to_feature, but png- or jpeg-encoded. Decoded by tfrecord_datasets.decode_matrix"""
+    return tf.train.Feature(
+        bytes_list=tf.train.BytesList(value=[encode_image(matrix_to_save, image_format, jpeg_quality)])
+    )
+
+
+def encode_image(matrix, image_format, jpeg_quality=95):
+    """
+    Args:
+        matrix (np.array): uint8 pixel data, shape [height, width] or [height, width, depth]
+        image_format (str): 'png' (lossless) or 'jpeg' (lossy)
+        jpeg_quality (int, optional): quality (1-95) if image_format='jpeg'. Defaults to 95.
+
+    Returns:
+        bytes: encoded image
+    """
+    if len(matrix.shape) == 3 and matrix.shape[2] == 1:
+        matrix = matrix[:, :, 0]  # PIL expects greyscale images without a channel dimension
+    buffer = io.BytesIO()
+    image = Image.fromarray(matrix.astype(np.uint8))
+    if image_format == 'png':
+        image.save(buffer, format='png')
+    elif image_format == 'jpeg':
+        image.save(buffer, format='jpeg', quality=jpeg_quality)
+    else:
+        raise ValueError('image_format {} not recognised - expected raw, png or jpeg'.format(image_format))
+    return buffer.getvalue()
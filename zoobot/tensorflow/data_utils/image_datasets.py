@@ -3,22 +3,28 @@ import logging
 
 import pandas as pd
 import tensorflow as tf
+from PIL import Image
+
+from zoobot.tensorflow.data_utils import checks
 
 
 # https://stackoverflow.com/questions/62544528/tensorflow-decodejpeg-expected-image-jpeg-png-or-gif-got-unknown-format-st?rq=1
-def load_image_file(loc, mode='png'):
+def load_image_file(loc, mode='png', resize_size=None, resize_method='lanczos3', keep_uint8=False):
     """
     Load an image file from disk to memory.
 
     Args:
         loc (str): Path to image on disk. Includes format e.g. .png.
         mode (str, optional): Image format. Defaults to 'png'.
+        resize_size (int, optional): If not None, resize to this size (see resize_image). Defaults to None.
+        resize_method (str, optional): 'lanczos3' or 'area'. See resize_image. Defaults to 'lanczos3'.
+        keep_uint8 (bool, optional): If True, return uint8 images rather than float32 (still 0-255). Defaults to False.
 
     Raises:
         ValueError: mode is neither png nor jpeg.
 
     Returns:
-        dict: like {'matrix': float32 np.ndarray from 0. to 255., 'id_str': ``loc``}
+        dict: like {'matrix': float32 np.ndarray from 0. to 255. (or uint8 if keep_uint8), 'id_str': ``loc``}
     """
     # values will be 0-255, does not normalise. Happens in preprocessing instead.
     # specify mode explicitly to avoid graph tracing issues
@@ -31,11 +37,49 @@ def load_image_file(loc, mode='png'):
     else:
         raise ValueError(f'Image filetype mode {mode} not recognised')
 
-    converted_image = tf.cast(image, tf.float32)
+    if resize_size:
+        image = resize_image(image, resize_size, method=resize_method)
+        if keep_uint8:
+            image = tf.cast(tf.round(image), tf.uint8)
+
+    if keep_uint8:
+        converted_image = image
+    else:
+        converted_image = tf.cast(image, tf.float32)
 
     return {'matrix': converted_image, 'id_str': loc}  # using the file paths as identifiers
 
 
+def resize_image(image, size, method='lanczos3'):
+    """
+    Resize one image (HWC, 0-255) to size x size.
+
+    'lanczos3' (with antialiasing) matches the previous batch resizing (see prepare_image_batch) but is slow - about as slow as decoding a png.
+    'area' averages the input pixels under each output pixel, which for integer factors (e.g. 424 -> 212) is exactly box downsampling.
+    On 424px DECaLS pngs, 'area' roughly doubles get_image_dataset throughput and differs from 'lanczos3' by ~1.2 (of 255) on average,
+    up to ~30 at sharp edges like stars. See benchmarks/tensorflow/benchmark_resize.py.
+
+    Args:
+        image (tf.Tensor): of shape (height, width, channels), values 0-255, any dtype
+        size (int): output size
+        method (str, optional): 'lanczos3' or 'area'. Defaults to 'lanczos3'.
+
+    Raises:
+        ValueError: method is neither lanczos3 nor area
+
+    Returns:
+        tf.Tensor: float32 image of shape (size, size, channels), values 0-255
+    """
+    image = tf.cast(image, tf.float32)
+    if method == 'lanczos3':
+        image = tf.image.resize(image, (size, size), method=tf.image.ResizeMethod.LANCZOS3, antialias=True)
+        return tf.clip_by_value(image, 0., 255.)  # resizing can cause slight change in min/max
+    elif method == 'area':
+        return tf.image.resize(image, (size, size), method=tf.image.ResizeMethod.AREA)  # averages, so stays within 0-255
+    else:
+        raise ValueError(f'Resize method {method} not recognised')
+
+
 def resize_image_batch_with_tf(batch, size):
     # May cause values outside 0-255 margins
     # May be slow. Ideally, resize the images beforehand on disk (or save as TFRecord, see make_shards.py and tfrecord_datasets.py)
@@ -50,17 +94,23 @@ def prepare_image_batch(batch, resize_size=None):
     return {'matrix': images, 'id_str': id_strs}  # pack back into dict
 
 
-def get_image_dataset(image_paths, file_format, requested_img_size, batch_size, labels=None, check_valid_paths=True):
+def get_image_dataset(image_paths, file_format, requested_img_size, batch_size, labels=None, check_valid_paths=True, num_parallel_calls=tf.data.AUTOTUNE, resize_method='lanczos3', keep_uint8=False):
     """
     Load images in a folder as a tf.data dataset
     Supports jpeg (note the e) and png
 
+    Images are decoded (and resized, if needed) in parallel (num_parallel_calls), keeping the order of image_paths.
+
     Args:
         image_paths (list): list of image paths to load
         file_format (str): image format e.g. png, jpeg
         requested_img_size (int): e.g. 256 for 256x256x3 image. Assumed square. Will resize if size on disk != this.
         batch_size (int): batch size to use when grouping images into batches
         labels (list or None): If not None, include labels in dataset (see Returns). Must be equal length to image_paths. Defaults to None.
+        check_valid_paths (bool, optional): If True, check every path exists before loading (see check_paths_exist). Defaults to True.
+        num_parallel_calls (int, optional): images to decode in parallel. Defaults to tf.data.AUTOTUNE.
+        resize_method (str, optional): 'lanczos3' (slow, as before) or 'area' (fast). See resize_image. Defaults to 'lanczos3'.
+        keep_uint8 (bool, optional): If True, yield uint8 images (4x smaller), to be cast to float later e.g. by preprocess.preprocess_dataset. Defaults to False.
 
     Raises:
         FileNotFoundError: at least one path does not match an existing file
@@ -75,7 +125,7 @@ def get_image_dataset(image_paths, file_format, requested_img_size, batch_size,
 
     if check_valid_paths:
         logging.info('Checking if all paths are valid')
-        missing_paths = [path for path in image_paths if not os.path.isfile(path)]
+        missing_paths = check_paths_exist(image_paths)
         if missing_paths:
             raise FileNotFoundError(f'Missing {len(missing_paths)} images e.g. {missing_paths[0]}')
         logging.info('All paths exist')
@@ -85,16 +135,23 @@ def get_image_dataset(image_paths, file_format, requested_img_size, batch_size,
     # will load full dataset into memory, possibly?
     path_ds = tf.data.Dataset.from_tensor_slices([str(path) for path in image_paths])
 
-    image_ds = path_ds.map(lambda x: load_image_file(x, mode=file_format))
-    image_ds = image_ds.batch(batch_size, drop_remainder=False)
     # check if the image shape matches requested_img_size, and resize if not
-    test_images = [batch for batch in image_ds.take(1)][0]['matrix']
-    size_on_disk = test_images.numpy().shape[1]  # x dimension (BXYC convention)
+    size_on_disk = get_image_size_on_disk(image_paths[0])
     if size_on_disk == requested_img_size:
         logging.info('Image size on disk matches requested_img_size of {}, skipping resizing'.format(requested_img_size))  # x dimension of first image, first y index, first channel
+        resize_size = None
     else:
-        logging.warning('Resizing images from disk size {} to requested size {}'.format(size_on_disk, requested_img_size))
-        image_ds = image_ds.map(lambda x: prepare_image_batch(x, resize_size=requested_img_size))
+        logging.warning('Resizing images from disk size {} to requested size {} ({})'.format(size_on_disk, requested_img_size, resize_method))
+        resize_size = requested_img_size
+
+    # resize each image as it is decoded, in parallel, rather than whole batches afterwards
+    # deterministic, so batches keep the order of image_paths (and so of labels)
+    image_ds = path_ds.map(
+        lambda x: load_image_file(x, mode=file_format, resize_size=resize_size, resize_method=resize_method, keep_uint8=keep_uint8),
+        num_parallel_calls=num_parallel_calls,
+        deterministic=True
+    )
+    image_ds = image_ds.batch(batch_size, drop_remainder=False)
 
     if labels is not None:
         assert len(labels) == len(image_paths)
@@ -109,8 +166,6 @@ def get_image_dataset(image_paths, file_format, requested_img_size, batch_size,
 
         label_ds = label_ds.batch(batch_size, drop_remainder=False)
 
-        print(list(label_ds.take(1)))  
-
         # label_dict is {'label': (256)} or {'feat_a': (256), 'feat_b': (256)}
         # image_dict is {'id_str': some_id 'matrix': (image)}
         # merge the two dicts to create {'id_str': ..., 'matrix': ..., 'feat_a': ..., 'feat_b': ...}
@@ -120,3 +175,30 @@ def get_image_dataset(image_paths, file_format, requested_img_size, batch_size,
     image_ds = image_ds.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
 
     return image_ds
+
+
+def check_paths_exist(image_paths):
+    """
+    Find any paths which do not exist, by listing each directory once rather than checking every path.
+    Much faster for many images in a few directories, especially on network filesystems.
+    See checks.find_missing_files.
+
+    Args:
+        image_paths (list): paths to check
+
+    Returns:
+        list: paths not found, in the order given
+    """
+    return checks.find_missing_files(image_paths)
+
+
+def get_image_size_on_disk(path):
+    """
+    Args:
+        path (str): image path
+
+    Returns:
+        int: image height in pixels, read from the file header (without decoding the image)
+    """
+    with Image.open(path) as image:
+        return image.size[1]  # PIL size is (width, height)
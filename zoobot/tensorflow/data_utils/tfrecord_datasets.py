@@ -9,7 +9,7 @@ import tensorflow as tf
 
 
 
-def get_tfrecord_dataset(tfrecord_locs, label_cols, batch_size, shuffle, drop_remainder=False):
+def get_tfrecord_dataset(tfrecord_locs, label_cols, batch_size, shuffle, drop_remainder=False, keep_uint8=False, image_format='raw', compression_type=None):
     """
     Use feature_spec to load data from tfrecord_locs, and optionally shuffle/batch according to args.
     Does NOT apply any preprocessing.
@@ -24,24 +24,51 @@ def get_tfrecord_dataset(tfrecord_locs, label_cols, batch_size, shuffle, drop_re
         batch_size (int): batch size
         shuffle (bool): if True, shuffle the dataset
         drop_remainder (bool): if True, drop any galaxies that don't fit exactly into a batch e.g. galaxy 9 of a list of 9 galaxies with batch size 8. Default False.
-    
+        keep_uint8 (bool): if True, yield 'matrix' as 0-255 uint8 (4x smaller) rather than 0-1 float32, to be normalised by the model. See preprocess.PreprocessingConfig. Default False.
+        image_format (str): how 'matrix' was saved: 'raw', 'png' or 'jpeg'. See create_tfrecord.serialize_image_example. Default 'raw'.
+        compression_type (str): compression used when writing the tfrecords: None, 'GZIP' or 'ZLIB'. Default None.
 
     Returns:
         tf.data.Dataset: yielding batches of {'matrix': , 'id_str': , label_cols[0]: , label_cols[1], ...}, optionally shuffled and cut.
     """
-    feature_spec = get_feature_spec(label_cols)
+    dataset = load_serialized_tfrecords(tfrecord_locs, shuffle=shuffle, compression_type=compression_type)
+    return parse_serialized_dataset(dataset, label_cols, batch_size, drop_remainder=drop_remainder, keep_uint8=keep_uint8, image_format=image_format)
+
+
+def parse_serialized_dataset(dataset, label_cols, batch_size, drop_remainder=False, keep_uint8=False, image_format='raw'):
+    """
+    Batch and parse a dataset of serialized examples, as for get_tfrecord_dataset.
+
+    Args:
+        dataset (tf.data.Dataset): yielding serialized examples (scalar strings) e.g. from load_serialized_tfrecords
+        label_cols (list): of features encoded in tfrecord. See get_tfrecord_dataset.
+        batch_size (int): batch size
+        drop_remainder (bool, optional): if True, drop any galaxies that don't fit exactly into a batch. Defaults to False.
+        keep_uint8 (bool, optional): if True, yield 'matrix' as 0-255 uint8 rather than 0-1 float32. Defaults to False.
+        image_format (str, optional): how 'matrix' was saved: 'raw', 'png' or 'jpeg'. Defaults to 'raw'.
 
+    Returns:
+        tf.data.Dataset: yielding batches of {'matrix': , 'id_str': , label_cols[0]: , label_cols[1], ...}
+    """
+    feature_spec = get_feature_spec(label_cols)
 
-    dataset = load_tfrecords(tfrecord_locs, feature_spec, shuffle=shuffle)
+    # parse whole batches of examples with one op per feature (rather than one op per feature per example)
+    # except the images, which are decoded per example (see parse_matrix_function)
+    dataset = dataset.map(partial(parse_matrix_function, keep_uint8=keep_uint8, image_format=image_format), num_parallel_calls=tf.data.experimental.AUTOTUNE, deterministic=True)
     dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    dataset = dataset.map(
+        partial(general_batch_parsing_function, features=feature_spec),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        deterministic=True
+    )
     dataset = dataset.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)  # ensure that a batch is always ready to go
     return dataset
 
 
-def load_tfrecords(tfrecord_locs, feature_spec, num_parallel_calls=tf.data.experimental.AUTOTUNE, shuffle=False):
+def load_tfrecords(tfrecord_locs, feature_spec, num_parallel_calls=tf.data.experimental.AUTOTUNE, shuffle=False, image_format='raw', compression_type=None):
     """
-    Load tfrecords as tf.data.Dataset.
-    Used by get_tfrecord_dataset.
+    Load tfrecords as tf.data.Dataset, parsing each example individually.
+    get_tfrecord_dataset instead parses whole batches at once (faster).
 
     shuffle will randomise the order of the tfrecords. This is different (and complementary) to shuffling the batches (see get_tfrecord_dataset).
     If shuffle=False and multiple tfrecords, returns examples in deterministic but not equal order 
@@ -51,18 +78,36 @@ def load_tfrecords(tfrecord_locs, feature_spec, num_parallel_calls=tf.data.exper
         feature_spec (dict): like {feature: tf.io spec}. See source code.
         num_parallel_calls (int, optional): Number of parallel threads to use when loading. Defaults to tf.data.experimental.AUTOTUNE.
         shuffle (bool, optional): If True, shuffle order in which to load TFRecords. Defaults to False.
+        image_format (str, optional): how 'matrix' was saved: 'raw', 'png' or 'jpeg'. Defaults to 'raw'.
+        compression_type (str, optional): None, 'GZIP' or 'ZLIB'. Defaults to None.
 
     Returns:
         tf.data.Dataset: yielding {'matrix': , 'id_str': , label_cols[0]: , label_cols[1], ...} for each galaxy in each TFRecord, optionally shuffled by TFRecord.
     """
+    parse_function = partial(general_parsing_function, features=feature_spec, image_format=image_format)
+    dataset = load_serialized_tfrecords(tfrecord_locs, num_parallel_calls=num_parallel_calls, shuffle=shuffle, compression_type=compression_type)
+    return dataset.map(parse_function, num_parallel_calls=num_parallel_calls, deterministic=True)  # Parse the record into tensors
+
+
+def load_serialized_tfrecords(tfrecord_locs, num_parallel_calls=tf.data.experimental.AUTOTUNE, shuffle=False, compression_type=None):
+    """
+    Load tfrecords as tf.data.Dataset of serialized (not yet parsed) examples.
+    Used by get_tfrecord_dataset and load_tfrecords.
+
+    Args:
+        tfrecord_locs (list): paths to tfrecords to load.
+        num_parallel_calls (int, optional): Number of parallel threads to use when loading. Defaults to tf.data.experimental.AUTOTUNE.
+        shuffle (bool, optional): If True, shuffle order in which to load TFRecords. Defaults to False.
+        compression_type (str, optional): None, 'GZIP' or 'ZLIB'. Defaults to None.
+
+    Returns:
+        tf.data.Dataset: yielding serialized examples (scalar strings), interleaved from each TFRecord (1st in s1, 1st in s2, ...)
+    """
     # TODO consider num_parallel_calls = len(list)?
-    # small wrapper around loading a TFRecord as a single tensor tuples
     logging.info('tfrecord.io: Loading dataset from {}'.format(tfrecord_locs))
-    parse_function = partial(general_parsing_function, features=feature_spec)    
     if isinstance(tfrecord_locs, str):
         logging.warning('Loading single tfrecord {} - is this expected?'.format(tfrecord_locs))
-        dataset = tf.data.TFRecordDataset(tfrecord_locs)
-        return dataset.map(parse_function, num_parallel_calls=num_parallel_calls)  # Parse the record into tensors
+        return tf.data.TFRecordDataset(tfrecord_locs, compression_type=compression_type)
     else:
         # see https://github.com/tensorflow/tensorflow/issues/14857#issuecomment-365439428
         logging.warning('Loading multiple tfrecords with interleaving, shuffle={}'.format(shuffle))
@@ -78,12 +123,11 @@ def load_tfrecords(tfrecord_locs, feature_spec, num_parallel_calls=tf.data.exper
 
         dataset = tf.data.Dataset.from_tensor_slices(tf.constant(tfrecord_locs, dtype=tf.string))
         dataset = dataset.interleave(
-            lambda filename: tf.data.TFRecordDataset(filename).map(parse_function),
+            lambda filename: tf.data.TFRecordDataset(filename, compression_type=compression_type),
             cycle_length=num_files,  # concurrently processed input elements
             num_parallel_calls=num_parallel_calls,
             deterministic=True
         )
-        # could add num_parallel_calls if desired, but let's leave for now 
         # for extra randomness, may shuffle those (1st in s1, 1st in s2, ...) subjects
         return dataset
 
@@ -107,14 +151,55 @@ def get_feature_spec(label_cols):
     return construct_feature_spec(requested_features)
 
 
-def general_parsing_function(serialized_example, features):
+def general_parsing_function(serialized_example, features, image_format='raw'):
     """Parse example. Decode feature 'matrix' into float32 if present"""
     example = tf.io.parse_single_example(serialized=serialized_example, features=features)
     if 'matrix' in features.keys():
-        example['matrix'] = cast_bytes_of_uint8_to_float32(example['matrix'])
+        example['matrix'] = cast_bytes_of_uint8_to_float32(example['matrix'], image_format)
     return example
 
 
+def parse_matrix_function(serialized_example, keep_uint8=False, image_format='raw'):
+    """
+    Parse and decode only feature 'matrix' (into float32, or uint8 if keep_uint8), keeping the serialized example to parse the other features per batch.
+
+    Decoding images per example, rather than per batch, keeps each uint8 -> float32 conversion small enough to stay in cache.
+    Decoding whole batches of 300x300x3 images was up to 2x slower in benchmarks/tensorflow/benchmark_tfrecord_parsing.py.
+
+    Args:
+        serialized_example (tf.Tensor): serialized example (scalar string)
+        keep_uint8 (bool, optional): if True, decode 'matrix' as uint8 and skip the conversion to float32. Defaults to False.
+        image_format (str, optional): how 'matrix' was saved: 'raw', 'png' or 'jpeg'. See decode_matrix. Defaults to 'raw'.
+
+    Returns:
+        tf.Tensor: serialized_example, unchanged
+        tf.Tensor: decoded 'matrix', as float32 flat array from 0. to 1. (or uint8 flat array from 0 to 255, if keep_uint8)
+    """
+    example = tf.io.parse_single_example(serialized=serialized_example, features={'matrix': tf.io.FixedLenFeature([], tf.string)})
+    if keep_uint8:
+        return serialized_example, decode_matrix(example['matrix'], image_format)
+    return serialized_example, cast_bytes_of_uint8_to_float32(example['matrix'], image_format)
+
+
+def general_batch_parsing_function(serialized_examples, matrices, features):
+    """
+    Parse a batch of examples at once, adding the 'matrix' already decoded by parse_matrix_function.
+    Gives the same result as general_parsing_function on each example, then batching.
+
+    Args:
+        serialized_examples (tf.Tensor): batch of serialized examples, shape (batch)
+        matrices (tf.Tensor): batch of decoded 'matrix', shape (batch, pixels)
+        features (dict): like {feature: tf.io spec}, from get_feature_spec
+
+    Returns:
+        dict: like {'matrix': (batch, pixels), 'id_str': (batch), label_cols[0]: (batch), ...}
+    """
+    other_features = dict([(key, value) for key, value in features.items() if key != 'matrix'])
+    examples = tf.io.parse_example(serialized=serialized_examples, features=other_features)
+    examples['matrix'] = matrices
+    return examples
+
+
 def construct_feature_spec(expected_features: Dict) -> Dict:
     """For arbitrary feature specs, to generalise active learning to multi-label
     
@@ -140,8 +225,28 @@ def construct_feature_spec(expected_features: Dict) -> Dict:
     return features
 
 
-def cast_bytes_of_uint8_to_float32(some_bytes):
+def decode_matrix(some_bytes, image_format='raw'):
+    """
+    Decode feature 'matrix' into a flat uint8 array, however it was saved (see create_tfrecord.serialize_image_example).
+
+    Args:
+        some_bytes (tf.Tensor): 'matrix' feature (scalar string)
+        image_format (str, optional): 'raw' (flat uint8 bytes), 'png' or 'jpeg' (encoded bytes). Defaults to 'raw'.
+
+    Returns:
+        tf.Tensor: uint8 flat array, in height-width-channel order
+    """
+    if image_format == 'raw':
+        return tf.io.decode_raw(some_bytes, out_type=tf.uint8)
+    elif image_format in ['png', 'jpeg']:
+        # flatten to match raw
+        return tf.reshape(tf.io.decode_image(some_bytes, expand_animations=False), [-1])
+    else:
+        raise ValueError('image_format {} not recognised - expected raw, png or jpeg'.format(image_format))
+
+
+def cast_bytes_of_uint8_to_float32(some_bytes, image_format='raw'):
     # bytes are uint of range 0-255 (i.e. pixels)
     # floats are 0-1 by convention (and may be clipped if not)
     # tfrecord datasets will be saved as 0-1 floats and so do NOT need dividing again (see preprocess.py, normalise_from_uint8 should be False)
-    return tf.cast(tf.io.decode_raw(some_bytes, out_type=tf.uint8), tf.float32) / 255.
+    return tf.cast(decode_matrix(some_bytes, image_format), tf.float32) / 255.
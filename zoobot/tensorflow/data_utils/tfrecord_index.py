@@ -0,0 +1,173 @@
+"""
+Random access to galaxies in (uncompressed) tfrecord shards, by id_str.
+
+TFRecords can only be read from start to end. To fetch a few galaxies (e.g. to inspect or re-predict them),
+each shard has an index (csv alongside, see get_index_loc) of the byte offset and length of every galaxy's record.
+Readers then seek straight to those records, rather than scanning whole shards.
+
+Indexes are written with each shard by create_shards.write_catalog_to_tfrecord_shards (see catalog_to_tfrecord.write_image_df_to_tfrecord).
+For shards made without an index, use index_tfrecord.
+Compressed shards (GZIP/ZLIB) cannot be indexed, as records have no fixed position in the compressed stream.
+
+Example:
+    index = tfrecord_index.load_index(shard_config.train_tfrecord_locs())
+    subset = tfrecord_index.find_galaxies(index, ['J000000.01+000000.1', ...])  # or e.g. index.sample(1000)
+    dataset = tfrecord_index.get_indexed_dataset(subset, label_cols, batch_size=32)
+"""
+import os
+import struct
+import logging
+from functools import partial
+
+import pandas as pd
+import tensorflow as tf
+
+from zoobot.tensorflow.data_utils import tfrecord_datasets
+
+
+# each record is framed as: uint64 length, uint32 crc of length, data, uint32 crc of data
+RECORD_HEADER_BYTES = 12
+RECORD_FOOTER_BYTES = 4
+
+
+def get_index_loc(tfrecord_loc):
+    # only the extension, not e.g. a directory named like shards.tfrecords
+    return os.path.splitext(tfrecord_loc)[0] + '_index.csv'
+
+
+def get_record_bytes(serialized_example):
+    # bytes taken by serialized_example once written to a tfrecord, including framing
+    return RECORD_HEADER_BYTES + len(serialized_example) + RECORD_FOOTER_BYTES
+
+
+def save_index(index, index_loc):
+    """
+    Args:
+        index (pd.DataFrame): with columns id_str, offset (of record, in bytes) and length (of serialized example, in bytes)
+        index_loc (str): csv to save
+    """
+    index[['id_str', 'offset', 'length']].to_csv(index_loc, index=False)
+
+
+def index_tfrecord(tfrecord_loc):
+    """
+    Index an existing (uncompressed) tfrecord, by reading every record once. Saves the index alongside (see get_index_loc).
+    Not needed for shards written with an index.
+
+    Args:
+        tfrecord_loc (str): tfrecord to index
+
+    Returns:
+        pd.DataFrame: index, with columns id_str, offset and length
+    """
+    rows = []
+    with open(tfrecord_loc, 'rb') as f:
+        offset = 0
+        header = f.read(RECORD_HEADER_BYTES)
+        while header:
+            length = struct.unpack('<Q', header[:8])[0]
+            serialized_example = f.read(length)
+            f.seek(RECORD_FOOTER_BYTES, os.SEEK_CUR)
+            rows.append({'id_str': get_id_str(serialized_example), 'offset': offset, 'length': length})
+            offset += get_record_bytes(serialized_example)
+            header = f.read(RECORD_HEADER_BYTES)
+    index = pd.DataFrame(rows, columns=['id_str', 'offset', 'length'])
+    save_index(index, get_index_loc(tfrecord_loc))
+    return index
+
+
+def get_id_str(serialized_example):
+    return tf.train.Example.FromString(serialized_example).features.feature['id_str'].bytes_list.value[0].decode('utf-8')
+
+
+def load_index(tfrecord_locs):
+    """
+    Load the indexes of tfrecord_locs into one table.
+
+    Args:
+        tfrecord_locs (list): paths to (indexed) tfrecords
+
+    Raises:
+        FileNotFoundError: a tfrecord has no index. Use index_tfrecord.
+
+    Returns:
+        pd.DataFrame: with columns tfrecord_loc, id_str, offset and length, for every galaxy in tfrecord_locs
+    """
+    indexes = []
+    for tfrecord_loc in tfrecord_locs:
+        index_loc = get_index_loc(tfrecord_loc)
+        if not os.path.isfile(index_loc):
+            raise FileNotFoundError('No index for {} - expected {}. Create with tfrecord_index.index_tfrecord.'.format(tfrecord_loc, index_loc))
+        index = pd.read_csv(index_loc, dtype={'id_str': str})
+        index.insert(0, 'tfrecord_loc', tfrecord_loc)
+        indexes.append(index)
+    return pd.concat(indexes, ignore_index=True)
+
+
+def find_galaxies(index, id_strs):
+    """
+    Args:
+        index (pd.DataFrame): from load_index
+        id_strs (list): galaxies to find
+
+    Raises:
+        KeyError: any id_strs are not in index
+
+    Returns:
+        pd.DataFrame: rows of index for id_strs, in the same order
+    """
+    missing = set(id_strs) - set(index['id_str'])
+    if missing:
+        raise KeyError('{} of {} galaxies not in index e.g. {}'.format(len(missing), len(id_strs), list(missing)[:3]))
+    return index.set_index('id_str').loc[list(id_strs)].reset_index()[index.columns]
+
+
+def read_serialized_examples(index):
+    """
+    Read the serialized examples of the galaxies in index, seeking straight to each record.
+
+    Args:
+        index (pd.DataFrame): rows from load_index (e.g. from find_galaxies, or sampled)
+
+    Yields:
+        bytes: serialized example for each row of index, in order
+    """
+    files = {}
+    try:
+        for tfrecord_loc, offset, length in index[['tfrecord_loc', 'offset', 'length']].itertuples(index=False):
+            if tfrecord_loc not in files:
+                files[tfrecord_loc] = open(tfrecord_loc, 'rb')
+            f = files[tfrecord_loc]
+            f.seek(offset)
+            header = f.read(RECORD_HEADER_BYTES)
+            if struct.unpack('<Q', header[:8])[0] != length:
+                # e.g. shard rewritten since indexed
+                raise ValueError('Index does not match {} at offset {} - re-index with tfrecord_index.index_tfrecord'.format(tfrecord_loc, offset))
+            yield f.read(length)
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def get_indexed_dataset(index, label_cols, batch_size, keep_uint8=False, image_format='raw'):
+    """
+    Like tfrecord_datasets.get_tfrecord_dataset, but for only the galaxies in index (in that order), read by seeking.
+
+    Args:
+        index (pd.DataFrame): rows from load_index (e.g. from find_galaxies, or sampled)
+        label_cols (list): of features encoded in tfrecord e.g. ['smooth_votes', 'featured_votes']. 'id_str' and 'matrix' are loaded automatically.
+        batch_size (int): batch size
+        keep_uint8 (bool, optional): if True, yield 'matrix' as 0-255 uint8. See get_tfrecord_dataset. Defaults to False.
+        image_format (str, optional): how 'matrix' was saved: 'raw', 'png' or 'jpeg'. Defaults to 'raw'.
+
+    Returns:
+        tf.data.Dataset: yielding batches of {'matrix': , 'id_str': , label_cols[0]: , label_cols[1], ...}
+    """
+    assert not index.empty
+    # generator rather than from_tensor_slices, so only a few images are in memory at once
+    dataset = tf.data.Dataset.from_generator(
+        partial(read_serialized_examples, index),
+        output_signature=tf.TensorSpec(shape=(), dtype=tf.string)
+    )
+    logging.info('Reading {} galaxies from {} tfrecords by index'.format(len(index), index['tfrecord_loc'].nunique()))
+    return tfrecord_datasets.parse_serialized_dataset(dataset, label_cols, batch_size, keep_uint8=keep_uint8, image_format=image_format)
@@ -78,6 +78,31 @@ def get_advanced_ring_feature_dataset(train_dataset_size=None, seed=1):
         tf.data.dataset: validation galaxies, as above.
         tf.data.dataset: test galaxies, as above.
     """
+    train, val, test = get_advanced_ring_features(train_dataset_size=train_dataset_size, seed=seed)
+
+    train_dataset = tf.data.Dataset.from_tensor_slices(train)
+    val_dataset = tf.data.Dataset.from_tensor_slices(val)
+    test_dataset = tf.data.Dataset.from_tensor_slices(test)
+
+    logging.info('Train size after cutting up: {}'.format(train_dataset_size))
+
+    return train_dataset, val_dataset, test_dataset
+
+
+def get_advanced_ring_features(train_dataset_size=None, seed=1):
+    """
+    As :meth:`get_advanced_ring_feature_dataset`, but returning numpy arrays rather than tf.data.datasets.
+    Useful for sweeping many heads over the same features (see zoobot/tensorflow/transfer_learning/sweep.py).
+
+    Args:
+        train_dataset_size (int, optional): Max number of training galaxies. Defaults to None. See :meth:`get_advanced_ring_image_dataset`.
+        seed (int, optional): Random seed for catalog shuffle and splits. Defaults to 1.
+
+    Returns:
+        tuple: of (features, labels) for training galaxies. Features of shape (galaxy, 1280), labels of shape (galaxy).
+        tuple: validation galaxies, as above.
+        tuple: test galaxies, as above.
+    """
     # TODO move these features either into the repo or somewhere otherwise accessible (Zenodo?)
     feature_df = pd.read_parquet('../morphology-tools/anomaly/data/cnn_features_concat.parquet')
     assert not any(feature_df.duplicated(subset=['iauname']))
@@ -90,13 +115,7 @@ def get_advanced_ring_feature_dataset(train_dataset_size=None, seed=1):
     val_df = pd.merge(ring_catalog_val, feature_df, on='iauname', how='inner')
     test_df = pd.merge(ring_catalog_test, feature_df, on='iauname', how='inner')
 
-    train_dataset = tf.data.Dataset.from_tensor_slices((train_df[feature_cols], train_df['label']))
-    val_dataset = tf.data.Dataset.from_tensor_slices((val_df[feature_cols], val_df['label']))
-    test_dataset = tf.data.Dataset.from_tensor_slices((test_df[feature_cols], test_df['label']))
-
-    logging.info('Train size after cutting up: {}'.format(train_dataset_size))
-
-    return train_dataset, val_dataset, test_dataset
+    return tuple((df[feature_cols].values, df['label'].values) for df in [train_df, val_df, test_df])
 
 
 
@@ -1,3 +1,9 @@
+import json
+import time
+import logging
+import resource
+
+import numpy as np
 import tensorflow as tf
 
 
@@ -28,3 +34,115 @@ class UpdateStepCallback(tf.keras.callbacks.Callback):
         tf.keras.backend.set_value(self.model.step, step)
         print('\n Ending step: ', float(tf.keras.backend.get_value(self.model.step)))
         # # print(f'Step {step}')
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+
+    def __init__(self, batch_size, save_loc=None, example_batch=None):
+        """
+        Record training throughput, to tell if training is I/O-bound or compute-bound. Keras equivalent of the pytorch ThroughputMonitor.
+
+        Per step, records wall time (seconds), host time between steps, images/sec and peak RSS.
+        Keras fuses data loading, forward, loss, backward and optimizer into one compiled train step, which callbacks cannot split.
+        Instead, if example_batch is provided, at the end of each epoch the callback times (compiled) forward, loss and backward passes
+        on that batch without updating the model. The rest of the mean step time is then data wait plus optimizer.
+        If that remainder is large, training is likely I/O-bound. For a full trace, use TensorBoard(profile_batch=...).
+
+        Scalars are written (as throughput/...) to the default summary writer, if any, and records appended to a JSON-lines file.
+
+        Args:
+            batch_size (int): images per step, to calculate images/sec
+            save_loc (str, optional): JSON-lines file to append records to. Defaults to None (no file).
+            example_batch (tuple, optional): (images, labels) batch to time forward/loss/backward passes. Defaults to None (no breakdown).
+        """
+        super(ThroughputCallback, self).__init__()
+        self.batch_size = batch_size
+        self.save_loc = save_loc
+        self.example_batch = example_batch
+        self._file = None
+        self._step = 0
+
+    def on_train_begin(self, logs=None):
+        if self.save_loc is not None:
+            self._file = open(self.save_loc, 'a')
+            logging.info('Recording training throughput to {}'.format(self.save_loc))
+
+    def on_train_end(self, logs=None):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._step_times = []
+        self._step_end = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        # keras converts logs to numpy for callbacks without _supports_tf_logs, so the step has finished by now
+        previous_step_end = self._step_end
+        self._step_end = time.perf_counter()
+        step_time = self._step_end - previous_step_end
+        self._step_times.append(step_time)
+        self._step += 1
+        self.record({
+            'step': self._step,
+            'epoch': self._epoch,
+            'batch_size': self.batch_size,
+            'step_time': step_time,
+            'host_gap': self._step_start - previous_step_end,
+            'images_per_sec': self.batch_size / step_time,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.  # kilobytes on linux
+        })
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (self.example_batch is None) or (not self._step_times):
+            return
+        breakdown = self.time_example_batch()
+        mean_step_time = float(np.mean(self._step_times))
+        breakdown['data_wait_and_optimizer'] = max(mean_step_time - breakdown['forward'] - breakdown['loss'] - breakdown['backward'], 0.)
+        self.record({'step': self._step, 'epoch': epoch, 'mean_step_time': mean_step_time, **breakdown})
+
+    def time_example_batch(self, repeats=3):
+        images, labels = self.example_batch
+        model = self.model
+
+        @tf.function
+        def forward(images):
+            return model(images, training=True)
+
+        @tf.function
+        def loss(labels, predictions):
+            return tf.reduce_mean(model.loss(labels, predictions))
+
+        @tf.function
+        def forward_backward(images, labels):
+            with tf.GradientTape() as tape:
+                loss_value = tf.reduce_mean(model.loss(labels, model(images, training=True)))
+            return tape.gradient(loss_value, model.trainable_variables)
+
+        def timed(func, *args):
+            func(*args)  # trace, if needed
+            start = time.perf_counter()
+            for _ in range(repeats):
+                result = tf.nest.map_structure(lambda x: x.numpy(), func(*args))  # .numpy() waits for the device
+            return (time.perf_counter() - start) / repeats, result
+
+        forward_time, predictions = timed(forward, images)
+        loss_time, _ = timed(loss, labels, predictions)
+        forward_backward_time, _ = timed(forward_backward, images, labels)
+        return {
+            'forward': forward_time,
+            'loss': loss_time,
+            'backward': max(forward_backward_time - forward_time - loss_time, 0.)
+        }
+
+    def record(self, record):
+        for key, value in record.items():
+            if key not in ['step', 'epoch']:
+                tf.summary.scalar('throughput/' + key, value, step=self._step)  # no-op without a default writer
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
@@ -33,3 +33,26 @@ class PermaRandomFlip(tf.keras.layers.RandomFlip):
 class PermaRandomCrop(tf.keras.layers.RandomCrop):
     def call(self, x, training=None):
         return super().call(x, training=True)
+
+class InputPreprocessing(layers.Layer):
+    """
+    Normalise from uint8 and/or make greyscale inside the model, so the input pipeline can keep images as uint8 (4x smaller).
+    Gives the same images as preprocess.preprocess_batch with normalise_from_uint8 and make_greyscale.
+    """
+    def __init__(self, normalise_from_uint8=True, make_greyscale=False, **kwargs):
+        super().__init__(**kwargs)
+        self.normalise_from_uint8 = normalise_from_uint8
+        self.make_greyscale = make_greyscale
+
+    def call(self, x, training=None):
+        x = tf.cast(x, tf.float32)
+        if self.normalise_from_uint8:
+            x = x / 255.
+        if self.make_greyscale:
+            x = tf.reduce_mean(x, axis=-1, keepdims=True)
+        return x
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'normalise_from_uint8': self.normalise_from_uint8, 'make_greyscale': self.make_greyscale})
+        return config
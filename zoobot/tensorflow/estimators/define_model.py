@@ -89,7 +89,9 @@ def get_model(
     use_imagenet_weights=False,
     always_augment=True,
     dropout_rate=0.2,
-    get_effnet=efficientnet_standard.EfficientNetB0
+    get_effnet=efficientnet_standard.EfficientNetB0,
+    normalise_from_uint8=False,
+    make_greyscale=False
     ):
     """
     Create a trainable efficientnet model.
@@ -109,6 +111,8 @@ def get_model(
         include_top (bool, optional): If True, include head used for GZ DECaLS: global pooling and dense layer. Defaults to True.
         expect_partial (bool, optional): If True, do not raise partial match error when loading weights (likely for optimizer state). Defaults to False.
         channels (int, default 1): Number of channels i.e. C in NHWC-dimension inputs. 
+        normalise_from_uint8 (bool, optional): If True, expect 0-255 (e.g. uint8) images and divide by 255 in the first layer. Use with preprocess.PreprocessingConfig(keep_uint8=True). Defaults to False.
+        make_greyscale (bool, optional): If True, expect 3-channel images and average over channels in the first layer, giving ``channels=1`` images. Use as above. Not needed for greyscale shards. Defaults to False.
 
     Returns:
         tf.keras.Model: trainable efficientnet model including augmentations and optional head
@@ -120,9 +124,17 @@ def get_model(
     # model = CustomSequential()  # to log the input image for debugging
     model = tf.keras.Sequential()
 
-    input_shape = (input_size, input_size, channels)
+    if make_greyscale:
+        assert channels == 1
+        input_shape = (input_size, input_size, 3)
+    else:
+        input_shape = (input_size, input_size, channels)
     model.add(tf.keras.layers.InputLayer(input_shape=input_shape))
 
+    if normalise_from_uint8 or make_greyscale:
+        # before augmentations, exactly as if done by preprocess.preprocess_batch
+        model.add(custom_layers.InputPreprocessing(normalise_from_uint8=normalise_from_uint8, make_greyscale=make_greyscale))
+
     add_augmentation_layers(
         model,
         crop_size=crop_size,
@@ -178,7 +190,7 @@ def load_weights(model, checkpoint_loc, expect_partial=False):
     load_status.assert_existing_objects_matched()
 
 
-def load_model(checkpoint_loc, include_top, input_size, crop_size, resize_size, output_dim=34, expect_partial=False, channels=1, always_augment=True, dropout_rate=0.2):
+def load_model(checkpoint_loc, include_top, input_size, crop_size, resize_size, output_dim=34, expect_partial=False, channels=1, always_augment=True, dropout_rate=0.2, normalise_from_uint8=False, make_greyscale=False):
     """    
     Utility wrapper for the common task of defining the GZ DECaLS model and then loading a pretrained checkpoint.
     resize_size must match the pretrained model used.
@@ -193,6 +205,8 @@ def load_model(checkpoint_loc, include_top, input_size, crop_size, resize_size,
         resize_size (int): Length to resize image. See ``add_augmentation_layers``.
         output_dim (int, optional): Dimension of head dense layer. No effect when include_top=False. Defaults to 34.
         expect_partial (bool, optional): If True, do not raise partial match error when loading weights (likely for optimizer state). Defaults to False.
+        normalise_from_uint8 (bool, optional): See ``get_model``. Defaults to False.
+        make_greyscale (bool, optional): See ``get_model``. Defaults to False.
 
     Returns:
         tf.keras.Model: GZ DECaLS-like model with weights loaded from ``checkpoint_loc``, optionally including GZ DECaLS-like head.
@@ -206,7 +220,9 @@ def load_model(checkpoint_loc, include_top, input_size, crop_size, resize_size,
         include_top=include_top,
         channels=channels,
         always_augment=always_augment,
-        dropout_rate=dropout_rate
+        dropout_rate=dropout_rate,
+        normalise_from_uint8=normalise_from_uint8,
+        make_greyscale=make_greyscale
     )
     load_weights(model, checkpoint_loc, expect_partial=expect_partial)
     return model
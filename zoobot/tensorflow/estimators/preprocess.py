@@ -15,6 +15,7 @@ class PreprocessingConfig():
             normalise_from_uint8: bool,
             permute_channels=False,
             input_channels=3,  # for png, jpg etc. Might be different if e.g. fits (not supported yet).
+            keep_uint8=False
     ):
         """
         Simple data class to define how images should be preprocessed.
@@ -23,13 +24,16 @@ class PreprocessingConfig():
         Args:
             label_cols (List): list of answer strings in fixed order. Useful for loading labels.
             input_size (int): length of image before preprocessing (assumed square) e.g. 300
-            make_greyscale (bool): if True, average over channels (last dimension). Incompatible with ``permute_channels``
+            make_greyscale (bool): if True, average over channels (last dimension). Incompatible with ``permute_channels``. Nothing to do if ``input_channels == 1`` (e.g. greyscale shards)
             normalise_from_uint8 (bool): if True, assume input image is 0-255 range and divide by 255.
             permute_channels (bool, optional): If True, randomly swap channels around. Defaults to False.
-            input_channels (int, optional): Number of channels in input image (last dimension). Defaults to 3.
+            input_channels (int, optional): Number of channels in input image (last dimension). 1 for greyscale shards (see create_shards.ShardConfig). Defaults to 3.
+            keep_uint8 (bool, optional): If True, leave images as loaded (e.g. 0-255 uint8, 4x smaller than float32) through shuffling, batching and prefetching.
+                The model must then normalise and make greyscale instead - see define_model.get_model. Requires ``make_greyscale=False`` and ``normalise_from_uint8=False``. Defaults to False.
 
         Raises:
             ValueError: trying to permute channels when ``input_channels == 1``
+            ValueError: trying to make greyscale or normalise here when ``keep_uint8``
         """
         self.label_cols = label_cols
         self.input_size = input_size
@@ -37,9 +41,12 @@ class PreprocessingConfig():
         self.normalise_from_uint8 = normalise_from_uint8
         self.make_greyscale = make_greyscale
         self.permute_channels = permute_channels
+        self.keep_uint8 = keep_uint8
 
-        if make_greyscale and permute_channels:
+        if (make_greyscale or input_channels == 1) and permute_channels:
             raise ValueError("Incompatible options - can't permute channels if there's only one!")
+        if keep_uint8 and (make_greyscale or normalise_from_uint8):
+            raise ValueError("Incompatible options - with keep_uint8, make greyscale and normalise in the model instead (see define_model.get_model)")
 
     # TODO move to shared utilities
     def asdict(self):
@@ -72,6 +79,7 @@ def preprocess_batch(batch, config):
 
     If config.normalise_from_uint8, assume images are 0-255 range and divide by 255.
     Then apply ``preprocess_images``.
+    If config.keep_uint8, images keep their loaded dtype (e.g. uint8) rather than being cast to float32.
 
     Finally, split batch into tuples of (images, labels) (if ``config.label_cols`` is not empty) or (images, id_strings) otherwise.
     
@@ -86,7 +94,8 @@ def preprocess_batch(batch, config):
     batch_images = get_images_from_batch(
         batch,
         size=config.input_size,
-        channels=config.input_channels)
+        channels=config.input_channels,
+        keep_uint8=config.keep_uint8)
 
     if config.normalise_from_uint8:
         batch_images = batch_images / 255.
@@ -111,16 +120,20 @@ def preprocess_images(batch_images, input_size, make_greyscale, permute_channels
     Args:
         batch_images (tf.Tensor): of shape (batch_size, input_size, input_size, channels)
         input_size (int): length of images before preprocessing (assumed square)
-        make_greyscale (bool): if True, take an average over channels.
+        make_greyscale (bool): if True, take an average over channels. Nothing to do if already greyscale (one channel).
         permute_channels (bool): if True, randomly swap channels around.
 
     Returns:
         tf.Tensor: preprocessed images, with channels=1 if ``make_greyscale``.
     """
     assert len(batch_images.shape) == 4
-    assert batch_images.shape[3] == 3  # should still have 3 channels at this point
+    # should still have 3 channels at this point, unless saved as greyscale
+    assert batch_images.shape[3] in [1, 3]
 
-    if make_greyscale:
+    if batch_images.shape[3] == 1:
+        # already greyscale e.g. greyscale shards, averaged when saved
+        channel_images = tf.identity(batch_images)
+    elif make_greyscale:
         # new channel dimension of 1
         channel_images = tf.reduce_mean(input_tensor=batch_images, axis=3, keepdims=True)
         assert channel_images.shape[1] == input_size
@@ -139,7 +152,7 @@ def preprocess_images(batch_images, input_size, make_greyscale, permute_channels
     return augmented_images
 
 
-def get_images_from_batch(batch, size, channels):
+def get_images_from_batch(batch, size, channels, keep_uint8=False):
     """
     Extract images from batch and ensure they are the expected size.
     Useful to then manipulate those images.
@@ -148,11 +161,15 @@ def get_images_from_batch(batch, size, channels):
         batch (dict): tf.data.Dataset batch with images under 'matrix' key
         size (int): length of images before preprocessing (assumed square)
         channels (int): Number of channels in input image (last dimension).
+        keep_uint8 (bool, optional): If True, keep images in their loaded dtype, rather than casting to float32. Defaults to False.
 
     Returns:
         tf.Tensor: images of shape ``(batch_size, size, size, channels)``
     """
-    batch_data = tf.cast(batch['matrix'], tf.float32)  # may automatically read uint8 into float32, but let's be sure
+    if keep_uint8:
+        batch_data = batch['matrix']
+    else:
+        batch_data = tf.cast(batch['matrix'], tf.float32)  # may automatically read uint8 into float32, but let's be sure
     # watch out, this may reshape to the wrong size if you specified the wrong --shard-img-size by an integer factor
     batch_images = tf.reshape(
         batch_data,
@@ -45,6 +45,19 @@ if __name__ == '__main__':
                     help='Max labelled galaxies (for debugging/speed')
     parser.add_argument('--img-size', dest='size', type=int,
                     help='Size at which to save images (before any augmentations). 300 for DECaLS paper.')
+    parser.add_argument('--image-format', dest='image_format', type=str, default='raw', choices=['raw', 'png', 'jpeg'],
+                    help='Save images as raw bytes (largest, fastest to decode), or encoded png (lossless) or jpeg (lossy). Train with the same --image-format.')
+    parser.add_argument('--jpeg-quality', dest='jpeg_quality', type=int, default=95)
+    parser.add_argument('--compression', dest='compression_type', type=str, default=None, choices=['GZIP', 'ZLIB'],
+                    help='Compress whole shards. Train with the same --compression.')
+    parser.add_argument('--num-workers', dest='num_workers', type=int, default=None,
+                    help='Processes writing shards in parallel. Defaults to all cpus.')
+    parser.add_argument('--file-check-cache', dest='file_check_cache_loc', type=str, default=None,
+                    help='json file caching image directory listings, to check file paths faster when re-run')
+    parser.add_argument('--greyscale', default=False, action='store_true',
+                    help='Save single-channel (greyscale) images, 3x smaller. Only for greyscale models. Train with --shard-channels 1.')
+    parser.add_argument('--incremental', default=False, action='store_true',
+                    help='Update existing shards in --shard-dir: only write new or changed galaxies, and remove stale ones. Existing galaxies keep their train/val/test split.')
 
     args = parser.parse_args()
 
@@ -87,11 +100,29 @@ if __name__ == '__main__':
     labelled_columns_to_save = ['id_str'] + label_cols
     logging.info('Saving columns for labelled galaxies: \n{}'.format(labelled_columns_to_save))
 
-    shard_config = create_shards.ShardConfig(shard_dir=args.shard_dir, size=args.size)
-
-    shard_config.prepare_shards(
-        labelled_catalog,
-        unlabelled_catalog,
-        train_test_fraction=train_test_fraction,
-        labelled_columns_to_save=labelled_columns_to_save
+    shard_config = create_shards.ShardConfig(
+        shard_dir=args.shard_dir,
+        size=args.size,
+        image_format=args.image_format,
+        jpeg_quality=args.jpeg_quality,
+        compression_type=args.compression_type,
+        greyscale=args.greyscale
     )
+
+    if args.incremental:
+        shard_config.update_shards(
+            labelled_catalog,
+            unlabelled_catalog,
+            labelled_columns_to_save=labelled_columns_to_save,
+            num_workers=args.num_workers,
+            file_check_cache_loc=args.file_check_cache_loc
+        )
+    else:
+        shard_config.prepare_shards(
+            labelled_catalog,
+            unlabelled_catalog,
+            train_test_fraction=train_test_fraction,
+            labelled_columns_to_save=labelled_columns_to_save,
+            num_workers=args.num_workers,
+            file_check_cache_loc=args.file_check_cache_loc
+        )
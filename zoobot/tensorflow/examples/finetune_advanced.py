@@ -12,11 +12,11 @@ from tensorflow.keras import layers
 
 from zoobot.tensorflow.estimators import preprocess, define_model
 from zoobot.tensorflow.training import training_config
-from zoobot.tensorflow.transfer_learning import utils
+from zoobot.tensorflow.transfer_learning import utils, feature_cache
 from zoobot.tensorflow.datasets import rings
 
     
-def main(batch_size, requested_img_size, train_dataset_size, epochs, greyscale=True):
+def main(batch_size, requested_img_size, train_dataset_size, epochs, greyscale=True, n_views=5):
     """
 
     This example is the research-grade version of finetune_minimal.py. Start there first.
@@ -26,6 +26,9 @@ def main(batch_size, requested_img_size, train_dataset_size, epochs, greyscale=T
     - Train a new head on a frozen model
     - Finetune a new head on a trained head/frozen model pair
     - Initialise the frozen model with either GZ DECaLS weights (note: channels=1!) or ImageNet weights (note: channels=3!) or randomly
+
+    While the base model is frozen, the new head is trained on cached base model outputs (n_views augmented views per galaxy)
+    rather than running the base model every epoch. See zoobot/tensorflow/transfer_learning/feature_cache.py.
     """
 
     """  
@@ -163,8 +166,7 @@ def main(batch_size, requested_img_size, train_dataset_size, epochs, greyscale=T
     """Add the small (trainable) dense head"""
     # I am not using test-time dropout (MC Dropout) on the head as 0.75 would be way too aggressive and reduce performance
     new_head = tf.keras.Sequential([
-      layers.InputLayer(input_shape=(7,7,1280)),  # base model dim before GlobalAveragePooling (ignoring batch)
-      layers.GlobalAveragePooling2D(),  # quirk of code that this is included - could have been input_shape=(1280) and skipped GAP2D
+      layers.InputLayer(input_shape=(1280)),  # base model dim after GlobalAveragePooling (ignoring batch)
       # TODO the following layers will likely need some experimentation to find a good combination for your problem
       # layers.Dropout(0.75),
       layers.Dense(64, activation='relu'),
@@ -179,6 +181,7 @@ def main(batch_size, requested_img_size, train_dataset_size, epochs, greyscale=T
     model = tf.keras.Sequential([
       tf.keras.layers.InputLayer(input_shape=(requested_img_size, requested_img_size, channels)),
       base_model,
+      layers.GlobalAveragePooling2D(),  # separate from new_head, so new_head can also train on cached (pooled) features
       new_head
     ])
 
@@ -190,25 +193,46 @@ def main(batch_size, requested_img_size, train_dataset_size, epochs, greyscale=T
     logging.info('Epochs: {}'.format(epochs))
     logging.info('Early stopping patience: {}'.format(patience))
 
-    model.compile(
-        loss=tf.keras.losses.binary_crossentropy,
-        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),  # normal learning rate is okay
-        metrics=['accuracy']
-    )
-    model.summary(print_fn=logging.info)
-
     train_config = training_config.TrainConfig(
       log_dir=log_dir_head,
       epochs=epochs,
       patience=patience  # early stopping: if val loss does not improve for this many epochs in a row, end training
     )
 
-    training_config.train_estimator(
-      model,
-      train_config,  # e.g. how to train epochs, patience
-      train_dataset,
-      val_dataset
+    if not base_model.trainable:
+      # the frozen base model gives the same output (up to augmentation) every epoch, so calculate it once per view and train only the head
+      feature_dir = os.path.join(log_dir, 'feature_cache')
+      os.mkdir(feature_dir)
+      train_features, train_labels = feature_cache.cache_features(base_model, train_dataset, os.path.join(feature_dir, 'train_features.npy'), n_views=n_views)
+      val_features, val_labels = feature_cache.cache_features(base_model, val_dataset, os.path.join(feature_dir, 'val_features.npy'), n_views=n_views)
+
+      new_head.compile(
+          loss=tf.keras.losses.binary_crossentropy,
+          optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),  # normal learning rate is okay
+          metrics=['accuracy']
+      )
+      training_config.train_estimator(
+        new_head,
+        train_config,  # e.g. how to train epochs, patience
+        feature_cache.get_feature_dataset(train_features, train_labels, batch_size, shuffle=True),  # random view per galaxy per epoch
+        feature_cache.get_feature_dataset(val_features, val_labels, batch_size)  # mean over views
+      )
+
+    # compile the full model (images in), to evaluate the trained head - or to train the whole model, if not frozen
+    model.compile(
+        loss=tf.keras.losses.binary_crossentropy,
+        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),  # normal learning rate is okay
+        metrics=['accuracy']
     )
+    model.summary(print_fn=logging.info)
+
+    if base_model.trainable:
+      training_config.train_estimator(
+        model,
+        train_config,
+        train_dataset,
+        val_dataset
+      )
 
     logging.info('Evaluating head (no finetuning) performancce')
     evaluate_performance(
@@ -221,6 +245,7 @@ def main(batch_size, requested_img_size, train_dataset_size, epochs, greyscale=T
     The head has been retrained.
     It may be possible to further improve performance by unfreezing the layers just before the head in the base model,
     and training with a very low learning rate (to avoid overfitting).
+    From here, the base model is no longer frozen, so training is on the images themselves (not the feature cache).
 
     If you want to focus on this step, you can comment out the training above and instead simply load the previous model (including the finetuned head).
     """
@@ -335,6 +360,8 @@ if __name__ == '__main__':
                         help='Image size before conv layers i.e. after loading (from 424, by default) and cropping (to 300, by default).')
     parser.add_argument('--epochs', dest='epochs', default=50, type=int,
                         help='Max epochs to run. N for transfer, and another N for fine-tuning')
+    parser.add_argument('--views', dest='n_views', default=5, type=int,
+                        help='Augmented views of each galaxy to cache for training the head on the frozen base model')
 
     args = parser.parse_args()
 
@@ -343,7 +370,8 @@ if __name__ == '__main__':
       requested_img_size=args.requested_img_size,
       train_dataset_size=args.train_dataset_size,
       epochs=args.epochs,
-      greyscale=True
+      greyscale=True,
+      n_views=args.n_views
     )
 
     # main(
@@ -0,0 +1,53 @@
+import os
+import logging
+import argparse
+
+from zoobot.tensorflow.datasets import rings
+from zoobot.tensorflow.transfer_learning import sweep
+
+
+if __name__ == '__main__':
+
+    """
+    Sweep many new heads over fixed representations at once, rather than running finetune_on_fixed_representation.py once per configuration.
+    The representations are loaded once and shared between worker processes. Results are added to one csv.
+
+    Example:
+    python zoobot/tensorflow/examples/finetune_sweep.py --save-dir results/finetune_sweep --head-types linear mlp --dropout-rates 0.5 0.75 --dataset-sizes 100 1000 10000 --seeds 0 1 2
+    """
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description='Sweep new heads over fixed ring representations')
+    parser.add_argument('--save-dir', dest='save_dir', type=str, default='results/finetune_sweep')
+    parser.add_argument('--head-types', dest='head_types', nargs='+', type=str, default=['mlp'])
+    parser.add_argument('--dropout-rates', dest='dropout_rates', nargs='+', type=float, default=[0.75])
+    parser.add_argument('--dataset-sizes', dest='dataset_sizes', nargs='+', type=int, default=None,
+                        help='Training galaxies to use (including resampling). Defaults to all.')
+    parser.add_argument('--seeds', dest='seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--processes', dest='processes', type=int, default=None, help='Defaults to one per cpu')
+    parser.add_argument('--batch-size', dest='batch_size', default=256, type=int)
+    args = parser.parse_args()
+
+    data_dir = os.path.join(args.save_dir, 'data')
+    if not os.path.isdir(data_dir):
+        # all training galaxies - each config then selects dataset_size of them
+        train, val, test = rings.get_advanced_ring_features()
+        sweep.save_sweep_data(data_dir, train, val, test)
+
+    configs = sweep.get_sweep_configs(
+        head_types=args.head_types,
+        dropout_rates=args.dropout_rates,
+        dataset_sizes=args.dataset_sizes or [None],
+        seeds=args.seeds
+    )
+    results = sweep.run_sweep(
+        data_dir,
+        configs,
+        results_loc=os.path.join(args.save_dir, 'results.csv'),
+        processes=args.processes,
+        batch_size=args.batch_size
+    )
+
+    summary = results.groupby(['head_type', 'dropout_rate', 'dataset_size'])[['test_loss', 'test_accuracy']].agg(['mean', 'std'])
+    logging.info('Results (over seeds): \n{}'.format(summary))
@@ -67,6 +67,18 @@ if __name__ == '__main__':
                         default=0.2, type=float)
     parser.add_argument('--patience', dest='patience',
                         default=8, type=int)
+    parser.add_argument('--validation-freq', dest='validation_freq', default=1, type=int,
+                        help='Validate every this many epochs')
+    parser.add_argument('--validation-steps', dest='validation_steps', default=None, type=int,
+                        help='Validate on only the first this many test batches, to save time on large catalogs')
+    parser.add_argument('--image-format', dest='image_format', type=str, default='raw', choices=['raw', 'png', 'jpeg'],
+                        help='How images were saved to the shards (see decals_dr5_to_shards.py)')
+    parser.add_argument('--compression', dest='compression_type', type=str, default=None, choices=['GZIP', 'ZLIB'],
+                        help='How the shards were compressed (see decals_dr5_to_shards.py)')
+    parser.add_argument('--shard-channels', dest='shard_channels', type=int, default=3,
+                        help='1 if shards were saved as greyscale (see decals_dr5_to_shards.py --greyscale)')
+    parser.add_argument('--keep-uint8', dest='keep_uint8', default=False, action='store_true',
+                        help='Keep images as uint8 until the model, which then normalises and makes greyscale. Uses 4x less host memory.')
     args = parser.parse_args()
 
     train_records_dir = args.train_records_dir
@@ -98,10 +110,16 @@ if __name__ == '__main__':
         train_records=train_records,
         test_records=test_records,
         shard_img_size=args.shard_img_size,
+        image_format=args.image_format,
+        compression_type=args.compression_type,
+        shard_channels=args.shard_channels,
         batch_size=args.batch_size,
         epochs=args.epochs,
         patience=args.patience,
+        validation_freq=args.validation_freq,
+        validation_steps=args.validation_steps,
         dropout_rate=args.dropout_rate,
         color=args.color,
         resize_size=args.resize_size,
+        keep_uint8=args.keep_uint8
     )
@@ -1,9 +1,10 @@
+import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 
 
 
-def get_multiquestion_loss(question_index_groups, reduction=tf.keras.losses.Reduction.SUM):
+def get_multiquestion_loss(question_index_groups, reduction=tf.keras.losses.Reduction.SUM, fused=False, sparse=False, masked=False):
     """
     Get subclass of tf.keras.losses.Loss which wraps ``calculate_multiquestion_loss`` and sums over batch.
 
@@ -13,15 +14,36 @@ def get_multiquestion_loss(question_index_groups, reduction=tf.keras.losses.Redu
 
     Args:
         question_index_groups (list): Answer indices for each question i.e. [(question.start_index, question.end_index), ...] for all questions. Useful for slicing model predictions by question.
+        fused (bool, optional): If True, wrap ``calculate_fused_multiquestion_loss`` instead, which calculates all questions at once and can be XLA compiled. Defaults to False.
+        sparse (bool, optional): If True, wrap ``calculate_sparse_multiquestion_loss`` instead, which skips questions with no votes. Useful for schemas combining several campaigns. Defaults to False.
+        masked (bool, optional): If True, labels have one extra column per question (after the answers, see schemas.Schema.question_mask_cols), 
+            used as ``question_mask`` for ``calculate_sparse_multiquestion_loss``. Requires sparse=True. Defaults to False.
+
+    Raises:
+        ValueError: fused and sparse both True, or masked without sparse
 
     Returns:
         MultiquestionLoss: see above.
     """
+    if fused and sparse:
+        raise ValueError('Choose either fused or sparse loss, not both')
+    if masked and not sparse:
+        raise ValueError('masked requires sparse=True')
+
+    if sparse:
+        loss_func = calculate_sparse_multiquestion_loss
+    elif fused:
+        loss_func = calculate_fused_multiquestion_loss
+    else:
+        loss_func = calculate_multiquestion_loss
 
     class MultiquestionLoss(tf.keras.losses.Loss):
 
         def call(self, labels, predictions):
-            return calculate_multiquestion_loss(labels, predictions, question_index_groups)
+            if masked:
+                labels, question_mask = split_question_mask(labels, len(question_index_groups))
+                return calculate_sparse_multiquestion_loss(labels, predictions, question_index_groups, question_mask=question_mask)
+            return loss_func(labels, predictions, question_index_groups)
 
     return MultiquestionLoss(reduction=reduction) 
 
@@ -59,6 +81,134 @@ def calculate_multiquestion_loss(labels, predictions, question_index_groups):
     # https://www.tensorflow.org/api_docs/python/tf/keras/losses/Loss will auto-reduce (sum) over the batch anyway
 
 
+def calculate_fused_multiquestion_loss(labels, predictions, question_index_groups):
+    """
+    Equivalent to :meth:`calculate_multiquestion_loss`, but calculates every question at once.
+
+    Instead of slicing out each question and building a tfp.distributions.DirichletMultinomial (with validation assertions on every step),
+    this writes out the Dirichlet-Multinomial log likelihood with ``tf.math.lgamma`` and sums the per-answer terms into per-question terms with ``tf.math.unsorted_segment_sum``.
+    There are no assertions or python loops over questions, so the whole loss can be fused by XLA (e.g. ``model.compile(..., jit_compile=True)``).
+
+    Args:
+        labels (tf.Tensor): (galaxy, k successes) where k successes dimension is indexed by question_index_groups.
+        predictions (tf.Tensor):  Dirichlet concentrations, matching shape of labels
+        question_index_groups (list): Paired (tuple) integers of (first, last) indices of answers to each question, listed for all questions.
+
+    Returns:
+        tf.Tensor: neg. log likelihood of shape (batch, question).
+    """
+    predictions = tf.convert_to_tensor(predictions)
+    labels = tf.cast(labels, predictions.dtype)
+    segment_ids = get_answer_segment_ids(question_index_groups, answers=predictions.shape[1])
+    num_questions = len(question_index_groups)
+
+    # per-answer terms of the log likelihood, shape (batch, answer)
+    answer_terms = tf.math.lgamma(labels + predictions) - tf.math.lgamma(predictions) - tf.math.lgamma(labels + 1.)
+
+    # unsorted_segment_sum works along the first axis, so sum with answers first and swap back to (batch, question)
+    def sum_by_question(x):
+        return tf.transpose(tf.math.unsorted_segment_sum(tf.transpose(x), segment_ids, num_segments=num_questions))
+
+    total_count = sum_by_question(labels)
+    total_concentration = sum_by_question(predictions)
+
+    log_prob = tf.math.lgamma(total_count + 1.) + tf.math.lgamma(total_concentration) - tf.math.lgamma(total_count + total_concentration) + sum_by_question(answer_terms)
+    return -log_prob  # important minus sign
+
+
+def calculate_sparse_multiquestion_loss(labels, predictions, question_index_groups, question_mask=None):
+    """
+    Equivalent to :meth:`calculate_fused_multiquestion_loss`, but only calculates the likelihood for questions which have votes.
+
+    With a schema combining several campaigns (e.g. ``label_metadata.decals_all_campaigns_ortho_pairs``), each galaxy only has votes for one campaign's questions.
+    The remaining questions have zero votes and hence zero neg. log likelihood, but the dense losses calculate them anyway.
+    Here, the answers of populated questions are gathered into a compact (flat) tensor, the likelihood is calculated on those,
+    and the results are scattered back into a (batch, question) tensor of zeros. Cost then scales with the votes present, not with the schema size.
+
+    Args:
+        labels (tf.Tensor): (galaxy, k successes) where k successes dimension is indexed by question_index_groups.
+        predictions (tf.Tensor):  Dirichlet concentrations, matching shape of labels
+        question_index_groups (list): Paired (tuple) integers of (first, last) indices of answers to each question, listed for all questions.
+        question_mask (tf.Tensor, optional): bool of shape (batch, question), True where that galaxy's question should be included e.g. questions from that galaxy's campaign. 
+            If None, include questions with any votes. Defaults to None.
+
+    Returns:
+        tf.Tensor: neg. log likelihood of shape (batch, question). Zero where ``question_mask`` is False.
+    """
+    predictions = tf.convert_to_tensor(predictions)
+    labels = tf.cast(labels, predictions.dtype)
+    segment_ids = get_answer_segment_ids(question_index_groups, answers=predictions.shape[1])
+    num_questions = len(question_index_groups)
+
+    if question_mask is None:
+        total_count_by_question = tf.transpose(tf.math.unsorted_segment_sum(tf.transpose(labels), segment_ids, num_segments=num_questions))
+        question_mask = total_count_by_question > 0
+    question_mask = tf.cast(question_mask, tf.bool)
+
+    # for each answer, is that galaxy's question included? Answers outside any question (segment id -1) point at an extra always-False column
+    padded_mask = tf.concat([question_mask, tf.zeros_like(question_mask[:, :1])], axis=1)
+    answer_mask = tf.gather(padded_mask, np.where(segment_ids < 0, num_questions, segment_ids), axis=1)
+
+    # gather the answers of included questions into a flat tensor
+    answer_indices = tf.where(answer_mask)  # (included answers, 2) of (galaxy, answer)
+    answer_labels = tf.gather_nd(labels, answer_indices)
+    answer_concentrations = tf.gather_nd(predictions, answer_indices)
+    answer_terms = tf.math.lgamma(answer_labels + answer_concentrations) - tf.math.lgamma(answer_concentrations) - tf.math.lgamma(answer_labels + 1.)
+
+    # index each included (galaxy, question) pair in the same (row-major) order as tf.where(question_mask)
+    flat_mask = tf.reshape(question_mask, [-1])
+    compact_question_ids = tf.cumsum(tf.cast(flat_mask, tf.int32)) - 1
+    answer_question_ids = tf.gather(
+        compact_question_ids,
+        tf.cast(answer_indices[:, 0], tf.int32) * num_questions + tf.gather(segment_ids, tf.cast(answer_indices[:, 1], tf.int32))
+    )
+    question_indices = tf.where(question_mask)  # (included questions, 2) of (galaxy, question)
+    num_included = tf.shape(question_indices)[0]
+
+    total_count = tf.math.unsorted_segment_sum(answer_labels, answer_question_ids, num_segments=num_included)
+    total_concentration = tf.math.unsorted_segment_sum(answer_concentrations, answer_question_ids, num_segments=num_included)
+    summed_answer_terms = tf.math.unsorted_segment_sum(answer_terms, answer_question_ids, num_segments=num_included)
+    log_prob = tf.math.lgamma(total_count + 1.) + tf.math.lgamma(total_concentration) - tf.math.lgamma(total_count + total_concentration) + summed_answer_terms
+
+    # scatter back, with zero neg. log prob (i.e. prob of 1) for excluded questions
+    return tf.scatter_nd(question_indices, -log_prob, shape=tf.shape(question_mask, out_type=tf.int64))
+
+
+def split_question_mask(labels, num_questions):
+    """
+    Split labels with question mask columns appended (see get_multiquestion_loss(masked=True)) into answer counts and question mask.
+
+    Args:
+        labels (tf.Tensor): of shape (batch, answers + questions)
+        num_questions (int): number of questions, i.e. of mask columns
+
+    Returns:
+        tf.Tensor: answer counts, of shape (batch, answers)
+        tf.Tensor: bool question mask, of shape (batch, questions)
+    """
+    return labels[:, :-num_questions], labels[:, -num_questions:] > 0
+
+
+def get_answer_segment_ids(question_index_groups, answers):
+    """
+    Label each answer (i.e. each column of labels/predictions) with the index of the question it belongs to.
+    Used by :meth:`calculate_fused_multiquestion_loss` to sum answers into questions with ``tf.math.unsorted_segment_sum``.
+
+    Columns not covered by any question get segment id -1, which unsorted_segment_sum drops.
+
+    Args:
+        question_index_groups (list): Paired (tuple) integers of (first, last) indices of answers to each question, listed for all questions.
+        answers (int): total number of answers (i.e. labels.shape[1])
+
+    Returns:
+        np.ndarray: int32 question index for each answer, of shape (answers)
+    """
+    segment_ids = np.full(answers, -1, dtype=np.int32)
+    for q_n, (q_start, q_end) in enumerate(question_index_groups):
+        segment_ids[q_start:q_end+1] = q_n
+    return segment_ids
+
+
 
 def dirichlet_loss(labels_for_q, concentrations_for_q):
     """
@@ -80,36 +230,8 @@ def dirichlet_loss(labels_for_q, concentrations_for_q):
     total_count = tf.reduce_sum(labels_for_q, axis=1)
 
     return get_dirichlet_neg_log_prob(labels_for_q, total_count, concentrations_for_q)
-
-
-    # # return tf.where(
-    # #     tf.math.equal(total_count, 0),  # if total_count is 0 (i.e. no votes)
-    # #     tf.constant(0.),  # prob is 1 and (neg) log prob is 0, with no gradients attached. broadcasts
-    # #     get_dirichlet_neg_log_prob(labels_for_q, total_count, concentrations_for_q)  # else, calculate neg log prob
-    # # )
-    # # # slightly inefficient as get_dirichlet_neg_log_prob forward pass done for all, but avoids gradients
-    # # # https://www.tensorflow.org/api_docs/python/tf/where
-    # # works great, but about 50% slower than optimal
-
-    # # indices_with_zero_counts = tf.where(tf.math.equal(total_count, 0))
-    # indices_with_nonzero_counts = tf.where(tf.math.logical_not(tf.math.equal(total_count, 0)))
-    
-    # # may potentially need to deal with the situation where there are 0 valid indices?
-
-    # total_counts_with_nonzero_counts = tf.gather(total_count, indices_with_nonzero_counts)
-    # labels_with_nonzero_counts = tf.gather(labels_for_q, indices_with_nonzero_counts)
-    # concentrations_with_nonzero_counts = tf.gather(concentrations_for_q, indices_with_nonzero_counts)
-    # neg_log_prob_of_indices_with_nonzero_counts = get_dirichlet_neg_log_prob(labels_with_nonzero_counts, total_counts_with_nonzero_counts, concentrations_with_nonzero_counts)
-
-    # # not needed, scatter_nd has 0 where no value is placed
-    # # neg_log_prob_of_indices_with_zero_counts = tf.zeros_like(indices_with_zero_counts)
-
-    # # now mix back together
-    # # indices and updates are both shape (<=N, 1)
-    # # so output shape must also be (N, 1) i.e. rank 1
-    # output_shape = tf.convert_to_tensor(value=(tf.size(total_count), 1), dtype=tf.int64)  # tf.size okay here as size=len for total_counts
-    # return tf.scatter_nd(indices_with_nonzero_counts, neg_log_prob_of_indices_with_nonzero_counts, shape=output_shape)
-
+    # galaxies with no votes for this question have zero neg. log prob (and zero gradients) anyway
+    # to skip computing them entirely, see calculate_sparse_multiquestion_loss
 
 
 def get_dirichlet_neg_log_prob(labels_for_q, total_count, concentrations_for_q):
@@ -8,7 +8,7 @@ import tensorflow as tf
 
 from zoobot.tensorflow.data_utils import tfrecord_datasets
 from zoobot.tensorflow.training import training_config, losses
-from zoobot.tensorflow.estimators import preprocess, define_model
+from zoobot.tensorflow.estimators import preprocess, define_model, custom_callbacks
 
 
 def train(
@@ -19,21 +19,34 @@ def train(
     train_records,
     test_records,
     shard_img_size=300,
+    image_format='raw',  # as saved, see create_shards.ShardConfig
+    compression_type=None,
+    shard_channels=3,  # 1 if saved as greyscale
     # model training parameters
     # only EfficientNet is currenty implemented
     batch_size=256,
     epochs=1000,
-    patience=8,
+    patience=8,  # epochs without improved val loss, however often validation runs
+    # validation parameters, see training_config.TrainConfig
+    validation_freq=1,
+    validation_steps=None,
+    validation_repeats=2,
+    steps_per_epoch=None,  # if set, patience counts epochs of this many batches unless tf.data knows the train dataset length
     dropout_rate=0.2,
+    sparse_loss=False,  # skip questions without votes, useful for schemas combining several campaigns
+    question_mask=False,  # instead, skip questions according to schema.question_mask_cols features saved in the shards. Requires sparse_loss.
     # augmentation parameters
     color=False,
     resize_size=224,
     # ideally, set shard_img_size * crop_factor ~= resize_size to skip resizing
     crop_factor=0.75,
     always_augment=False,
+    # keep images uint8 until the model, which then normalises and makes greyscale. 4x less host memory, same images.
+    keep_uint8=False,
     # hardware parameters
     gpus=2,
     eager=False,  # set True for easier debugging but slower training
+    monitor_throughput=False,  # record step times etc. to save_dir/throughput.jsonl, see custom_callbacks.ThroughputCallback
     # replication parameters
     random_state=42,  # TODO not yet implemented
 ):
@@ -47,13 +60,20 @@ def train(
         logging.warning(
             'Training on color images, not converting to greyscale')
         channels = 3
+        if shard_channels == 1:
+            raise ValueError('Cannot train on color images with greyscale shards')
+
+    # mask columns are loaded alongside the labels, and split off by the loss
+    label_cols = schema.label_cols + schema.question_mask_cols if question_mask else schema.label_cols
 
     preprocess_config = preprocess.PreprocessingConfig(
-        label_cols=schema.label_cols,
+        label_cols=label_cols,
         input_size=shard_img_size,
-        make_greyscale=greyscale,
+        make_greyscale=greyscale and not keep_uint8,
         # False for tfrecords with 0-1 floats, True for png/jpg with 0-255 uints
-        normalise_from_uint8=False
+        normalise_from_uint8=False,
+        input_channels=shard_channels,
+        keep_uint8=keep_uint8
     )
 
     assert save_dir is not None
@@ -72,9 +92,11 @@ def train(
         context_manager = contextlib.nullcontext()
 
     raw_train_dataset = tfrecord_datasets.get_tfrecord_dataset(
-        train_records, schema.label_cols, batch_size, shuffle=True, drop_remainder=True)
+        train_records, label_cols, batch_size, shuffle=True, drop_remainder=True, keep_uint8=keep_uint8,
+        image_format=image_format, compression_type=compression_type)
     raw_test_dataset = tfrecord_datasets.get_tfrecord_dataset(
-        test_records, schema.label_cols, batch_size, shuffle=False, drop_remainder=True)
+        test_records, label_cols, batch_size, shuffle=False, drop_remainder=True, keep_uint8=keep_uint8,
+        image_format=image_format, compression_type=compression_type)
 
     train_dataset = preprocess.preprocess_dataset(
         raw_train_dataset, preprocess_config)
@@ -90,11 +112,13 @@ def train(
             resize_size=resize_size,
             channels=channels,
             always_augment=always_augment,
-            dropout_rate=dropout_rate
+            dropout_rate=dropout_rate,
+            normalise_from_uint8=keep_uint8,
+            make_greyscale=greyscale and keep_uint8 and shard_channels == 3  # greyscale shards are already greyscale
         )
 
         multiquestion_loss = losses.get_multiquestion_loss(
-            schema.question_index_groups)
+            schema.question_index_groups, sparse=sparse_loss, masked=question_mask)
         # SUM reduction over loss, cannot divide by batch size on replicas when distributed training
         # so do it here instead
         def loss(x, y): return multiquestion_loss(x, y) / batch_size
@@ -108,14 +132,27 @@ def train(
     train_config = training_config.TrainConfig(
         log_dir=save_dir,
         epochs=epochs,
-        patience=patience
+        patience=patience,
+        validation_freq=validation_freq,
+        validation_steps=validation_steps,
+        validation_repeats=validation_repeats,
+        steps_per_epoch=steps_per_epoch
     )
 
+    extra_callbacks = []
+    if monitor_throughput:
+        extra_callbacks.append(custom_callbacks.ThroughputCallback(
+            batch_size=batch_size,
+            save_loc=os.path.join(save_dir, 'throughput.jsonl'),
+            example_batch=next(iter(train_dataset))
+        ))
+
     # inplace on model
     training_config.train_estimator(
         model,
         train_config,  # parameters for how to train e.g. epochs, patience
         train_dataset,
         test_dataset,
+        extra_callbacks=extra_callbacks,
         eager=eager
     )
@@ -26,15 +26,24 @@ class TrainConfig():
             self,
             epochs=1500,  # rely on earlystopping callback
             min_epochs=0,
-            patience=10,
+            patience=10,  # epochs (passes through train dataset) without improved val loss, however often validation runs. See get_validation_patience.
             log_dir='runs/default_run_{}'.format(time.time()),
-            save_freq='epoch'
+            save_freq='epoch',
+            # validation can be a large share of each epoch on big catalogs - these make it cheaper
+            validation_freq=1,  # validate every this many epochs
+            validation_steps=None,  # validate on only the first this many batches of the (unshuffled) test dataset. Defaults to all.
+            validation_repeats=2,  # validate on each batch this many times, to reduce variance from dropout and augmentations
+            steps_per_epoch=None  # if set, end each epoch (and so validate) after this many train batches, repeating the train dataset
     ): 
         self.epochs = epochs
         self.min_epochs = min_epochs
         self.patience = patience
         self.log_dir = log_dir
         self.save_freq = save_freq
+        self.validation_freq = validation_freq
+        self.validation_steps = validation_steps
+        self.validation_repeats = validation_repeats
+        self.steps_per_epoch = steps_per_epoch
 
 
     # TODO move to shared utilities
@@ -51,7 +60,8 @@ def train_estimator(model, train_config, train_dataset, test_dataset, extra_call
 
     Includes tensorboard logging (to log_dir/tensorboard).
     Includes checkpointing (named log_dir/checkpoint), with the rolling best val loss checkpoint saved.
-    Includes early stopping according to train_config.patience.
+    Includes early stopping according to train_config.patience (see get_validation_patience).
+    Validates according to train_config.validation_freq, validation_steps and validation_repeats (see get_validation_dataset).
 
     Args:
         model (tf.keras.Model): model to train. Must already be compiled with model.compile(loss, optimizer)
@@ -88,7 +98,8 @@ def train_estimator(model, train_config, train_dataset, test_dataset, extra_call
             save_freq=train_config.save_freq,
             save_best_only=True,
             save_weights_only=True),
-        tf.keras.callbacks.EarlyStopping(restore_best_weights=True, patience=train_config.patience),
+        # counts validations, not epochs
+        tf.keras.callbacks.EarlyStopping(restore_best_weights=True, patience=get_validation_patience(train_config, train_batches=get_train_batches(train_dataset))),
         tf.keras.callbacks.TerminateOnNaN(),
         custom_callbacks.UpdateStepCallback(
             batch_size=next(iter(train_dataset))[0].shape[0]  # grab the first batch, 0th tuple element (the images), 0th dimension, to check the batch size
@@ -111,9 +122,14 @@ def train_estimator(model, train_config, train_dataset, test_dataset, extra_call
             model.run_eagerly = True
         # https://www.tensorflow.org/api_docs/python/tf/keras/Model
 
+        if train_config.steps_per_epoch is not None:
+            train_dataset = train_dataset.repeat()  # epochs no longer line up with passes through the data
+
         model.fit(
             train_dataset,
-            validation_data=test_dataset.repeat(2),  # reduce variance from dropout, augs
+            validation_data=get_validation_dataset(test_dataset, train_config),
+            validation_freq=train_config.validation_freq,
+            steps_per_epoch=train_config.steps_per_epoch,
             epochs=train_config.epochs,
             callbacks=callbacks,
             verbose=verbose
@@ -126,3 +142,59 @@ def train_estimator(model, train_config, train_dataset, test_dataset, extra_call
     model.load_weights(checkpoint_name)  # inplace
 
     return model
+
+
+def get_train_batches(train_dataset):
+    """
+    Args:
+        train_dataset (tf.data.Dataset): yielding batches
+
+    Returns:
+        int: batches per pass through train_dataset, or None if tf.data can't tell without reading it (e.g. filtered tfrecords)
+    """
+    cardinality = int(train_dataset.cardinality())
+    if cardinality < 0:  # tf.data.UNKNOWN_CARDINALITY or tf.data.INFINITE_CARDINALITY
+        return None
+    return cardinality
+
+
+def get_validation_patience(train_config, train_batches=None):
+    """
+    Convert early stopping patience in epochs to patience in validations, which is what EarlyStopping counts.
+
+    With steps_per_epoch set, each Keras epoch is steps_per_epoch train batches rather than a pass through the train dataset.
+    train_batches (per pass) is then needed to convert - if unknown, patience instead counts Keras epochs of steps_per_epoch batches.
+
+    Args:
+        train_config (TrainConfig): with patience, validation_freq and steps_per_epoch
+        train_batches (int, optional): train batches per pass through train dataset, from get_train_batches. Defaults to None.
+
+    Returns:
+        int: validations without improvement before stopping
+    """
+    keras_epochs_per_epoch = 1
+    if train_config.steps_per_epoch is not None:
+        if train_batches is None:
+            logging.warning(
+                'Train batches per epoch unknown - early stopping patience will count epochs of steps_per_epoch ({}) batches'.format(train_config.steps_per_epoch))
+        else:
+            keras_epochs_per_epoch = train_batches / train_config.steps_per_epoch
+    return max(int(np.ceil(train_config.patience * keras_epochs_per_epoch / train_config.validation_freq)), 1)
+
+
+def get_validation_dataset(test_dataset, train_config):
+    """
+    Dataset to validate on, cut to train_config.validation_steps batches and repeated train_config.validation_repeats times.
+
+    The cut takes the first batches, so is only the same galaxies every validation if test_dataset is not shuffled (as in train_with_keras.py).
+
+    Args:
+        test_dataset (tf.data.Dataset): yielding batched tuples of (galaxy images, labels)
+        train_config (TrainConfig): validation_steps and validation_repeats to apply
+
+    Returns:
+        tf.data.Dataset: yielding batched tuples of (galaxy images, labels)
+    """
+    if train_config.validation_steps is not None:
+        test_dataset = test_dataset.take(train_config.validation_steps)
+    return test_dataset.repeat(train_config.validation_repeats)  # reduce variance from dropout, augs
@@ -0,0 +1,124 @@
+"""
+Run a frozen base model over every image once (or once per augmented view), and train new heads on the saved features.
+
+While the base model is frozen, the head only ever sees base model outputs - so there's no need to recompute them every epoch.
+Zoobot base models augment on every call (always_augment=True), so each view is a different random augmentation.
+Training the head then samples one view per galaxy per epoch, keeping most of the benefit of augmentation.
+
+Features are saved as a float32 .npy array of shape (view, galaxy, feature), as in zoobot.pytorch.transfer_learning.representations,
+with labels alongside (save_loc ending _labels.npy).
+"""
+import os
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+
+def cache_features(base_model, dataset, save_loc, n_views=5, pool=True):
+    """
+    Save base_model outputs for every galaxy in dataset, n_views times.
+
+    dataset must yield (images, labels) batches in the same order every iteration (i.e. not shuffled),
+    so that galaxy i is row i of every view.
+
+    Args:
+        base_model (tf.keras.Model): frozen (headless) base model e.g. from define_model.load_model(include_top=False)
+        dataset (tf.data.Dataset): batched (images, labels), not shuffled, e.g. from preprocess.preprocess_dataset
+        save_loc (str): path for .npy file of features, shape (n_views, galaxies, features). Labels saved alongside.
+        n_views (int, optional): passes over dataset. Defaults to 5.
+        pool (bool, optional): if True, global average pool base model outputs (e.g. (7, 7, 1280) to (1280)) before saving. Defaults to True.
+
+    Returns:
+        np.memmap: features, of shape (n_views, galaxies, features)
+        np.ndarray: labels, of shape (galaxies, ...)
+    """
+    @tf.function  # much faster than calling the model eagerly
+    def get_features(images):
+        batch_features = base_model(images, training=False)
+        if pool:
+            batch_features = tf.reduce_mean(batch_features, axis=[1, 2])
+        return batch_features
+
+    features_by_view = []
+    labels = None
+    for view in range(n_views):
+        logging.info('Caching features: view {} of {}'.format(view + 1, n_views))
+        view_features = []
+        view_labels = []
+        for images, batch_labels in dataset:
+            view_features.append(get_features(images).numpy().astype(np.float32))
+            if labels is None:  # labels are the same every view
+                view_labels.append(batch_labels.numpy())
+        features_by_view.append(np.concatenate(view_features))
+        if labels is None:
+            labels = np.concatenate(view_labels)
+
+    features = np.stack(features_by_view)
+    assert features.shape[1] == len(labels)
+    _save_atomic(get_labels_loc(save_loc), labels)
+    _save_atomic(save_loc, features)
+    logging.info('Saved features of shape {} to {}'.format(features.shape, save_loc))
+    return load_features(save_loc)
+
+
+def load_features(save_loc):
+    """
+    Args:
+        save_loc (str): .npy file saved by cache_features
+
+    Returns:
+        np.memmap: features, of shape (n_views, galaxies, features)
+        np.ndarray: labels, of shape (galaxies, ...)
+    """
+    return np.load(save_loc, mmap_mode='r'), np.load(get_labels_loc(save_loc))
+
+
+def get_labels_loc(save_loc):
+    return save_loc.replace('.npy', '') + '_labels.npy'
+
+
+def _save_atomic(save_loc, arr):
+    # write then rename, so an interrupted run never leaves a partial cache
+    with open(save_loc + '.tmp', 'wb') as f:
+        np.save(f, arr)
+    os.replace(save_loc + '.tmp', save_loc)
+
+
+def get_feature_dataset(features, labels, batch_size, shuffle=False, seed=None):
+    """
+    Dataset of (features, labels) batches from cached features, to train or evaluate a head.
+
+    Features are held in memory. When shuffling (i.e. training), each galaxy gets a random view each epoch.
+    Otherwise, features are averaged over views.
+
+    Args:
+        features (np.ndarray): of shape (view, galaxy, feature), from cache_features or load_features
+        labels (np.ndarray): of shape (galaxy, ...)
+        batch_size (int): batch size
+        shuffle (bool, optional): if True, shuffle galaxies and sample views each epoch. Defaults to False.
+        seed (int, optional): random seed for shuffle. Defaults to None.
+
+    Returns:
+        tf.data.Dataset: yielding (features, labels) batches
+    """
+    features = np.asarray(features, dtype=np.float32)
+    if not shuffle:
+        features = features.mean(axis=0, keepdims=True)
+    n_views, n_galaxies = features.shape[:2]
+    # captured by the map fn, rather than sliced with from_tensor_slices (whose graph constants are limited to 2GB)
+    features = tf.constant(features)
+    labels = tf.constant(labels)
+
+    def get_batch(indices):
+        if shuffle:
+            views = tf.random.uniform(tf.shape(indices), maxval=n_views, dtype=tf.int64)
+        else:
+            views = tf.zeros_like(indices)
+        return tf.gather_nd(features, tf.stack([views, indices], axis=1)), tf.gather(labels, indices)
+
+    dataset = tf.data.Dataset.range(n_galaxies)
+    if shuffle:
+        dataset = dataset.shuffle(n_galaxies, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size).map(get_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
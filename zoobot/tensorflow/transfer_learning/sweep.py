@@ -0,0 +1,224 @@
+"""
+Sweep new heads (architecture, dropout, train dataset size...) over fixed representations, in parallel.
+
+Training a head on fixed representations (see examples/finetune_on_fixed_representation.py) is small and single-core bound,
+so sweeping one configuration at a time leaves most cores idle.
+Instead, the representations are saved once as .npy files and memory-mapped by every worker process -
+the OS shares one copy in memory (page cache), rather than each process loading (or pickling) its own.
+Each worker trains one head at a time on one thread, so a pool of N workers keeps N cores busy.
+
+Results are appended to one csv (one row per configuration) as each head finishes.
+Configurations already in that csv are skipped, so an interrupted sweep can be resumed.
+"""
+import os
+import logging
+import itertools
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from tensorflow.keras import layers
+
+
+SPLITS = ['train', 'val', 'test']
+
+# set in each worker by _init_worker
+_WORKER_DATA = {}
+
+
+def save_sweep_data(data_dir, train, val, test):
+    """
+    Save representations and labels for each split, to be memory-mapped by the sweep workers.
+
+    Args:
+        data_dir (str): directory to save to
+        train (tuple): of (features, labels) for training galaxies. features of shape (galaxy, feature), labels of shape (galaxy)
+        val (tuple): as above, for validation galaxies (early stopping)
+        test (tuple): as above, for test galaxies (reported metrics)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    for split, (features, labels) in zip(SPLITS, [train, val, test]):
+        assert len(features) == len(labels)
+        np.save(os.path.join(data_dir, '{}_features.npy'.format(split)), np.asarray(features, dtype=np.float32))
+        np.save(os.path.join(data_dir, '{}_labels.npy'.format(split)), np.asarray(labels, dtype=np.float32))
+
+
+def load_sweep_data(data_dir):
+    """
+    Args:
+        data_dir (str): directory saved by save_sweep_data
+
+    Returns:
+        dict: of form {split: (features, labels)}, with features memory-mapped (read-only)
+    """
+    return dict([
+        (split, (
+            np.load(os.path.join(data_dir, '{}_features.npy'.format(split)), mmap_mode='r'),
+            np.load(os.path.join(data_dir, '{}_labels.npy'.format(split)))
+        ))
+        for split in SPLITS
+    ])
+
+
+def get_sweep_configs(head_types=['mlp'], dropout_rates=[0.75], dataset_sizes=[None], seeds=[0]):
+    """
+    Every combination of the given options, each as a dict to pass to train_head.
+
+    Args:
+        head_types (list, optional): 'linear' or 'mlp'. Defaults to ['mlp'].
+        dropout_rates (list, optional): dropout rate before each dense layer ('mlp' only). Defaults to [0.75].
+        dataset_sizes (list, optional): number of training galaxies to (randomly) select. None for all. Defaults to [None].
+        seeds (list, optional): random seeds for selecting training galaxies and initialising heads. Defaults to [0].
+
+    Returns:
+        list: of dicts like {'head_type': 'mlp', 'dropout_rate': 0.75, 'dataset_size': 1000, 'seed': 0, 'run_name': ...}
+    """
+    configs = []
+    for head_type, dropout_rate, dataset_size, seed in itertools.product(head_types, dropout_rates, dataset_sizes, seeds):
+        if head_type == 'linear' and dropout_rate != dropout_rates[0]:
+            continue  # dropout does not apply, would be a repeat
+        config = {'head_type': head_type, 'dropout_rate': dropout_rate, 'dataset_size': dataset_size, 'seed': seed}
+        config['run_name'] = '{head_type}_dropout{dropout_rate}_size{dataset_size}_seed{seed}'.format(**config)
+        configs.append(config)
+    return configs
+
+
+def run_sweep(data_dir, configs, results_loc, processes=None, batch_size=256, max_galaxies_to_show=5000000):
+    """
+    Train a head for each config in parallel, appending results to results_loc.
+
+    Args:
+        data_dir (str): directory saved by save_sweep_data
+        configs (list): of dicts, from get_sweep_configs
+        results_loc (str): csv to append results to. Configs with a run_name already in this csv are skipped.
+        processes (int, optional): worker processes. Defaults to None (one per cpu).
+        batch_size (int, optional): batch size for training heads. Defaults to 256.
+        max_galaxies_to_show (int, optional): sets epochs for each config, as in finetune_on_fixed_representation.py. Defaults to 5000000.
+
+    Returns:
+        pd.DataFrame: all results in results_loc, including any from previous sweeps
+    """
+    if os.path.isfile(results_loc):
+        completed = set(pd.read_csv(results_loc)['run_name'])
+        logging.info('Skipping {} configs already in {}'.format(len(completed.intersection([c['run_name'] for c in configs])), results_loc))
+        configs = [config for config in configs if config['run_name'] not in completed]
+
+    # largest datasets first, so the slowest heads don't start last and leave the other workers idle at the end
+    n_train = len(load_sweep_data(data_dir)['train'][1])
+    configs = sorted(configs, key=lambda config: config['dataset_size'] or n_train, reverse=True)
+
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(min(processes, len(configs)), 1)
+    logging.info('Sweeping {} configs over {} processes'.format(len(configs), processes))
+
+    kwargs = {'batch_size': batch_size, 'max_galaxies_to_show': max_galaxies_to_show}
+    # spawn, not fork - tensorflow is not fork-safe once initialised
+    with multiprocessing.get_context('spawn').Pool(processes=processes, initializer=_init_worker, initargs=(data_dir,)) as pool:
+        for result in pool.imap_unordered(_train_head_in_worker, [(config, kwargs) for config in configs]):
+            logging.info('{run_name}: test loss {test_loss:.4f}, test accuracy {test_accuracy:.3f} ({train_time:.1f}s)'.format(**result))
+            pd.DataFrame([result]).to_csv(results_loc, mode='a', header=not os.path.isfile(results_loc), index=False)
+
+    return pd.read_csv(results_loc)
+
+
+def _init_worker(data_dir):
+    # one thread per worker: the pool provides the parallelism
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    _WORKER_DATA.update(load_sweep_data(data_dir))
+
+
+def _train_head_in_worker(args):
+    config, kwargs = args
+    result = train_head(config, _WORKER_DATA, **kwargs)
+    tf.keras.backend.clear_session()  # don't accumulate graphs over many heads
+    return result
+
+
+def get_head(head_type, input_dim, dropout_rate=0.75):
+    """
+    New binary classification head, as in finetune_on_fixed_representation.py.
+
+    Args:
+        head_type (str): 'linear' (one sigmoid neuron) or 'mlp' (two dense layers with dropout, then one sigmoid neuron)
+        input_dim (int): representation dimension e.g. 1280
+        dropout_rate (float, optional): for 'mlp'. Defaults to 0.75.
+
+    Returns:
+        tf.keras.Sequential: head, not yet compiled
+    """
+    if head_type == 'linear':
+        hidden_layers = []
+    elif head_type == 'mlp':
+        hidden_layers = [
+            layers.Dense(64, activation='relu'),
+            layers.Dropout(dropout_rate),
+            layers.Dense(64, activation='relu'),
+            layers.Dropout(dropout_rate)
+        ]
+    else:
+        raise ValueError('head_type {} not recognised - expected linear or mlp'.format(head_type))
+    return tf.keras.Sequential(
+        [layers.InputLayer(input_shape=(input_dim,))] + hidden_layers + [layers.Dense(1, activation='sigmoid', name='sigmoid_output')]
+    )
+
+
+def train_head(config, data, batch_size=256, max_galaxies_to_show=5000000):
+    """
+    Train and evaluate one head, with early stopping on validation loss.
+
+    Args:
+        config (dict): from get_sweep_configs
+        data (dict): from load_sweep_data
+        batch_size (int, optional): Defaults to 256.
+        max_galaxies_to_show (int, optional): epochs = max_galaxies_to_show / dataset_size. Defaults to 5000000.
+
+    Returns:
+        dict: config, plus test_loss, test_accuracy, best_val_loss, epochs_trained, train_time
+    """
+    start_time = time.time()
+    train_features, train_labels = data['train']
+    val_features, val_labels = data['val']
+    test_features, test_labels = data['test']
+
+    dataset_size = config['dataset_size'] or len(train_labels)
+    assert dataset_size <= len(train_labels)
+    rng = np.random.default_rng(config['seed'])
+    # sorted indices read the memmap sequentially
+    train_indices = np.sort(rng.permutation(len(train_labels))[:dataset_size])
+    x, y = np.asarray(train_features[train_indices]), train_labels[train_indices]
+
+    epochs = max(int(max_galaxies_to_show / dataset_size), 1)
+    patience = min(max(10, int(epochs/6)), 30)
+
+    tf.keras.utils.set_random_seed(config['seed'])  # head initialisation
+    model = get_head(config['head_type'], input_dim=train_features.shape[1], dropout_rate=config['dropout_rate'])
+    model.compile(
+        loss=tf.keras.losses.binary_crossentropy,
+        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+        metrics=['accuracy']
+    )
+    history = model.fit(
+        x, y,
+        batch_size=batch_size,
+        epochs=epochs,
+        validation_data=(np.asarray(val_features), val_labels),
+        callbacks=[tf.keras.callbacks.EarlyStopping(restore_best_weights=True, patience=patience)],
+        verbose=0
+    )
+    # dropout is off when evaluating, so no need to repeat
+    test_loss, test_accuracy = model.evaluate(np.asarray(test_features), test_labels, batch_size=batch_size, verbose=0)
+
+    result = config.copy()
+    result.update({
+        'dataset_size': dataset_size,
+        'test_loss': float(test_loss),
+        'test_accuracy': float(test_accuracy),
+        'best_val_loss': float(np.min(history.history['val_loss'])),
+        'epochs_trained': len(history.history['val_loss']),
+        'train_time': time.time() - start_time
+    })
+    return result